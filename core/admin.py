@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Car, Owner, Outlay, OutlayAmount
+from .models import User, Car, Owner, Outlay, OutlayAmount, BackgroundJob, InvoiceBatch, CarCostMonthly
 from django.contrib.auth.admin import UserAdmin
 
 
@@ -21,6 +21,7 @@ class OwnerAdmin(admin.ModelAdmin):
 @admin.register(Outlay)
 class OutlayAdmin(admin.ModelAdmin):
     list_display = ["uuid", "type", "category", "description", "cars_list"]
+    raw_id_fields = ["invoice_item"]
 
     def cars_list(self, obj):
         return ", ".join(f"{car.mark} {car.model}" for car in obj.cars.all())
@@ -31,3 +32,21 @@ class OutlayAdmin(admin.ModelAdmin):
 @admin.register(OutlayAmount)
 class OutlayAmountAdmin(admin.ModelAdmin):
     list_display = ["uuid", "price_per_item", "item_count", "full_price"]
+
+
+@admin.register(CarCostMonthly)
+class CarCostMonthlyAdmin(admin.ModelAdmin):
+    list_display = ["car", "month", "type", "category", "total", "count"]
+    list_filter = ["type", "category"]
+    list_select_related = ["car"]
+
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ["uuid", "job_type", "status", "progress", "attempts", "created_at", "finished_at"]
+    list_filter = ["job_type", "status"]
+
+
+@admin.register(InvoiceBatch)
+class InvoiceBatchAdmin(admin.ModelAdmin):
+    list_display = ["uuid", "name", "created_at"]
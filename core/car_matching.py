@@ -0,0 +1,212 @@
+"""
+Matching of noisy invoice text (OCR'd VINs, partial VINs, spaced plates) to fleet cars.
+
+The index is built from all cars once per process and rebuilt when the fleet
+changes, see get_car_match_index().
+"""
+import logging
+import re
+import threading
+
+from django.db.models import Count, Max
+
+from .models import Car
+
+logger = logging.getLogger(__name__)
+
+# Characters OCR confuses with digits are folded to the digit on both sides of the comparison.
+# VINs never contain I, O or Q, so for VINs the folding is lossless.
+OCR_CANONICAL = str.maketrans("OQILZSB", "0011258")
+MAX_EDIT_DISTANCE = 2
+# Shorter tokens are too ambiguous for suffix / edit-distance matching
+MIN_SUFFIX_LENGTH = 6
+MIN_FUZZY_LENGTH = 7
+# Methods that can pick the wrong car of a fleet with similar VINs: such matches are
+# only suggested and booked once a user confirms them
+REVIEW_METHODS = {"suffix", "fuzzy"}
+
+TOKEN_RE = re.compile(r"[A-Z0-9]{5,}")
+WORD_SPLIT_RE = re.compile(r"[\s\-]+")
+_TERMINAL = None  # trie key holding the car uuids of a complete key
+
+
+def compact_key(value: str | None) -> str:
+    """'wx 1234-a ' -> 'WX1234A'"""
+    return WORD_SPLIT_RE.sub("", (value or "").upper())
+
+
+def canonical_key(value: str | None) -> str:
+    return compact_key(value).translate(OCR_CANONICAL)
+
+
+class CarMatchIndex:
+    """
+    In-memory lookup structures over fleet VINs and license plates:
+
+    - exact / canonical (OCR-folded) key -> car uuids
+    - VIN suffixes (MIN_SUFFIX_LENGTH and longer) -> car uuids
+    - a trie of canonical keys for Levenshtein search; VINs of one fleet share
+      long prefixes, so each shared prefix is compared with the query only once
+    """
+
+    def __init__(self, cars):
+        """cars: iterable of dicts with uuid, mark, model, year, vin_code, license_plate"""
+        self.car_names = {}
+        self.exact = {}
+        self.canonical = {}
+        self.suffixes = {}
+        self.trie = {}
+
+        for car in cars:
+            car_uuid = str(car["uuid"])
+            self.car_names[car_uuid] = f"{car['mark']} {car['model']} {car['year']}"
+
+            vin = compact_key(car["vin_code"])
+            for key in (vin, compact_key(car["license_plate"])):
+                if not key:
+                    continue
+                self.exact.setdefault(key, set()).add(car_uuid)
+                self.canonical.setdefault(key.translate(OCR_CANONICAL), set()).add(car_uuid)
+                self._trie_add(key.translate(OCR_CANONICAL), car_uuid)
+
+            canonical_vin = vin.translate(OCR_CANONICAL)
+            for length in range(MIN_SUFFIX_LENGTH, len(canonical_vin)):
+                self.suffixes.setdefault(canonical_vin[-length:], set()).add(car_uuid)
+
+    def __len__(self) -> int:
+        return len(self.car_names)
+
+    def _trie_add(self, key: str, car_uuid: str) -> None:
+        node = self.trie
+        for char in key:
+            node = node.setdefault(char, {})
+        node.setdefault(_TERMINAL, set()).add(car_uuid)
+
+    def _search_trie(self, word: str, max_distance: int) -> tuple[int, set]:
+        """Car uuids of the closest keys within max_distance edits of word, with that distance"""
+        size = len(word)
+        cap = max_distance + 1
+        best_distance = cap
+        best = set()
+        # Cells farther than max_distance from the diagonal can never be <= max_distance,
+        # so rows keep them at `cap` and only the band around the diagonal is computed
+        first_row = [min(i, cap) for i in range(size + 1)]
+        stack = [(char, child, first_row, 1) for char, child in self.trie.items() if char is not _TERMINAL]
+
+        while stack:
+            char, node, previous, depth = stack.pop()
+            row = [cap] * (size + 1)
+            row[0] = min(depth, cap)
+            row_min = row[0]
+            for i in range(max(1, depth - max_distance), min(size, depth + max_distance) + 1):
+                cell = previous[i - 1] if word[i - 1] == char else previous[i - 1] + 1
+                if previous[i] < cell:
+                    cell = previous[i] + 1
+                if row[i - 1] < cell:
+                    cell = row[i - 1] + 1
+                row[i] = cell
+                if cell < row_min:
+                    row_min = cell
+
+            # best_distance starts at `cap`: farther keys must never become a match
+            if _TERMINAL in node and row[size] <= max_distance and row[size] <= best_distance:
+                if row[size] < best_distance:
+                    best_distance, best = row[size], set()
+                best |= node[_TERMINAL]
+
+            if row_min <= min(best_distance, max_distance):
+                stack.extend(
+                    (next_char, child, row, depth + 1)
+                    for next_char, child in node.items() if next_char is not _TERMINAL
+                )
+
+        return best_distance, best
+
+    def _result(self, car_uuids: set, method: str, key: str, distance: int = 0) -> dict | None:
+        # Ambiguous matches are not guessed
+        if len(car_uuids) != 1:
+            return None
+        car_uuid = next(iter(car_uuids))
+        return {
+            "car_uuid": car_uuid,
+            "car_name": self.car_names[car_uuid],
+            "method": method,
+            "key": key,
+            "distance": distance,
+            "needs_review": method in REVIEW_METHODS,
+        }
+
+    def match(self, value: str | None, text: str = "") -> dict | None:
+        """
+        Find the car referenced by an invoice line.
+
+        Args:
+            value: VIN / plate token extracted by the parser (may be None)
+            text: full item name, searched for more tokens and spaced plates
+
+        Returns:
+            Dict with car_uuid, car_name, method (exact, plate, ocr, suffix, fuzzy),
+            key (the matched token), distance and needs_review, or None
+        """
+        upper_text = (text or "").upper()
+        value = compact_key(value)
+        tokens = [value] if value else []
+        for token in TOKEN_RE.findall(upper_text):
+            # Words like "DIESEL" are never a VIN or a plate
+            if token not in tokens and any(c.isdigit() for c in token):
+                tokens.append(token)
+
+        for token in tokens:
+            if token in self.exact:
+                return self._result(self.exact[token], "exact", token)
+
+        # Plates printed with spaces or dashes: "WX 1234A"
+        words = [w for w in WORD_SPLIT_RE.split(upper_text) if w]
+        for size in (2, 3):
+            for i in range(len(words) - size + 1):
+                joined = "".join(words[i:i + size])
+                if joined in self.exact:
+                    return self._result(self.exact[joined], "plate", joined)
+
+        canonical_tokens = [(token, token.translate(OCR_CANONICAL)) for token in tokens]
+        for token, canonical in canonical_tokens:
+            if canonical in self.canonical:
+                return self._result(self.canonical[canonical], "ocr", token)
+
+        for token, canonical in canonical_tokens:
+            if len(canonical) >= MIN_SUFFIX_LENGTH and canonical in self.suffixes:
+                return self._result(self.suffixes[canonical], "suffix", token)
+
+        # Single-character OCR errors are the common case and a radius-1 search
+        # visits a fraction of the trie, so widen the radius only when needed
+        for max_distance in range(1, MAX_EDIT_DISTANCE + 1):
+            for token, canonical in canonical_tokens:
+                if len(canonical) >= MIN_FUZZY_LENGTH:
+                    distance, car_uuids = self._search_trie(canonical, max_distance)
+                    if car_uuids:
+                        return self._result(car_uuids, "fuzzy", token, distance)
+
+        return None
+
+
+_index_lock = threading.Lock()
+_index_cache = {"stamp": None, "index": None}
+
+
+def get_car_match_index() -> CarMatchIndex:
+    """
+    Process-wide CarMatchIndex.
+
+    Each call checks a cheap fleet stamp (car count and last Car.updated_at),
+    so a car saved or deleted in any process - web or job worker - rebuilds the index.
+    """
+    stamp = Car.objects.aggregate(count=Count("pk"), last_updated=Max("updated_at"))
+    stamp = (stamp["count"], stamp["last_updated"])
+
+    with _index_lock:
+        if _index_cache["index"] is None or _index_cache["stamp"] != stamp:
+            cars = Car.objects.values("uuid", "mark", "model", "year", "vin_code", "license_plate")
+            _index_cache["index"] = CarMatchIndex(cars)
+            _index_cache["stamp"] = stamp
+            logger.info(f"Built car match index for {stamp[0]} cars")
+        return _index_cache["index"]
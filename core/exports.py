@@ -0,0 +1,452 @@
+"""
+Outlay exports for the finance team.
+
+Rows come from one .values() query over the outlay-car links, read with
+iterator(), and the workbook is written in openpyxl's write-only mode, so
+memory stays flat and the query count is constant whatever the row count.
+Fleet-wide exports run as background jobs (see run_outlay_export()) and
+are stored under EXPORTS_ROOT, outside the public media, for
+EXPORT_RETENTION_DAYS. Per-car CSV/TSV exports
+are streamed straight from a .values_list() cursor (see stream_car_csv()).
+"""
+import csv
+import io
+import os
+import re
+import tempfile
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Max
+from django.db.models.functions import Length
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+from .models import InvoiceItem, Outlay, OutlayCategoryChoice, OutlayTypeChoice, ServiceEvent
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+CSV_CONTENT_TYPE = "text/csv"
+EXPORT_FORMATS = {
+    "xlsx": XLSX_CONTENT_TYPE,
+    "csv": CSV_CONTENT_TYPE,
+}
+EXPORT_CHUNK_SIZE = 2000
+# Streamed exports: rows buffered per yielded chunk of the response body
+STREAM_ROWS_PER_CHUNK = 500
+CSV_DIALECTS = {
+    "csv": ("text/csv", ","),
+    "tsv": ("text/tab-separated-values", "\t"),
+}
+MAX_COLUMN_WIDTH = 50
+
+# Headers for Financial Director and Accountant
+OUTLAY_EXPORT_HEADERS = [
+    "Дата",
+    "Тип витрати",
+    "Категорія",
+    "Назва витрати",
+    "Сервіс",
+    "Автомобіль",
+    "VIN код",
+    "Номерний знак",
+    "Кількість",
+    "Ціна за одиницю (PLN)",
+    "Загальна сума (PLN)",
+    "ПДВ %",
+    "Сума ПДВ (PLN)",
+    "Коментар",
+    "Створено",
+    "Оновлено",
+]
+NUMERIC_COLUMNS = range(8, 13)  # Кількість .. Сума ПДВ (0-based)
+
+OUTLAY_EXPORT_FIELDS = (
+    "outlay__type", "outlay__category", "outlay__category_name", "outlay__name", "outlay__service_name",
+    "outlay__comment", "outlay__created_at", "outlay__updated_at",
+    "outlay__amount__price_per_item", "outlay__amount__item_count", "outlay__amount__full_price",
+    "car__mark", "car__model", "car__year", "car__vin_code", "car__license_plate",
+)
+
+TAX_PERCENT_RE = re.compile(r"ПДВ[:\s]+(\d+(?:\.\d+)?)", re.IGNORECASE)
+TYPE_LABELS = dict(OutlayTypeChoice.choices)
+CATEGORY_LABELS = dict(OutlayCategoryChoice.choices)
+CENT = Decimal("0.01")
+# Leading characters spreadsheets evaluate as a formula (plus tab / CR, OWASP CSV injection)
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def outlay_export_links(**filters):
+    """
+    Outlay-car links to export, oldest outlay first: one row per outlay and car,
+    so every row knows its car without a query per outlay.
+    """
+    return Outlay.cars.through.objects.filter(**filters).order_by("outlay__created_at", "outlay_id")
+
+
+def outlay_export_row(link: dict) -> list:
+    """Spreadsheet row of one outlay_export_links().values(*OUTLAY_EXPORT_FIELDS) dict"""
+    price_per_item = link["outlay__amount__price_per_item"] or None
+    item_count = link["outlay__amount__item_count"] or None
+    total_price = link["outlay__amount__full_price"] or None
+
+    # Priority: use what's stored, derive the missing one of total / unit price / count
+    if not total_price and price_per_item and item_count:
+        total_price = price_per_item * item_count
+    if not price_per_item and total_price and item_count:
+        price_per_item = (total_price / item_count).quantize(CENT)
+    if not item_count and total_price and price_per_item:
+        item_count = (total_price / price_per_item).quantize(CENT)
+
+    comment = link["outlay__comment"] or ""
+    tax_match = TAX_PERCENT_RE.search(comment) if comment else None
+    tax_percent = Decimal(tax_match.group(1)) if tax_match else None
+
+    category = link["outlay__category"]
+    category_display = CATEGORY_LABELS.get(category, category) if category else link["outlay__category_name"] or ""
+    created_at, updated_at = link["outlay__created_at"], link["outlay__updated_at"]
+    has_car = link["car__mark"] is not None
+
+    return [
+        created_at.strftime("%d.%m.%Y") if created_at else "",
+        TYPE_LABELS.get(link["outlay__type"], link["outlay__type"]),
+        category_display,
+        link["outlay__name"] or "",
+        link["outlay__service_name"] or "",
+        f"{link['car__mark']} {link['car__model']} {link['car__year']}" if has_car else "",
+        link["car__vin_code"] or "",
+        link["car__license_plate"] or "",
+        item_count or "",
+        price_per_item or "",
+        total_price or "",
+        tax_percent or "",
+        "",  # Tax amount is not stored per outlay
+        comment,
+        created_at.strftime("%d.%m.%Y %H:%M") if created_at else "",
+        updated_at.strftime("%d.%m.%Y %H:%M") if updated_at else "",
+    ]
+
+
+def csv_safe_row(row) -> list:
+    """Row with text cells that would start a formula prefixed by a quote, numbers are left as they are"""
+    return [
+        f"'{value}" if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES) else value
+        for value in row
+    ]
+
+
+def outlay_export_widths(links) -> list[float]:
+    """
+    Column widths (longest value + 2, at most MAX_COLUMN_WIDTH).
+
+    Write-only sheets emit column widths before the first row, so text columns are
+    measured with one MAX(LENGTH()) aggregate over the same links instead of a pass
+    over the written rows; dates and labels have known lengths, numbers use the header.
+    """
+    longest = links.aggregate(
+        category_len=Max(Length("outlay__category_name")),
+        name_len=Max(Length("outlay__name")),
+        service_len=Max(Length("outlay__service_name")),
+        car_len=Max(Length("car__mark") + Length("car__model")),
+        vin_len=Max(Length("car__vin_code")),
+        plate_len=Max(Length("car__license_plate")),
+        comment_len=Max(Length("outlay__comment")),
+    )
+    content = [
+        10,
+        max(map(len, TYPE_LABELS.values())),
+        max(longest["category_len"] or 0, *map(len, CATEGORY_LABELS.values())),
+        longest["name_len"] or 0,
+        longest["service_len"] or 0,
+        (longest["car_len"] or 0) + 6,  # "mark model year"
+        longest["vin_len"] or 0,
+        longest["plate_len"] or 0,
+        0, 0, 0, 0, 0,
+        longest["comment_len"] or 0,
+        16,
+        16,
+    ]
+    return [
+        min(max(len(header), length) + 2, MAX_COLUMN_WIDTH)
+        for header, length in zip(OUTLAY_EXPORT_HEADERS, content, strict=True)
+    ]
+
+
+def _named_styles() -> list[NamedStyle]:
+    border = Border(left=Side(style="thin"), right=Side(style="thin"), top=Side(style="thin"), bottom=Side(style="thin"))
+    return [
+        NamedStyle(
+            name="outlay_header",
+            font=Font(bold=True, color="FFFFFF", size=12),
+            fill=PatternFill(start_color="366092", end_color="366092", fill_type="solid"),
+            alignment=Alignment(horizontal="center", vertical="center"),
+            border=border,
+        ),
+        NamedStyle(name="outlay_text", alignment=Alignment(horizontal="left", vertical="center"), border=border),
+        NamedStyle(name="outlay_number", alignment=Alignment(horizontal="right", vertical="center"), border=border),
+    ]
+
+
+def _report_progress(progress, rows: int, total: int | None) -> None:
+    if progress and total and rows % EXPORT_CHUNK_SIZE == 0:
+        progress(min(99, rows * 100 // total), f"Записано рядків: {rows} з {total}")
+
+
+def write_outlays_xlsx(links, file, sheet_title: str = "Витрати", progress=None, total: int | None = None) -> int:
+    """
+    Write outlay_export_links() to `file` (path or binary file object) as an .xlsx
+    workbook in one pass over the rows. Returns the number of data rows.
+
+    progress(percent, message) is called once per chunk when the expected `total` is known.
+    """
+    wb = Workbook(write_only=True)
+    for style in _named_styles():
+        wb.add_named_style(style)
+    ws = wb.create_sheet(sheet_title)
+
+    for index, width in enumerate(outlay_export_widths(links), 1):
+        ws.column_dimensions[get_column_letter(index)].width = width
+    ws.freeze_panes = "A2"
+
+    def style_array(style_name):
+        cell = WriteOnlyCell(ws)
+        cell.style = style_name
+        return cell._style
+
+    def styled(values, styles):
+        # Resolving a named style per cell costs more than writing the cell; share the resolved
+        # style arrays instead (they are only read when the row is written)
+        cells = []
+        for value, style in zip(values, styles, strict=True):
+            cell = WriteOnlyCell(ws, value=value)
+            cell._style = style
+            cells.append(cell)
+        return cells
+
+    header_style = style_array("outlay_header")
+    ws.append(styled(OUTLAY_EXPORT_HEADERS, [header_style] * len(OUTLAY_EXPORT_HEADERS)))
+
+    text_style, number_style = style_array("outlay_text"), style_array("outlay_number")
+    row_styles = [
+        number_style if index in NUMERIC_COLUMNS else text_style for index in range(len(OUTLAY_EXPORT_HEADERS))
+    ]
+    rows = 0
+    for link in links.values(*OUTLAY_EXPORT_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        ws.append(styled(outlay_export_row(link), row_styles))
+        rows += 1
+        _report_progress(progress, rows, total)
+
+    wb.save(file)
+    return rows
+
+
+def write_outlays_csv(links, file, progress=None, total: int | None = None) -> int:
+    """
+    Write outlay_export_links() to the text file object `file` as CSV, same columns
+    as the workbook. Open it with newline="" and encoding="utf-8-sig" (the BOM makes
+    Excel read the Ukrainian headers correctly). Returns the number of data rows.
+    """
+    writer = csv.writer(file)
+    writer.writerow(OUTLAY_EXPORT_HEADERS)
+
+    rows = 0
+    for link in links.values(*OUTLAY_EXPORT_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        writer.writerow(csv_safe_row(outlay_export_row(link)))
+        rows += 1
+        _report_progress(progress, rows, total)
+    return rows
+
+
+def fleet_export_links(filters: dict):
+    """
+    outlay_export_links() of a fleet export job payload: optional "date_from" and
+    "date_to" (ISO dates, inclusive), "owner" (Owner uuid), "type" and "category".
+    """
+    lookups = {}
+    if filters.get("date_from"):
+        lookups["outlay__created_at__date__gte"] = filters["date_from"]
+    if filters.get("date_to"):
+        lookups["outlay__created_at__date__lte"] = filters["date_to"]
+    if filters.get("owner"):
+        lookups["car__owner_id"] = filters["owner"]
+    if filters.get("type"):
+        lookups["outlay__type"] = filters["type"]
+    if filters.get("category"):
+        lookups["outlay__category"] = filters["category"]
+    return outlay_export_links(**lookups)
+
+
+def fleet_export_filename(filters: dict, fmt: str) -> str:
+    """Download name of a fleet export, e.g. Витрати_2025-01-01_2025-03-31.xlsx"""
+    period = "_".join(filter(None, [filters.get("date_from"), filters.get("date_to")])) or "усі"
+    return f"Витрати_{period}.{fmt}"
+
+
+def purge_old_exports() -> int:
+    """
+    Delete export files (and .part leftovers of crashed jobs) older than
+    EXPORT_RETENTION_DAYS from EXPORTS_ROOT.
+
+    Returns:
+        Number of deleted files
+    """
+    cutoff = time.time() - settings.EXPORT_RETENTION_DAYS * 86400
+    expired = [
+        path for path in Path(settings.EXPORTS_ROOT).glob("*")
+        if path.is_file() and path.stat().st_mtime < cutoff
+    ]
+
+    deleted = 0
+    for path in expired:
+        try:
+            path.unlink()
+            deleted += 1
+        except FileNotFoundError:
+            # Purged by a concurrent export job
+            pass
+    return deleted
+
+
+def run_outlay_export(export_id, filters: dict, fmt: str, progress=None) -> dict:
+    """
+    Write a fleet export to EXPORTS_ROOT/<export_id>.<fmt>, purging expired exports first.
+
+    The file is written next to its final path and renamed into place, so a retried
+    or crashed job never leaves a half-written export behind the download link.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+
+    purge_old_exports()
+
+    links = fleet_export_links(filters)
+    total = links.count()
+    if progress:
+        progress(0, f"Рядків для експорту: {total}")
+
+    export_dir = Path(settings.EXPORTS_ROOT)
+    export_dir.mkdir(parents=True, exist_ok=True)
+    file_path = export_dir / f"{export_id}.{fmt}"
+
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(dir=export_dir, suffix=".part", delete=False) as tmp:
+            tmp_path = tmp.name
+            if fmt == "xlsx":
+                rows = write_outlays_xlsx(links, tmp, progress=progress, total=total)
+            else:
+                with io.TextIOWrapper(tmp, encoding="utf-8-sig", newline="") as file:
+                    rows = write_outlays_csv(links, file, progress=progress, total=total)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if tmp_path:
+            os.unlink(tmp_path)
+        raise
+
+    return {
+        "file_path": str(file_path.relative_to(export_dir)),
+        "filename": fleet_export_filename(filters, fmt),
+        "format": fmt,
+        "rows": rows,
+        "size": file_path.stat().st_size,
+    }
+
+
+INVOICE_ITEM_CSV_HEADERS = [
+    "Фактура", "Дата фактури", "ID", "Назва товару", "Кількість", "Ціна нетто", "Ціна нетто 2",
+    "ПДВ %", "Сума ПДВ", "Ціна брутто", "VIN автомобіля",
+]
+SERVICE_EVENT_CSV_HEADERS = [
+    "Тип сервісу", "Пробіг, км", "Наступний сервіс, км", "Останній сервіс, км", "Інтервал, км",
+    "Дата", "Статус", "Виконано", "Створено",
+]
+
+
+def car_outlay_csv_rows(car):
+    for link in outlay_export_links(car=car).values(*OUTLAY_EXPORT_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield outlay_export_row(link)
+
+
+def car_invoice_item_csv_rows(car):
+    """Invoice lines booked as outlays of the car"""
+    items = (
+        InvoiceItem.objects
+        .filter(pk__in=Outlay.objects.filter(cars=car, invoice_item__isnull=False).values("invoice_item"))
+        .order_by("invoice__created_at", "invoice_id", "item_id")
+        .values_list(
+            "invoice__name", "invoice__created_at", "item_id", "item_name", "amount", "price_netto",
+            "price_netto2", "tax_percent", "tax_price", "price_brutto", "current_car_vin",
+        )
+    )
+    for (invoice_name, invoice_created_at, *values) in items.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield [
+            invoice_name,
+            invoice_created_at.strftime("%d.%m.%Y"),
+            *("" if value is None else value for value in values),
+        ]
+
+
+def car_service_event_csv_rows(car):
+    events = (
+        ServiceEvent.objects
+        .filter(car=car)
+        .order_by("date", "id")
+        .values_list(
+            "service_type", "mileage_km", "next_service_km", "last_service_km", "interval_km",
+            "date", "status", "is_completed", "created_at",
+        )
+    )
+    for (*values, date, status, is_completed, created_at) in events.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield [
+            *values,
+            date.strftime("%d.%m.%Y"),
+            status,
+            "Так" if is_completed else "Ні",
+            created_at.strftime("%d.%m.%Y %H:%M"),
+        ]
+
+
+# dataset -> (file name prefix, headers, rows of a car)
+CAR_CSV_DATASETS = {
+    "outlays": ("Витрати", OUTLAY_EXPORT_HEADERS, car_outlay_csv_rows),
+    "invoice-items": ("Позиції_фактур", INVOICE_ITEM_CSV_HEADERS, car_invoice_item_csv_rows),
+    "service-events": ("Сервісні_події", SERVICE_EVENT_CSV_HEADERS, car_service_event_csv_rows),
+}
+
+
+def stream_csv(headers: list, rows, delimiter: str = ","):
+    """
+    Encoded CSV body for StreamingHttpResponse: BOM and header line first, so the
+    download starts before the query has run, then rows in STREAM_ROWS_PER_CHUNK batches.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=delimiter)
+
+    def flush() -> bytes:
+        data = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    writer.writerow(headers)
+    yield "\ufeff".encode("utf-8") + flush()
+
+    pending = 0
+    for row in rows:
+        writer.writerow(csv_safe_row(row))
+        pending += 1
+        if pending == STREAM_ROWS_PER_CHUNK:
+            yield flush()
+            pending = 0
+    if pending:
+        yield flush()
+
+
+def stream_car_csv(car, dataset: str, fmt: str = "csv"):
+    """(content type, file name prefix, body iterator) of a per-car CSV/TSV export"""
+    content_type, delimiter = CSV_DIALECTS[fmt]
+    prefix, headers, rows = CAR_CSV_DATASETS[dataset]
+    return content_type, prefix, stream_csv(headers, rows(car), delimiter)
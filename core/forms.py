@@ -3,6 +3,7 @@ from .models import (
     Car, 
     Owner, 
     OutlayCategoryChoice, 
+    OutlayTypeChoice,
     Service, 
     CarServiceState,
     InvoiceItem
@@ -506,6 +507,99 @@ class InvoiceUploadForm(forms.Form):
     )
 
 
+class OutlayExportForm(forms.Form):
+    date_from = forms.DateField(
+        required=False,
+        label='Дата з',
+        widget=forms.DateInput(attrs={"type": "date", "class": "border_input w-full"})
+    )
+    date_to = forms.DateField(
+        required=False,
+        label='Дата по',
+        widget=forms.DateInput(attrs={"type": "date", "class": "border_input w-full"})
+    )
+    owner = forms.ModelChoiceField(
+        queryset=Owner.objects.all(),
+        required=False,
+        label='Власник',
+        empty_label='Усі власники',
+        widget=forms.Select(attrs={"class": "border_input w-full"})
+    )
+    type = forms.ChoiceField(
+        required=False,
+        label='Тип витрати',
+        choices=[('', 'Усі типи')] + OutlayTypeChoice.choices,
+        widget=forms.Select(attrs={"class": "border_input w-full"})
+    )
+    category = forms.ChoiceField(
+        required=False,
+        label='Підкатегорія',
+        choices=[('', 'Усі підкатегорії')] + OutlayCategoryChoice.choices,
+        widget=forms.Select(attrs={"class": "border_input w-full"})
+    )
+    format = forms.ChoiceField(
+        required=True,
+        label='Формат',
+        choices=[('xlsx', 'Excel (XLSX)'), ('csv', 'CSV')],
+        widget=forms.RadioSelect(attrs={"class": "service-radio"}),
+        initial='xlsx',
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from = cleaned_data.get("date_from")
+        date_to = cleaned_data.get("date_to")
+
+        if date_from and date_to and date_from > date_to:
+            self.add_error("date_to", "Дата по не може бути раніше дати з.")
+        return cleaned_data
+
+    def get_filters(self) -> dict:
+        """JSON-serializable filters for the export job payload"""
+        data = self.cleaned_data
+        return {
+            "date_from": data["date_from"].isoformat() if data.get("date_from") else None,
+            "date_to": data["date_to"].isoformat() if data.get("date_to") else None,
+            "owner": str(data["owner"].pk) if data.get("owner") else None,
+            "type": data.get("type") or None,
+            "category": data.get("category") or None,
+        }
+
+
+class MultipleFileField(forms.FileField):
+    """FileField accepting several files, cleaned value is a list"""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("widget", MultipleFileInput())
+        super().__init__(*args, **kwargs)
+
+    def clean(self, data, initial=None):
+        single_file_clean = super().clean
+        if isinstance(data, (list, tuple)):
+            return [single_file_clean(file, initial) for file in data]
+        return [single_file_clean(data, initial)]
+
+
+class InvoiceBatchUploadForm(forms.Form):
+    files = MultipleFileField(
+        label='PDF файли або ZIP архів',
+        required=True,
+        widget=MultipleFileInput(attrs={
+            'accept': '.pdf,.zip',
+            'class': 'border_input w-full'
+        })
+    )
+    name = forms.CharField(
+        label='Назва пакету',
+        required=False,
+        max_length=100,
+        widget=forms.TextInput(attrs={
+            'class': 'border_input w-full',
+            'placeholder': 'Назва пакету (необов\'язково)'
+        })
+    )
+
+
 class InvoiceItemForm(forms.ModelForm):
     class Meta:
         model = InvoiceItem
@@ -0,0 +1,125 @@
+"""
+Synthetic invoices in the layout PDFCore supports, for parser benchmarks.
+"""
+from decimal import Decimal
+from pathlib import Path
+import random
+
+import pymupdf
+
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+ROW_HEIGHT = 16
+# x positions of the vertical table rules: LP, name, qty, netto, netto2, VAT %, VAT, brutto
+COLUMNS = (30, 55, 255, 290, 345, 400, 435, 495, 565)
+HEADERS = ("LP", "Nazwa", "Ilość", "Wartość netto", "Po rabacie", "VAT %", "Kwota VAT", "Wartość brutto")
+FONT_NAME = "F0"
+
+
+def format_pl(value: Decimal) -> str:
+    """Decimal('1100.5') -> '1 100,50'"""
+    integer, fraction = f"{value:.2f}".split(".")
+    groups = []
+    while integer:
+        groups.insert(0, integer[-3:])
+        integer = integer[:-3]
+    return f"{' '.join(groups)},{fraction}"
+
+
+def _text(shape, x: float, y: float, value: str, size: float = 7) -> None:
+    shape.insert_text((x, y), value, fontsize=size, fontname=FONT_NAME)
+
+
+def make_synthetic_invoice(
+    path: str | Path,
+    pages: int = 1,
+    rows_per_page: int = 40,
+    vins: list[str] | None = None,
+    seed: int = 0,
+) -> dict:
+    """
+    Write a ruled-table fuel invoice to `path`.
+
+    Returns dict with expected values: rows, total_brutto (Decimal).
+    """
+    rnd = random.Random(seed)
+    vins = vins or [f"WF0XXXGCDX{n:07d}" for n in range(50)]
+    font = pymupdf.Font("cjk")  # built-in font with Polish glyphs
+    doc = pymupdf.open()
+
+    lp = 1
+    total = Decimal("0")
+    total_netto = Decimal("0")
+    total_vat = Decimal("0")
+
+    for page_index in range(pages):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        page.insert_font(fontname=FONT_NAME, fontbuffer=font.buffer)
+        # One content stream commit per page: page.insert_text/draw_line commit on every
+        # call, which makes generating a page quadratic in the number of cells
+        shape = page.new_shape()
+        y = 40
+
+        if page_index == 0:
+            for line in (
+                "Faktura numer FV/2024/01/0001",
+                "Data wystawienia: Puchały, 2024-01-31",
+                "Data sprzedaży: 2024-01-31",
+                "Termin płatności: 2024-02-14",
+                "Płatność: PRZELEW",
+                "NIP 1234567890 BDO 000123456",
+            ):
+                _text(shape, 30, y, line, size=9)
+                y += 14
+            y += 10
+
+        table_rows = rows_per_page + 1
+        for r in range(table_rows + 1):
+            shape.draw_line((COLUMNS[0], y + r * ROW_HEIGHT), (COLUMNS[-1], y + r * ROW_HEIGHT))
+        for x in COLUMNS:
+            shape.draw_line((x, y), (x, y + table_rows * ROW_HEIGHT))
+        shape.finish(color=(0, 0, 0), width=1)
+        for col, header in enumerate(HEADERS):
+            _text(shape, COLUMNS[col] + 2, y + 11, header, size=5)
+
+        for r in range(rows_per_page):
+            qty = rnd.randint(1, 80)
+            netto = Decimal(rnd.randint(500, 50000)) / 100 * qty
+            vat = (netto * Decimal("0.23")).quantize(Decimal("0.01"))
+            brutto = netto + vat
+            total += brutto
+            total_netto += netto
+            total_vat += vat
+
+            values = (
+                str(lp),
+                f"Olej napędowy ON {rnd.choice(vins)}",
+                str(qty),
+                format_pl(netto),
+                format_pl(netto),
+                "23",
+                format_pl(vat),
+                format_pl(brutto),
+            )
+            for col, value in enumerate(values):
+                _text(shape, COLUMNS[col] + 2, y + (r + 1) * ROW_HEIGHT + 11, value)
+            lp += 1
+
+        if page_index == pages - 1:
+            y += table_rows * ROW_HEIGHT + 20
+            for line in (
+                f"Wartość netto {format_pl(total_netto)} PLN",
+                f"Wartość VAT {format_pl(total_vat)} PLN",
+                f"Wartość brutto {format_pl(total)} PLN",
+                f"Do zapłaty {format_pl(total)} PLN",
+            ):
+                _text(shape, 300, y, line, size=9)
+                y += 14
+
+        shape.commit()
+
+    doc.subset_fonts()
+    doc.save(str(path), garbage=3, deflate=True)
+    doc.close()
+
+    return {"rows": lp - 1, "total_brutto": total}
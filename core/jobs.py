@@ -0,0 +1,212 @@
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import (
+    BackgroundJob,
+    BackgroundJobStatusChoice,
+    BackgroundJobTypeChoice,
+    Invoice,
+    InvoiceStatusChoice,
+)
+from .services import InvoiceParseError, parse_invoice
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before the next attempt: attempt 1 -> 30s, 2 -> 120s, ...
+RETRY_BACKOFF_SECONDS = 30
+# RUNNING jobs not touched for this long are considered abandoned by a dead worker
+STALE_JOB_TIMEOUT = timedelta(minutes=15)
+# How often a polling worker looks for abandoned jobs
+STALE_JOB_CHECK_INTERVAL = timedelta(minutes=1)
+
+
+class JobFailed(Exception):
+    """Permanent job failure, the job is not retried"""
+
+
+class WorkerShutdown(BaseException):
+    """
+    Raised in a worker on SIGTERM. A BaseException, so run_job() does not record it
+    as a job failure; the worker releases the interrupted job instead.
+    """
+
+
+def enqueue_job(job_type: str, payload: dict | None = None, invoice: Invoice | None = None) -> BackgroundJob:
+    return BackgroundJob.objects.create(
+        job_type=job_type,
+        payload=payload or {},
+        invoice=invoice,
+    )
+
+
+def enqueue_invoice_parse(invoice: Invoice) -> BackgroundJob:
+    return enqueue_job(BackgroundJobTypeChoice.INVOICE_PARSE, invoice=invoice)
+
+
+def enqueue_invoice_parses(invoices: list[Invoice]) -> list[BackgroundJob]:
+    """Parse jobs of a whole upload batch in one INSERT"""
+    return BackgroundJob.objects.bulk_create(
+        BackgroundJob(job_type=BackgroundJobTypeChoice.INVOICE_PARSE, invoice=invoice)
+        for invoice in invoices
+    )
+
+
+def enqueue_outlay_export(filters: dict, fmt: str) -> BackgroundJob:
+    """Fleet export, written by a job worker so large exports never hold a web worker"""
+    return enqueue_job(BackgroundJobTypeChoice.OUTLAY_EXPORT, payload={"filters": filters, "format": fmt})
+
+
+def claim_next_job(worker_id: str, job_types: list[str] | None = None) -> BackgroundJob | None:
+    """
+    Lock and mark as RUNNING the oldest queued job.
+    SKIP LOCKED lets several workers poll the same table without blocking each other.
+    """
+    with transaction.atomic():
+        qs = (
+            BackgroundJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=BackgroundJobStatusChoice.QUEUED, run_after__lte=timezone.now())
+            .order_by("run_after", "created_at")
+        )
+        if job_types:
+            qs = qs.filter(job_type__in=job_types)
+
+        job = qs.first()
+        if job is None:
+            return None
+
+        job.status = BackgroundJobStatusChoice.RUNNING
+        job.attempts += 1
+        job.started_at = timezone.now()
+        job.locked_by = worker_id
+        job.error = ""
+        job.save(update_fields=["status", "attempts", "started_at", "locked_by", "error", "updated_at"])
+
+    return job
+
+
+def requeue_stale_jobs() -> int:
+    """Return jobs of crashed workers back to the queue"""
+    deadline = timezone.now() - STALE_JOB_TIMEOUT
+    return BackgroundJob.objects.filter(
+        status=BackgroundJobStatusChoice.RUNNING,
+        updated_at__lt=deadline,
+    ).update(
+        status=BackgroundJobStatusChoice.QUEUED,
+        locked_by="",
+        updated_at=timezone.now(),
+    )
+
+
+def release_job(job: BackgroundJob) -> bool:
+    """
+    Return a job interrupted by a worker shutdown to the queue right away, without
+    waiting for STALE_JOB_TIMEOUT. The interrupted attempt does not count.
+    """
+    return bool(BackgroundJob.objects.filter(
+        pk=job.pk,
+        status=BackgroundJobStatusChoice.RUNNING,
+        locked_by=job.locked_by,
+    ).update(
+        status=BackgroundJobStatusChoice.QUEUED,
+        attempts=max(job.attempts - 1, 0),
+        locked_by="",
+        progress=0,
+        progress_message="",
+        updated_at=timezone.now(),
+    ))
+
+
+def handle_invoice_parse(job: BackgroundJob) -> dict:
+    invoice = job.invoice
+    if invoice is None:
+        raise JobFailed("Фактуру для обробки не знайдено")
+
+    try:
+        summary = parse_invoice(invoice, progress=job.update_progress)
+    except InvoiceParseError as exc:
+        raise JobFailed(str(exc)) from exc
+
+    return {
+        "items_count": summary["items_count"],
+        "cars_matched": sum(1 for m in summary["car_matches"].values() if m.get("car_uuid")),
+        "validation_errors": len(summary["validation_errors"]),
+        "rejected_rows": len(summary["rejected_rows"]),
+        "rejected_outlays": len(summary["rejected_outlays"]),
+        "parse_stats": invoice.parse_stats,
+    }
+
+
+def fail_invoice_parse(job: BackgroundJob) -> None:
+    if job.invoice_id:
+        Invoice.objects.filter(pk=job.invoice_id).update(
+            status=InvoiceStatusChoice.FAILED,
+            parse_error=job.error,
+            updated_at=timezone.now(),
+        )
+
+
+def handle_outlay_export(job: BackgroundJob) -> dict:
+    # Imported here: openpyxl is only needed by workers that run exports
+    from .exports import run_outlay_export
+
+    try:
+        return run_outlay_export(
+            job.uuid,
+            job.payload.get("filters", {}),
+            job.payload.get("format", "xlsx"),
+            progress=job.update_progress,
+        )
+    except ValueError as exc:
+        raise JobFailed(str(exc)) from exc
+
+
+JOB_HANDLERS = {
+    BackgroundJobTypeChoice.INVOICE_PARSE: handle_invoice_parse,
+    BackgroundJobTypeChoice.OUTLAY_EXPORT: handle_outlay_export,
+}
+
+JOB_FAILURE_HANDLERS = {
+    BackgroundJobTypeChoice.INVOICE_PARSE: fail_invoice_parse,
+}
+
+
+def run_job(job: BackgroundJob) -> BackgroundJob:
+    """Execute a claimed job and store its outcome (DONE, FAILED or re-QUEUED for retry)"""
+    handler = JOB_HANDLERS.get(job.job_type)
+    update_fields = ["status", "result", "error", "progress", "finished_at", "run_after", "locked_by", "updated_at"]
+
+    try:
+        if handler is None:
+            raise JobFailed(f"Unknown job type: {job.job_type}")
+        job.result = handler(job) or {}
+        job.status = BackgroundJobStatusChoice.DONE
+        job.progress = 100
+        job.finished_at = timezone.now()
+        logger.info(f"Job {job.uuid} ({job.job_type}) done: {job.result}")
+    except Exception as exc:
+        job.error = str(exc)
+        retriable = not isinstance(exc, JobFailed) and job.attempts < job.max_attempts
+        if retriable:
+            job.status = BackgroundJobStatusChoice.QUEUED
+            job.run_after = timezone.now() + timedelta(
+                seconds=RETRY_BACKOFF_SECONDS * job.attempts ** 2
+            )
+            logger.warning(f"Job {job.uuid} attempt {job.attempts} failed, retry at {job.run_after}: {exc}")
+        else:
+            job.status = BackgroundJobStatusChoice.FAILED
+            job.finished_at = timezone.now()
+            logger.exception(f"Job {job.uuid} ({job.job_type}) failed: {exc}")
+
+    job.locked_by = ""
+    job.save(update_fields=update_fields)
+
+    if job.status == BackgroundJobStatusChoice.FAILED:
+        on_failure = JOB_FAILURE_HANDLERS.get(job.job_type)
+        if on_failure:
+            on_failure(job)
+
+    return job
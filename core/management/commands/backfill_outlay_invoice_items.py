@@ -0,0 +1,111 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import InvoiceItem, Outlay
+from core.services import INVOICE_OUTLAY_COMMENT_PREFIX, parse_invoice_outlay_comment
+
+# Outlays were created while their invoice was uploaded: auto_now_add stamped them
+# a moment after the invoice, never exactly at its created_at
+OUTLAY_CREATED_WINDOW = timedelta(minutes=5)
+
+
+class Command(BaseCommand):
+    help = (
+        "Link outlays created from invoices before Outlay.invoice_item existed to their "
+        "invoice line, resolved from the 'Автоматично створено з фактури: ...' comment"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Outlays resolved per query")
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be linked")
+
+    def handle(self, *args, **options):
+        qs = (
+            Outlay.objects
+            .filter(invoice_item__isnull=True, comment__startswith=INVOICE_OUTLAY_COMMENT_PREFIX)
+            .order_by("uuid")
+            .only("uuid", "comment", "created_at")
+        )
+        stats = {"outlays": 0, "linked": 0, "not_found": 0, "ambiguous": 0, "unparsed": 0}
+        started = time.monotonic()
+        last = None
+
+        while True:
+            chunk = list((qs.filter(uuid__gt=last) if last else qs)[:options["chunk_size"]])
+            if not chunk:
+                break
+            last = chunk[-1].uuid
+            stats["outlays"] += len(chunk)
+
+            linked = self.resolve_chunk(chunk, stats)
+            if linked and not options["dry_run"]:
+                with transaction.atomic():
+                    Outlay.objects.bulk_update(linked, ["invoice_item"])
+            stats["linked"] += len(linked)
+
+            self.stdout.write(
+                f"{stats['outlays']} outlay(s), {time.monotonic() - started:.1f}s: {stats['linked']} linked, "
+                f"{stats['not_found']} not found, {stats['ambiguous']} ambiguous, {stats['unparsed']} unparsed"
+            )
+
+        prefix = "Dry run, nothing written. " if options["dry_run"] else ""
+        self.stdout.write(self.style.SUCCESS(f"{prefix}Done: {stats}"))
+
+    def resolve_chunk(self, chunk: list[Outlay], stats: dict) -> list[Outlay]:
+        """Set invoice_item on the outlays of a chunk that resolve to exactly one invoice line"""
+        keys = {}
+        for outlay in chunk:
+            key = parse_invoice_outlay_comment(outlay.comment)
+            if key is None:
+                stats["unparsed"] += 1
+                continue
+            keys[outlay.pk] = key
+
+        # One query per chunk: every line with one of the chunk's (invoice name, item id)
+        candidates = {}
+        items = (
+            InvoiceItem.objects
+            .filter(
+                invoice__name__in={name for name, _ in keys.values()},
+                item_id__in={item_id for _, item_id in keys.values()},
+            )
+            .values_list("uuid", "invoice__name", "item_id", "invoice__created_at")
+        )
+        for item_uuid, invoice_name, item_id, invoice_created_at in items:
+            candidates.setdefault((invoice_name, item_id), []).append((item_uuid, invoice_created_at))
+
+        linked = []
+        for outlay in chunk:
+            key = keys.get(outlay.pk)
+            if key is None:
+                continue
+            matches = candidates.get(key, [])
+            if len(matches) > 1:
+                # Invoice names are not unique: take the invoice uploaded last before the outlay
+                matches = self.closest_invoice_matches(matches, outlay.created_at)
+            if not matches:
+                stats["not_found"] += 1
+            elif len(matches) > 1:
+                stats["ambiguous"] += 1
+            else:
+                outlay.invoice_item_id = matches[0][0]
+                linked.append(outlay)
+        return linked
+
+    def closest_invoice_matches(self, matches: list[tuple], created_at) -> list[tuple]:
+        """
+        (item uuid, invoice created_at) matches of the invoice created closest before the
+        outlay, within OUTLAY_CREATED_WINDOW. Several only when those invoices share the
+        timestamp; all matches when none is in the window, counted as ambiguous.
+        """
+        in_window = [
+            match for match in matches
+            if match[1] is not None and timedelta(0) <= created_at - match[1] <= OUTLAY_CREATED_WINDOW
+        ]
+        if not in_window:
+            return matches
+        closest = max(match[1] for match in in_window)
+        return [match for match in in_window if match[1] == closest]
@@ -0,0 +1,286 @@
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import tempfile
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.invoice_samples import make_synthetic_invoice
+from core.services import PDFCore
+
+MANIFEST_NAME = "manifest.json"
+STAGES = ("parse", "extract_table_pdfplumber", "validate_rows")
+# Metrics compared against --baseline, "higher is better" ones first
+THROUGHPUT_METRICS = ("pages_per_s", "rows_per_s")
+LATENCY_METRICS = ("p50_ms", "p95_ms", "peak_rss_mb")
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Nearest-rank percentile, values must not be empty"""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def build_corpus(corpus_dir: Path, sizes: list[int], per_size: int, rows_per_page: int) -> list[dict]:
+    """
+    Generate the synthetic invoices (or reuse them when corpus_dir already has a
+    manifest with the same parameters) and return the manifest entries.
+    """
+    params = {"sizes": sizes, "per_size": per_size, "rows_per_page": rows_per_page}
+    manifest_path = corpus_dir / MANIFEST_NAME
+    if manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text())
+        if manifest["params"] == params and all((corpus_dir / e["file"]).exists() for e in manifest["invoices"]):
+            return manifest["invoices"]
+
+    invoices = []
+    for pages in sizes:
+        for seed in range(per_size):
+            filename = f"invoice_{pages}p_{seed}.pdf"
+            expected = make_synthetic_invoice(
+                corpus_dir / filename, pages=pages, rows_per_page=rows_per_page, seed=seed,
+            )
+            invoices.append({
+                "file": filename,
+                "pages": pages,
+                "rows": expected["rows"],
+                "total_brutto": str(expected["total_brutto"]),
+            })
+
+    manifest_path.write_text(json.dumps({"params": params, "invoices": invoices}, indent=2))
+    return invoices
+
+
+def check_parse_result(entry: dict, data: dict) -> list[str]:
+    """Differences between a parse() result and the values the invoice was generated with"""
+    problems = []
+    table = data.get("table") or []
+    if len(table) != entry["rows"]:
+        problems.append(f"rows: expected {entry['rows']}, parsed {len(table)}")
+
+    total = sum(Decimal(str(row.get("price_brutto", 0))) for row in table)
+    if abs(total - Decimal(entry["total_brutto"])) > Decimal("0.01"):
+        problems.append(f"total brutto: expected {entry['total_brutto']}, parsed {total:.2f}")
+    if data.get("total_validation_error"):
+        problems.append(f"total_validation_error: {data['total_validation_error']}")
+
+    invalid_rows = sum(1 for row in table if row.get("validation_errors"))
+    if invalid_rows:
+        problems.append(f"{invalid_rows} row(s) with validation errors")
+    return problems
+
+
+def _run_stage(stage: str, corpus_dir: str, invoices: list[dict], table_engine: str, conn) -> None:
+    """
+    Runs in a forked child, one per stage, so ru_maxrss is the peak of that stage only.
+    Sends back per-invoice latencies, row counts, regression problems and memory figures.
+    """
+    paths = [str(Path(corpus_dir) / entry["file"]) for entry in invoices]
+    prepared = []
+    if stage == "validate_rows":
+        # Rows are produced outside the measured section
+        prepared = [PDFCore(path, workers=1, table_engine=table_engine).parse()["table"] for path in paths]
+
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    latencies = []
+    rows = []
+    problems = {}
+
+    for index, (path, entry) in enumerate(zip(paths, invoices, strict=True)):
+        started = time.perf_counter()
+        if stage == "parse":
+            data = PDFCore(path, workers=1, table_engine=table_engine).parse()
+            row_count = len(data["table"])
+            invoice_problems = check_parse_result(entry, data)
+            if invoice_problems:
+                problems[entry["file"]] = invoice_problems
+        elif stage == "extract_table_pdfplumber":
+            row_count = len(PDFCore(path, workers=1)._extract_table_with_pdfplumber(workers=1))
+        else:
+            core = PDFCore(path, workers=1)
+            for row in prepared[index]:
+                core._validate_row(row)
+            row_count = len(prepared[index])
+        latencies.append(time.perf_counter() - started)
+        rows.append(row_count)
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with conn:
+        conn.send({
+            "latencies": latencies,
+            "rows": rows,
+            "problems": problems,
+            "peak_kb": peak_kb,
+            "growth_kb": peak_kb - baseline_kb,
+        })
+
+
+def stage_report(invoices: list[dict], measured: dict) -> dict:
+    latencies = measured["latencies"]
+    total_s = sum(latencies)
+    pages = sum(entry["pages"] for entry in invoices)
+    rows = sum(measured["rows"])
+    return {
+        "invoices": len(invoices),
+        "pages": pages,
+        "rows": rows,
+        "total_s": round(total_s, 4),
+        "pages_per_s": round(pages / total_s, 2) if total_s else None,
+        "rows_per_s": round(rows / total_s, 1) if total_s else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3),
+        "peak_rss_mb": round(measured["peak_kb"] / 1024, 1),
+        "rss_growth_mb": round(measured["growth_kb"] / 1024, 1),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Parser regression and throughput benchmark: runs parse(), pdfplumber table extraction "
+        "and row validation over a synthetic invoice corpus and writes the results as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=[1, 5, 20],
+            help="Invoice sizes in the corpus, in pages",
+        )
+        parser.add_argument("--per-size", type=int, default=5, help="Invoices generated per size")
+        parser.add_argument("--rows-per-page", type=int, default=40)
+        parser.add_argument(
+            "--corpus-dir",
+            help="Keep the corpus in this directory and reuse it on later runs (default: temporary directory)",
+        )
+        parser.add_argument(
+            "--stages",
+            nargs="+",
+            choices=STAGES,
+            default=list(STAGES),
+        )
+        parser.add_argument(
+            "--engine",
+            choices=PDFCore.TABLE_ENGINES,
+            default="auto",
+            help="Table engine used by the parse stage",
+        )
+        parser.add_argument("--output", help="Write the JSON report to this file")
+        parser.add_argument("--baseline", help="JSON report of an earlier run to compare with")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["baseline"]:
+            try:
+                baseline = json.loads(Path(options["baseline"]).read_text())
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read baseline report: {e}") from e
+
+        if options["corpus_dir"]:
+            corpus_dir = Path(options["corpus_dir"])
+            corpus_dir.mkdir(parents=True, exist_ok=True)
+            report = self.run(corpus_dir, options)
+        else:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                report = self.run(Path(tmp_dir), options)
+
+        for stage, result in report["stages"].items():
+            self.stdout.write(
+                f"{stage:>25}: {result['pages_per_s']:>9} pages/s {result['rows_per_s']:>10} rows/s "
+                f"p50 {result['p50_ms']:>9.2f} ms  p95 {result['p95_ms']:>9.2f} ms  "
+                f"peak RSS {result['peak_rss_mb']:>6.1f} MB"
+            )
+        if baseline:
+            self.write_comparison(report, baseline)
+
+        for filename, problems in report["regressions"].items():
+            self.stdout.write(self.style.ERROR(f"{filename}: {'; '.join(problems)}"))
+
+        if options["output"]:
+            Path(options["output"]).write_text(json.dumps(report, indent=2))
+            self.stdout.write(f"Report written to {options['output']}")
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+
+        if report["regressions"]:
+            raise CommandError(f"{len(report['regressions'])} invoice(s) parsed differently than generated")
+        self.stdout.write(self.style.SUCCESS("Done"))
+
+    def run(self, corpus_dir: Path, options: dict) -> dict:
+        started = time.perf_counter()
+        invoices = build_corpus(corpus_dir, options["sizes"], options["per_size"], options["rows_per_page"])
+        self.stdout.write(
+            f"Corpus: {len(invoices)} invoices, {sum(e['pages'] for e in invoices)} pages "
+            f"({time.perf_counter() - started:.1f}s)"
+        )
+
+        ctx = multiprocessing.get_context("fork")
+        stages = {}
+        regressions = {}
+        for stage in options["stages"]:
+            parent_conn, child_conn = ctx.Pipe(duplex=False)
+            process = ctx.Process(
+                target=_run_stage,
+                args=(stage, str(corpus_dir), invoices, options["engine"], child_conn),
+            )
+            process.start()
+            # Only the child keeps the sending end: recv() raises EOFError if it dies instead of waiting forever
+            child_conn.close()
+            with parent_conn:
+                try:
+                    measured = parent_conn.recv()
+                except EOFError:
+                    measured = None
+            process.join()
+            if measured is None:
+                raise CommandError(f"Stage {stage} crashed (exit code {process.exitcode})")
+
+            stages[stage] = stage_report(invoices, measured)
+            regressions.update(measured["problems"])
+
+        return {
+            "created_at": timezone.now().isoformat(),
+            "parser_version": PDFCore.PARSER_VERSION,
+            "engine": options["engine"],
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "corpus": {
+                "sizes": options["sizes"],
+                "per_size": options["per_size"],
+                "rows_per_page": options["rows_per_page"],
+                "invoices": len(invoices),
+            },
+            "stages": stages,
+            "regressions": regressions,
+        }
+
+    def write_comparison(self, report: dict, baseline: dict) -> None:
+        """Relative change per stage and metric, positive means better"""
+        self.stdout.write(
+            f"Compared with parser version {baseline.get('parser_version')} ({baseline.get('created_at')}), "
+            f"positive is better:"
+        )
+        for stage, result in report["stages"].items():
+            previous = baseline.get("stages", {}).get(stage)
+            if not previous:
+                continue
+            changes = []
+            for metric in THROUGHPUT_METRICS + LATENCY_METRICS:
+                old, new = previous.get(metric), result.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old * 100
+                if metric in LATENCY_METRICS:
+                    change = -change
+                changes.append(f"{metric} {change:+.1f}%")
+            self.stdout.write(f"{stage:>25}: {', '.join(changes)}")
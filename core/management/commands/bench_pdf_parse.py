@@ -0,0 +1,60 @@
+import multiprocessing
+import resource
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from core.invoice_samples import make_synthetic_invoice
+from core.services import PDFCore
+
+
+def _measure_parse(path: str, table_engine: str, conn) -> None:
+    """Runs in a forked child so ru_maxrss reflects this parse only."""
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    data = PDFCore(path, workers=1, table_engine=table_engine).parse()
+    elapsed = time.perf_counter() - started
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    conn.send((elapsed, peak_kb, peak_kb - baseline_kb, len(data["table"])))
+    conn.close()
+
+
+class Command(BaseCommand):
+    help = "Measure PDFCore.parse time and peak RSS per table engine on synthetic invoices"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 50])
+        parser.add_argument(
+            "--engines",
+            nargs="+",
+            choices=PDFCore.TABLE_ENGINES,
+            default=["pdfplumber", "auto"],
+        )
+        parser.add_argument("--rows-per-page", type=int, default=40)
+
+    def handle(self, *args, **options):
+        ctx = multiprocessing.get_context("fork")
+        self.stdout.write(
+            f"{'pages':>6} {'engine':>11} {'rows':>6} {'time, s':>8} {'peak RSS, MB':>13} {'RSS growth, MB':>15}"
+        )
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for pages in options["pages"]:
+                path = Path(tmp_dir) / f"invoice_{pages}p.pdf"
+                make_synthetic_invoice(path, pages=pages, rows_per_page=options["rows_per_page"])
+
+                for engine in options["engines"]:
+                    parent_conn, child_conn = ctx.Pipe(duplex=False)
+                    process = ctx.Process(target=_measure_parse, args=(str(path), engine, child_conn))
+                    process.start()
+                    elapsed, peak_kb, growth_kb, rows = parent_conn.recv()
+                    process.join()
+
+                    self.stdout.write(
+                        f"{pages:>6} {engine:>11} {rows:>6} {elapsed:>8.3f} "
+                        f"{peak_kb / 1024:>13.1f} {growth_kb / 1024:>15.1f}"
+                    )
+
+        self.stdout.write(self.style.SUCCESS("Done"))
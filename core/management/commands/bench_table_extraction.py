@@ -0,0 +1,62 @@
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from core.invoice_samples import make_synthetic_invoice
+from core.services import PDFCore
+
+
+class Command(BaseCommand):
+    help = "Compare sequential and process-pool table extraction on synthetic invoices"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--pages",
+            type=int,
+            nargs="+",
+            default=[1, 10, 50],
+            help="Invoice sizes to benchmark, in pages",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Process pool size for the parallel run",
+        )
+        parser.add_argument("--repeat", type=int, default=3, help="Runs per mode, best time is reported")
+        parser.add_argument("--rows-per-page", type=int, default=40)
+
+    def _best_time(self, path: Path, workers: int, repeat: int) -> tuple[float, list]:
+        best = float("inf")
+        rows = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            rows = PDFCore(path, workers=workers)._extract_table_with_pdfplumber(workers=workers)
+            best = min(best, time.perf_counter() - started)
+        return best, rows
+
+    def handle(self, *args, **options):
+        workers = options["workers"]
+        self.stdout.write(f"CPU cores: {os.cpu_count()}, parallel workers: {workers}")
+        self.stdout.write(f"{'pages':>6} {'rows':>6} {'sequential, s':>14} {'parallel, s':>12} {'speedup':>8}")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for pages in options["pages"]:
+                path = Path(tmp_dir) / f"invoice_{pages}p.pdf"
+                make_synthetic_invoice(path, pages=pages, rows_per_page=options["rows_per_page"])
+
+                sequential, seq_rows = self._best_time(path, 1, options["repeat"])
+                parallel, par_rows = self._best_time(path, workers, options["repeat"])
+
+                if seq_rows != par_rows:
+                    self.stdout.write(self.style.ERROR(f"{pages} pages: parallel rows differ from sequential"))
+
+                self.stdout.write(
+                    f"{pages:>6} {len(seq_rows):>6} {sequential:>14.3f} {parallel:>12.3f} "
+                    f"{sequential / parallel:>7.2f}x"
+                )
+
+        self.stdout.write(self.style.SUCCESS("Done"))
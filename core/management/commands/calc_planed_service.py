@@ -1,34 +1,140 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from core.constants import test_schema_service
+from django.db import connections, transaction
+from django.utils import timezone
+
+from core.models import CarServiceState
+from core.service_status import evaluate_service_plans
+
+# bulk_update() builds one CASE per column per batch, its cost grows faster than the batch
+UPDATE_BATCH_SIZE = 500
+
+
+def empty_stats() -> dict:
+    return {"states": 0, "changed": 0, "skipped": 0, "services": 0, "load_s": 0.0, "compute_s": 0.0, "write_s": 0.0}
+
+
+def recompute_chunk(first_pk: int, last_pk: int, dry_run: bool) -> dict:
+    """
+    Recompute the service plans of the CarServiceState rows first_pk..last_pk against
+    the current Car.mileage and write the changed ones back. Runs in the pool workers.
+    """
+    stats = empty_stats()
+
+    with transaction.atomic():
+        started = time.monotonic()
+        # Plans edited meanwhile in the UI wait for the chunk instead of being overwritten
+        states = list(
+            CarServiceState.objects
+            .select_for_update(of=("self",))
+            .select_related("car")
+            .only("id", "service_plan", "mileage", "car__mileage")
+            .filter(pk__gte=first_pk, pk__lte=last_pk)
+            .order_by("pk")
+        )
+        stats["states"] = len(states)
+
+        plannable = []
+        for state in states:
+            services = (state.service_plan or {}).get("services")
+            if not services or not state.car.mileage or state.car.mileage <= 0:
+                stats["skipped"] += 1
+                continue
+            plannable.append((state, services))
+        stats["load_s"] = time.monotonic() - started
+
+        started = time.monotonic()
+        evaluated = evaluate_service_plans([(state.car.mileage, services) for state, services in plannable])
+        stats["services"] = sum(len(services) for services in evaluated)
+
+        now = timezone.now()
+        changed = []
+        for (state, services), new_services in zip(plannable, evaluated, strict=True):
+            if new_services == services and state.mileage == state.car.mileage:
+                continue
+            state.service_plan = {**state.service_plan, "services": new_services}
+            state.mileage = state.car.mileage
+            state.updated_at = now  # bulk_update() skips auto_now
+            changed.append(state)
+        stats["changed"] = len(changed)
+        stats["compute_s"] = time.monotonic() - started
+
+        started = time.monotonic()
+        if changed and not dry_run:
+            CarServiceState.objects.bulk_update(
+                changed, ["service_plan", "mileage", "updated_at"], batch_size=UPDATE_BATCH_SIZE,
+            )
+        stats["write_s"] = time.monotonic() - started
+
+    return stats
 
 
 class Command(BaseCommand):
-    help = "Calc basic schema to check next car service by millage"
+    help = (
+        "Recompute next service mileage and statuses of every car service plan against the "
+        "car's current mileage and save the plans that changed. Meant to run nightly."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Service plans per chunk (one transaction each)")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.JOB_WORKER_CONCURRENCY,
+            help="Chunks recomputed in parallel",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Only report how many plans would change")
 
     def handle(self, *args, **options):
-        schema_service_data = test_schema_service.get("services")
-
-        if not schema_service_data:
-            self.stdout.write(self.style.WARNING("No services found"))
-            return
-        current_mileage = 200_000
-        
-        for service in schema_service_data:
-            last_service = service.get("last_service_km")
-            interval = service.get("interval_km")
-            if last_service == 0:
-                service["status"] = "UNKNOWN"
-                service["next_service"] = None
-                self.stdout.write(str(service))
-                continue
+        stats = empty_stats()
+        workers = max(1, options["workers"])
+        started = time.monotonic()
+
+        if workers == 1:
+            for first_pk, last_pk in self.chunk_ranges(options["chunk_size"]):
+                self.add_stats(stats, recompute_chunk(first_pk, last_pk, options["dry_run"]), started)
+        else:
+            ranges = list(self.chunk_ranges(options["chunk_size"]))
+            # Forked pool workers must not share the parent's database connection
+            connections.close_all()
+            ctx = multiprocessing.get_context("fork")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+                futures = [
+                    pool.submit(recompute_chunk, first_pk, last_pk, options["dry_run"])
+                    for first_pk, last_pk in ranges
+                ]
+                for future in futures:
+                    self.add_stats(stats, future.result(), started)
 
-            next_service = last_service + interval
-            service["next_service"]=next_service
+        elapsed = time.monotonic() - started
+        prefix = "Dry run, nothing written. " if options["dry_run"] else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Done in {elapsed:.2f}s ({workers} worker(s)): {stats['states']} plan(s), "
+            f"{stats['changed']} changed, {stats['skipped']} skipped, {stats['services']} service(s); "
+            f"{stats['states'] / elapsed if elapsed else 0:.0f} plans/s, "
+            f"{stats['services'] / elapsed if elapsed else 0:.0f} services/s; "
+            f"load {stats['load_s']:.2f}s, compute {stats['compute_s']:.2f}s, write {stats['write_s']:.2f}s"
+        ))
 
-            if next_service <= 0:
-                service["status"]="IMPORTANT"
-            else:
-                service["status"]="PLANNED"
-            self.stdout.write(str(service))
+    def chunk_ranges(self, chunk_size: int):
+        """(first pk, last pk) of consecutive chunks, read with a keyset over the primary key"""
+        pks = CarServiceState.objects.order_by("pk").values_list("pk", flat=True)
+        last = None
+        while True:
+            chunk = list((pks.filter(pk__gt=last) if last else pks)[:chunk_size])
+            if not chunk:
+                return
+            last = chunk[-1]
+            yield chunk[0], last
 
-        self.stdout.write(self.style.SUCCESS("Done"))
+    def add_stats(self, stats: dict, chunk_stats: dict, started: float) -> None:
+        for key, value in chunk_stats.items():
+            stats[key] += value
+        self.stdout.write(
+            f"{stats['states']} plan(s), {time.monotonic() - started:.1f}s: "
+            f"{stats['changed']} changed, {stats['skipped']} skipped"
+        )
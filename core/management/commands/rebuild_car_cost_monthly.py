@@ -0,0 +1,69 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Car, CarCostMonthly, Outlay
+from core.services import aggregate_car_costs
+
+
+def rollup_key(row: CarCostMonthly) -> tuple:
+    return row.car_id, row.month, row.type, row.category
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconcile the CarCostMonthly rollup with the outlays, a chunk of cars at a time. "
+        "Run once after the migration that adds the table, later only to repair drift "
+        "(e.g. outlays edited in the admin)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=200, help="Cars reconciled per transaction")
+        parser.add_argument("--dry-run", action="store_true", help="Only report the differences")
+
+    def handle(self, *args, **options):
+        stats = {"cars": 0, "rows": 0, "added": 0, "changed": 0, "removed": 0}
+        started = time.monotonic()
+        cars = Car.objects.order_by("pk").values_list("pk", flat=True)
+        last = None
+
+        while True:
+            car_ids = list((cars.filter(pk__gt=last) if last else cars)[:options["chunk_size"]])
+            if not car_ids:
+                break
+            last = car_ids[-1]
+            stats["cars"] += len(car_ids)
+
+            with transaction.atomic():
+                # Same lock as refresh_car_cost_monthly(): outlay writes of these cars wait for the chunk
+                list(Car.objects.select_for_update().filter(pk__in=car_ids).order_by("pk").values_list("pk", flat=True))
+
+                expected = {
+                    rollup_key(row): row
+                    for row in aggregate_car_costs(Outlay.cars.through.objects.filter(car_id__in=car_ids))
+                }
+                existing = {rollup_key(row): row for row in CarCostMonthly.objects.filter(car_id__in=car_ids)}
+
+                added = expected.keys() - existing.keys()
+                removed = existing.keys() - expected.keys()
+                changed = [
+                    key for key in expected.keys() & existing.keys()
+                    if (expected[key].total, expected[key].count) != (existing[key].total, existing[key].count)
+                ]
+                stats["rows"] += len(expected)
+                stats["added"] += len(added)
+                stats["removed"] += len(removed)
+                stats["changed"] += len(changed)
+
+                if (added or removed or changed) and not options["dry_run"]:
+                    CarCostMonthly.objects.filter(car_id__in=car_ids).delete()
+                    CarCostMonthly.objects.bulk_create(expected.values())
+
+            self.stdout.write(
+                f"{stats['cars']} car(s), {time.monotonic() - started:.1f}s: {stats['rows']} row(s), "
+                f"+{stats['added']} ~{stats['changed']} -{stats['removed']}"
+            )
+
+        prefix = "Dry run, nothing written. " if options["dry_run"] else ""
+        self.stdout.write(self.style.SUCCESS(f"{prefix}Done: {stats}"))
@@ -0,0 +1,236 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import Invoice, InvoiceParseCache, InvoiceStatusChoice
+from core.services import (
+    PDFCore,
+    apply_invoice_reparse,
+    diff_invoice_items,
+    parse_invoice_file_sandboxed,
+)
+
+DEFAULT_CHECKPOINT = settings.BASE_DIR / "reparse_invoices.checkpoint.json"
+
+
+def date_arg(value: str):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(f"invalid date {value!r}, expected YYYY-MM-DD") from exc
+
+
+def after(qs, last: list | None):
+    """Invoices after the checkpointed (created_at, uuid) key"""
+    if not last:
+        return qs
+    last_created = datetime.fromisoformat(last[0])
+    return qs.filter(Q(created_at__gt=last_created) | Q(created_at=last_created, uuid__gt=last[1]))
+
+
+def _parse_file(filepath: str) -> dict:
+    """Pool task: parse one stored invoice with the usual sandbox limits"""
+    return parse_invoice_file_sandboxed(filepath)
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-parse stored invoice PDFs after a parser upgrade and apply the differences "
+        "to their items (and outlays) in bulk. Resumable with --resume."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", type=date_arg, help="Invoices uploaded on or after this date (YYYY-MM-DD)")
+        parser.add_argument("--until", type=date_arg, help="Invoices uploaded on or before this date (YYYY-MM-DD)")
+        parser.add_argument(
+            "--parser-version",
+            action="append",
+            dest="parser_versions",
+            help="Only invoices parsed by this parser version, '' for legacy invoices (can be repeated). "
+                 "Default: every version except the current one",
+        )
+        parser.add_argument(
+            "--with-validation-errors",
+            action="store_true",
+            help="Only invoices with row or total validation errors",
+        )
+        parser.add_argument("--include-failed", action="store_true", help="Also retry invoices that failed to parse")
+        parser.add_argument("--chunk-size", type=int, default=50, help="Invoices per chunk (one checkpoint per chunk)")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Invoices parsed in parallel (each in a single-process sandbox)",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Only report the differences")
+        parser.add_argument("--checkpoint", default=str(DEFAULT_CHECKPOINT), help="Checkpoint file")
+        parser.add_argument("--resume", action="store_true", help="Continue after the last checkpointed invoice")
+
+    def handle(self, *args, **options):
+        filters = {
+            "since": options["since"].isoformat() if options["since"] else None,
+            "until": options["until"].isoformat() if options["until"] else None,
+            "parser_versions": options["parser_versions"],
+            "with_validation_errors": options["with_validation_errors"],
+            "include_failed": options["include_failed"],
+            "target_version": PDFCore.PARSER_VERSION,
+        }
+        checkpoint_path = Path(options["checkpoint"])
+        stats = {"invoices": 0, "updated": 0, "failed": 0, "missing": 0,
+                 "added": 0, "changed": 0, "removed": 0, "unchanged": 0}
+        last = None
+
+        if options["resume"]:
+            if not checkpoint_path.exists():
+                raise CommandError(f"No checkpoint at {checkpoint_path}")
+            checkpoint = json.loads(checkpoint_path.read_text())
+            if checkpoint["filters"] != filters:
+                raise CommandError("Checkpoint was written with other filters, run without --resume to start over")
+            last = checkpoint["last"]
+            stats = checkpoint["stats"]
+            self.stdout.write(f"Resuming after invoice {last[1]} ({stats['invoices']} already processed)")
+
+        qs = self.get_queryset(options)
+        self.stdout.write(f"Invoices to re-parse: {after(qs, last).count()} (parser version {PDFCore.PARSER_VERSION})")
+
+        # Forked pool workers must not share the parent's database connection
+        connections.close_all()
+        ctx = multiprocessing.get_context("fork")
+        started = time.monotonic()
+
+        with ProcessPoolExecutor(max_workers=max(1, options["workers"]), mp_context=ctx) as pool:
+            while True:
+                chunk = list(after(qs, last)[:options["chunk_size"]])
+                if not chunk:
+                    break
+
+                self.process_chunk(chunk, pool, stats, options["dry_run"])
+                last = [chunk[-1].created_at.isoformat(), str(chunk[-1].uuid)]
+
+                if not options["dry_run"]:
+                    checkpoint_path.write_text(json.dumps({
+                        "filters": filters,
+                        "last": last,
+                        "stats": stats,
+                        "updated_at": timezone.now().isoformat(),
+                    }, indent=2))
+
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f"{stats['invoices']} invoice(s), {elapsed:.1f}s: {stats['updated']} updated, "
+                    f"{stats['failed']} failed, {stats['missing']} missing file(s); items +{stats['added']} "
+                    f"~{stats['changed']} -{stats['removed']} ={stats['unchanged']}"
+                )
+
+        prefix = "Dry run, nothing written. " if options["dry_run"] else ""
+        self.stdout.write(self.style.SUCCESS(f"{prefix}Done: {json.dumps(stats)}"))
+
+    def get_queryset(self, options):
+        statuses = [InvoiceStatusChoice.PARSED]
+        if options["include_failed"]:
+            statuses.append(InvoiceStatusChoice.FAILED)
+        qs = Invoice.objects.filter(status__in=statuses).exclude(file_path="")
+
+        if options["since"]:
+            qs = qs.filter(created_at__date__gte=options["since"])
+        if options["until"]:
+            qs = qs.filter(created_at__date__lte=options["until"])
+        if options["parser_versions"] is not None:
+            qs = qs.filter(parser_version__in=options["parser_versions"])
+        else:
+            qs = qs.exclude(parser_version=PDFCore.PARSER_VERSION)
+        if options["with_validation_errors"]:
+            qs = qs.filter(
+                Q(invoice_data__has_key="validation_errors") | Q(invoice_data__has_key="total_validation_error")
+            )
+        # Keyset order for checkpoints
+        return qs.order_by("created_at", "uuid")
+
+    def process_chunk(self, chunk: list[Invoice], pool, stats: dict, dry_run: bool) -> None:
+        """Parse a chunk in the pool (parse cache first) and apply the results one invoice at a time"""
+        cached = dict(
+            InvoiceParseCache.objects
+            .filter(file_hash__in=[i.file_hash for i in chunk if i.file_hash], parser_version=PDFCore.PARSER_VERSION)
+            .values_list("file_hash", "data")
+        )
+
+        results = {}
+        futures = {}
+        for invoice in chunk:
+            stats["invoices"] += 1
+            if invoice.file_hash in cached:
+                results[invoice.pk] = {"status": "ok", "data": cached[invoice.file_hash], "cached": True}
+                continue
+            file_path = Path(settings.MEDIA_ROOT) / invoice.file_path
+            if not file_path.exists():
+                stats["missing"] += 1
+                self.stdout.write(self.style.WARNING(f"{invoice.uuid}: file {invoice.file_path} not found"))
+                continue
+            futures[pool.submit(_parse_file, str(file_path))] = invoice
+
+        for future in as_completed(futures):
+            invoice = futures[future]
+            try:
+                results[invoice.pk] = future.result()
+            except Exception as e:
+                results[invoice.pk] = {"status": "error", "message": str(e)}
+
+        new_cache = []
+        for invoice in chunk:
+            result = results.get(invoice.pk)
+            if result is None:
+                continue
+            table = (result.get("data") or {}).get("table")
+            if result["status"] != "ok" or not table:
+                # The stored items are kept: a failed re-parse must not wipe a parsed invoice
+                stats["failed"] += 1
+                self.stdout.write(self.style.WARNING(
+                    f"{invoice.uuid}: {result.get('message') or 'no table rows found'}"
+                ))
+                continue
+
+            if not result.get("cached") and invoice.file_hash:
+                new_cache.append(InvoiceParseCache(
+                    file_hash=invoice.file_hash, parser_version=PDFCore.PARSER_VERSION, data=result["data"],
+                ))
+                invoice.parse_stats = {
+                    "cached": False,
+                    "duration_s": result["duration_s"],
+                    "peak_memory_mb": result["peak_memory_mb"],
+                }
+            else:
+                invoice.parse_stats = {"cached": True}
+
+            diff = diff_invoice_items(invoice, table)
+            if dry_run:
+                counts = {
+                    "added": len(diff["added"]),
+                    "changed": len(diff["changed"]),
+                    "removed": len(diff["removed"]),
+                    "unchanged": diff["unchanged"],
+                }
+            else:
+                with transaction.atomic():
+                    counts = apply_invoice_reparse(invoice, result["data"], diff)
+
+            for key, value in counts.items():
+                stats[key] += value
+            if counts["added"] or counts["changed"] or counts["removed"]:
+                stats["updated"] += 1
+                self.stdout.write(
+                    f"{invoice.uuid} {invoice.name}: +{counts['added']} ~{counts['changed']} -{counts['removed']}"
+                )
+
+        if new_cache and not dry_run:
+            InvoiceParseCache.objects.bulk_create(new_cache, ignore_conflicts=True)
@@ -0,0 +1,130 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from core.jobs import (
+    STALE_JOB_CHECK_INTERVAL,
+    WorkerShutdown,
+    claim_next_job,
+    release_job,
+    requeue_stale_jobs,
+    run_job,
+)
+from core.models import BackgroundJobTypeChoice
+
+
+class Command(BaseCommand):
+    help = "Process queued background jobs (invoice parsing etc.) from the database queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Process all currently queued jobs and exit",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=2.0,
+            help="Seconds to wait between polls when the queue is empty",
+        )
+        parser.add_argument(
+            "--job-type",
+            action="append",
+            choices=BackgroundJobTypeChoice.values,
+            dest="job_types",
+            help="Only process jobs of this type (can be repeated)",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.JOB_WORKER_CONCURRENCY,
+            help="Worker processes polling the queue in parallel",
+        )
+
+    def handle(self, *args, **options):
+        self.requeue_stale_jobs()
+
+        concurrency = max(1, options["concurrency"])
+        if concurrency == 1:
+            self.run_worker(options)
+            return
+
+        # Forked workers must not share the parent's database connection
+        connections.close_all()
+        ctx = multiprocessing.get_context("fork")
+        # Not daemonic: a worker forks its own sandbox process for every invoice parse
+        processes = [ctx.Process(target=self.run_worker, args=(options,)) for _ in range(concurrency)]
+        for process in processes:
+            process.start()
+        self.stdout.write(f"Started {concurrency} worker processes")
+
+        def stop_workers(signum, frame):
+            # Each worker releases its current job back to the queue and exits
+            for process in processes:
+                process.terminate()
+
+        signal.signal(signal.SIGTERM, stop_workers)
+
+        for process in processes:
+            try:
+                process.join()
+            except KeyboardInterrupt:
+                # Ctrl+C reaches the whole process group, workers stop on their own
+                process.join()
+
+        self.stdout.write(self.style.SUCCESS(f"All {concurrency} worker processes stopped"))
+
+    def requeue_stale_jobs(self) -> None:
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(self.style.WARNING(f"Requeued {requeued} stale job(s)"))
+
+    def run_worker(self, options):
+        """Claim and run jobs one by one until the queue is empty (--once), interrupted or terminated"""
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.stdout.write(f"Worker {worker_id} started")
+
+        def shutdown(signum, frame):
+            raise WorkerShutdown()
+
+        signal.signal(signal.SIGTERM, shutdown)
+
+        processed = 0
+        job = None
+        next_stale_check = time.monotonic() + STALE_JOB_CHECK_INTERVAL.total_seconds()
+        try:
+            while True:
+                close_old_connections()
+                # Jobs of workers that died without releasing them (SIGKILL, OOM, lost host)
+                if time.monotonic() >= next_stale_check:
+                    self.requeue_stale_jobs()
+                    next_stale_check = time.monotonic() + STALE_JOB_CHECK_INTERVAL.total_seconds()
+
+                job = claim_next_job(worker_id, options["job_types"])
+
+                if job is None:
+                    if options["once"]:
+                        break
+                    time.sleep(options["sleep"])
+                    continue
+
+                started = time.monotonic()
+                job = run_job(job)
+                processed += 1
+                self.stdout.write(
+                    f"{job.job_type} {job.uuid}: {job.status} in {time.monotonic() - started:.2f}s"
+                )
+                job = None
+        except (KeyboardInterrupt, WorkerShutdown) as exc:
+            if job is not None and release_job(job):
+                self.stdout.write(self.style.WARNING(f"Released {job.job_type} {job.uuid} back to the queue"))
+            self.stdout.write("Interrupted" if isinstance(exc, KeyboardInterrupt) else "Terminated")
+
+        self.stdout.write(self.style.SUCCESS(f"Worker {worker_id} done, processed {processed} job(s)"))
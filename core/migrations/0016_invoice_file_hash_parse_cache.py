@@ -0,0 +1,67 @@
+# Generated by Django 6.0 on 2026-10-17 20:15
+
+import hashlib
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def hash_existing_invoice_files(apps, schema_editor):
+    """Fill file_hash for already uploaded invoices so re-uploads of them are detected"""
+    Invoice = apps.get_model('core', 'Invoice')
+
+    for invoice in Invoice.objects.filter(file_hash='').only('uuid', 'file_path').iterator(chunk_size=500):
+        file_path = Path(settings.MEDIA_ROOT) / invoice.file_path
+        if not file_path.is_file():
+            continue
+
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+
+        Invoice.objects.filter(pk=invoice.pk).update(
+            file_hash=digest.hexdigest(),
+            original_filename=os.path.basename(invoice.file_path),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_invoice_status_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='file_hash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64, verbose_name='SHA-256 файлу'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='original_filename',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Назва файлу'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='parser_version',
+            field=models.CharField(blank=True, default='', max_length=20, verbose_name='Версія парсера'),
+        ),
+        migrations.CreateModel(
+            name='InvoiceParseCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_hash', models.CharField(max_length=64)),
+                ('parser_version', models.CharField(max_length=20)),
+                ('data', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('file_hash', 'parser_version'), name='core_invoice_parse_cache_unique')],
+            },
+        ),
+        migrations.RunPython(hash_existing_invoice_files, migrations.RunPython.noop),
+    ]
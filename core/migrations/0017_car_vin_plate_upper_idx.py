@@ -0,0 +1,22 @@
+# Generated by Django 6.0 on 2026-10-17 20:18
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_invoice_file_hash_parse_cache'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(django.db.models.functions.text.Upper('vin_code'), name='core_car_vin_upper_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(django.db.models.functions.text.Upper('license_plate'), name='core_car_plate_upper_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-17 20:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_car_vin_plate_upper_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='parse_stats',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Статистика обробки'),
+        ),
+    ]
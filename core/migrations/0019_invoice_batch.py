@@ -0,0 +1,35 @@
+# Generated by Django 6.0 on 2026-10-17 20:58
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_invoice_parse_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceBatch',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Створено')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Оновлено')),
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=100, verbose_name='Назва')),
+                ('entries', models.JSONField(blank=True, default=list, verbose_name='Файли')),
+            ],
+            options={
+                'verbose_name': 'Пакет фактур',
+                'verbose_name_plural': 'Пакети фактур',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='invoices', to='core.invoicebatch', verbose_name='Пакет'),
+        ),
+    ]
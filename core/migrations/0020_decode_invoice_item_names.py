@@ -0,0 +1,45 @@
+# Generated by Django 6.0 on 2026-10-17 21:30
+
+import re
+
+from django.db import migrations
+
+UNICODE_ESCAPE_RE = re.compile(r'\\u([0-9a-fA-F]{4})')
+CHUNK_SIZE = 1000
+
+
+def decode_item_names(apps, schema_editor):
+    """
+    Store item names decoded (literal \\uXXXX -> character), the invoice page no longer decodes them per request.
+    Only names containing an escape are read, in uuid-ordered chunks, each chunk is one bulk UPDATE.
+    """
+    InvoiceItem = apps.get_model('core', 'InvoiceItem')
+    qs = InvoiceItem.objects.filter(item_name__contains='\\u').only('uuid', 'item_name').order_by('uuid')
+
+    last_uuid = None
+    while True:
+        chunk = list((qs.filter(uuid__gt=last_uuid) if last_uuid else qs)[:CHUNK_SIZE])
+        if not chunk:
+            break
+        last_uuid = chunk[-1].uuid
+
+        changed = []
+        for item in chunk:
+            decoded = UNICODE_ESCAPE_RE.sub(lambda m: chr(int(m.group(1), 16)), item.item_name)
+            if decoded != item.item_name:
+                item.item_name = decoded
+                changed.append(item)
+        InvoiceItem.objects.bulk_update(changed, ['item_name'])
+
+
+class Migration(migrations.Migration):
+    # Every chunk commits on its own, a large table is not rewritten in one transaction
+    atomic = False
+
+    dependencies = [
+        ('core', '0019_invoice_batch'),
+    ]
+
+    operations = [
+        migrations.RunPython(decode_item_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-17 21:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_decode_invoice_item_names'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outlay',
+            name='invoice_item',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='outlays', to='core.invoiceitem', verbose_name='Позиція фактури'),
+        ),
+    ]
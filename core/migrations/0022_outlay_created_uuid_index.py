@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-17 21:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_outlay_invoice_item'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='outlay',
+            index=models.Index(fields=['-created_at', '-uuid'], name='core_outlay_created_uuid_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 6.0 on 2026-10-17 21:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_outlay_created_uuid_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CarCostMonthly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='Перший день місяця', verbose_name='Місяць')),
+                ('type', models.CharField(choices=[('service', 'Сервіс'), ('other', 'Інші')], max_length=20, verbose_name='Тип витрати')),
+                ('category', models.CharField(blank=True, default='', max_length=20, verbose_name='Підкатегорія')),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Сума (PLN)')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Кількість витрат')),
+                ('car', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_costs', to='core.car')),
+            ],
+            options={
+                'verbose_name': 'Витрати авто за місяць',
+                'verbose_name_plural': 'Витрати авто за місяць',
+                'ordering': ['car', 'month'],
+                'constraints': [models.UniqueConstraint(fields=('car', 'month', 'type', 'category'), name='core_car_cost_monthly_key')],
+            },
+        ),
+    ]
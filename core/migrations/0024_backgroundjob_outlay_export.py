@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-17 21:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_car_cost_monthly'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='backgroundjob',
+            name='job_type',
+            field=models.CharField(choices=[('invoice_parse', 'Парсинг фактури'), ('outlay_export', 'Експорт витрат')], max_length=50),
+        ),
+    ]
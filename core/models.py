@@ -1,4 +1,9 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, NullIf, Upper
+from django.utils import timezone
 from django.contrib.auth.models import BaseUserManager, AbstractBaseUser, PermissionsMixin
 import uuid
 from django.core.validators import MinValueValidator, MaxValueValidator
@@ -118,6 +123,48 @@ class CarDriveTypeChoice(models.TextChoices):
     AWD = "AWD", "Повний"
 
 
+MONEY_FIELD = models.DecimalField(max_digits=14, decimal_places=2)
+
+
+def outlay_amount_value(prefix: str = "amount__"):
+    """
+    SQL value of one outlay amount: full_price, or price_per_item × item_count when
+    full_price is empty or 0. `prefix` is the path from the queried model to OutlayAmount.
+    """
+    return Coalesce(
+        NullIf(F(f"{prefix}full_price"), Value(0)),
+        F(f"{prefix}price_per_item") * F(f"{prefix}item_count"),
+        output_field=MONEY_FIELD,
+    )
+
+
+def outlay_amount_sum(prefix: str = "amount__"):
+    """Sum of outlay_amount_value() as Decimal, 0 for no outlays"""
+    return Coalesce(Sum(outlay_amount_value(prefix)), Value(Decimal("0")), output_field=MONEY_FIELD)
+
+
+class CarQuerySet(models.QuerySet):
+    def with_outlays_total(self):
+        """
+        Annotate outlays_total (Decimal) and outlays_count of every car.
+
+        Correlated subqueries over the car's outlays: any number of cars costs one
+        query, and the annotation combines with other joins without multiplying rows.
+        """
+        per_car = Outlay.objects.filter(cars=OuterRef("pk")).order_by().values("cars")
+        return self.annotate(
+            outlays_total=Coalesce(
+                Subquery(per_car.annotate(total=outlay_amount_sum()).values("total")),
+                Value(Decimal("0")),
+                output_field=MONEY_FIELD,
+            ),
+            outlays_count=Coalesce(
+                Subquery(per_car.annotate(count=Count("pk")).values("count")),
+                Value(0),
+            ),
+        )
+
+
 class Car(AbstractTimeStampModel):
     uuid = models.UUIDField(
         default=uuid.uuid4, 
@@ -164,12 +211,22 @@ class Car(AbstractTimeStampModel):
         verbose_name="Власник авто"
     )
 
+    objects = CarQuerySet.as_manager()
+
     @property
-    def total_expenses_amount(self):
-        service_total = sum(item.total for item in self.car_expenses.all())
-        other_total = sum(item.total_amount() for item in self.other_expenses.all())
+    def total_expenses_amount(self) -> Decimal:
+        expense_sum = Coalesce(Sum(F("count") * F("price_per_one")), Value(Decimal("0")), output_field=MONEY_FIELD)
+        service_total = self.car_expenses.aggregate(total=expense_sum)["total"]
+        other_total = self.other_expenses.aggregate(total=expense_sum)["total"]
         return service_total + other_total
 
+    class Meta:
+        indexes = [
+            # Case-insensitive VIN / plate lookups (iexact is UPPER(col) = UPPER(%s) on Postgres)
+            models.Index(Upper("vin_code"), name="core_car_vin_upper_idx"),
+            models.Index(Upper("license_plate"), name="core_car_plate_upper_idx"),
+        ]
+
     def __str__(self):
         return f"{self.mark} {self.model} {self.year}"
 
@@ -325,6 +382,21 @@ class Outlay(AbstractTimeStampModel):
         Car, 
         related_name="outlay_cars"
     )
+    # Invoice line the outlay was created from (None for manual outlays)
+    invoice_item = models.ForeignKey(
+        "InvoiceItem",
+        on_delete=models.SET_NULL,
+        related_name="outlays",
+        null=True,
+        blank=True,
+        verbose_name="Позиція фактури",
+    )
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the outlay list, see get_outlays_page()
+            models.Index(fields=["-created_at", "-uuid"], name="core_outlay_created_uuid_idx"),
+        ]
 
 
 class OutlayAmount(models.Model):
@@ -346,6 +418,55 @@ class OutlayAmount(models.Model):
         return f"{self.uuid}"
 
 
+class CarCostMonthly(models.Model):
+    """
+    Outlay totals per car, month, outlay type and category.
+
+    Kept in step with the outlays by refresh_car_cost_monthly() in the same transaction
+    as every outlay write; `rebuild_car_cost_monthly` reconciles it from scratch.
+    """
+    car = models.ForeignKey(Car, on_delete=models.CASCADE, related_name="monthly_costs")
+    month = models.DateField(verbose_name="Місяць", help_text="Перший день місяця")
+    type = models.CharField(max_length=20, choices=OutlayTypeChoice.choices, verbose_name="Тип витрати")
+    # "" for outlays without a category (NULL would defeat the unique constraint)
+    category = models.CharField(max_length=20, blank=True, default="", verbose_name="Підкатегорія")
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Сума (PLN)")
+    count = models.PositiveIntegerField(default=0, verbose_name="Кількість витрат")
+
+    class Meta:
+        ordering = ["car", "month"]
+        verbose_name = "Витрати авто за місяць"
+        verbose_name_plural = "Витрати авто за місяць"
+        constraints = [
+            models.UniqueConstraint(fields=["car", "month", "type", "category"], name="core_car_cost_monthly_key"),
+        ]
+
+    def __str__(self):
+        return f"{self.car_id} {self.month:%Y-%m} {self.type} {self.category}"
+
+
+class InvoiceStatusChoice(models.TextChoices):
+    PARSING = "parsing", "Обробляється"
+    PARSED = "parsed", "Оброблено"
+    FAILED = "failed", "Помилка обробки"
+
+
+class InvoiceBatch(AbstractTimeStampModel):
+    """Several invoices uploaded at once (multiple PDFs or a ZIP archive)"""
+    uuid = models.UUIDField(default=uuid.uuid4, primary_key=True, editable=False)
+    name = models.CharField(max_length=100, verbose_name="Назва")
+    # One entry per uploaded file: filename, invoice (uuid), duplicate, error
+    entries = models.JSONField(default=list, blank=True, verbose_name="Файли")
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "Пакет фактур"
+        verbose_name_plural = "Пакети фактур"
+
+    def __str__(self):
+        return self.name
+
+
 class Invoice(AbstractTimeStampModel):
     uuid = models.UUIDField(default=uuid.uuid4, primary_key=True, editable=False)
     name = models.CharField(max_length=55)
@@ -353,6 +474,26 @@ class Invoice(AbstractTimeStampModel):
     invoice_data = models.JSONField(default=dict)
     invoice_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     is_archived = models.BooleanField(default=False)
+    status = models.CharField(
+        max_length=20,
+        choices=InvoiceStatusChoice.choices,
+        default=InvoiceStatusChoice.PARSED,
+        verbose_name="Статус обробки",
+    )
+    parse_error = models.TextField(blank=True, default="", verbose_name="Помилка обробки")
+    file_hash = models.CharField(max_length=64, blank=True, default="", db_index=True, verbose_name="SHA-256 файлу")
+    original_filename = models.CharField(max_length=255, blank=True, default="", verbose_name="Назва файлу")
+    parser_version = models.CharField(max_length=20, blank=True, default="", verbose_name="Версія парсера")
+    # duration_s, peak_memory_mb, cached; reason on limit failures
+    parse_stats = models.JSONField(default=dict, blank=True, verbose_name="Статистика обробки")
+    batch = models.ForeignKey(
+        InvoiceBatch,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="invoices",
+        verbose_name="Пакет",
+    )
 
     cars = models.ManyToManyField(Car, related_name="invoices")
 
@@ -365,6 +506,25 @@ class Invoice(AbstractTimeStampModel):
         return f"{self.name} - {self.created_at.strftime('%d.%m.%Y') if self.created_at else ''}"
 
 
+class InvoiceParseCache(models.Model):
+    """PDFCore.parse() output per file content and parser version"""
+    file_hash = models.CharField(max_length=64)
+    parser_version = models.CharField(max_length=20)
+    data = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["file_hash", "parser_version"],
+                name="core_invoice_parse_cache_unique",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.file_hash[:12]} v{self.parser_version}"
+
+
 class InvoiceItem(AbstractTimeStampModel):
     uuid = models.UUIDField(default=uuid.uuid4, primary_key=True, editable=False)
     invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name="items")
@@ -387,6 +547,67 @@ class InvoiceItem(AbstractTimeStampModel):
         return f"{self.item_id} - {self.item_name}"
 
 
+class BackgroundJobTypeChoice(models.TextChoices):
+    INVOICE_PARSE = "invoice_parse", "Парсинг фактури"
+    OUTLAY_EXPORT = "outlay_export", "Експорт витрат"
+
+
+class BackgroundJobStatusChoice(models.TextChoices):
+    QUEUED = "queued", "В черзі"
+    RUNNING = "running", "Виконується"
+    DONE = "done", "Виконано"
+    FAILED = "failed", "Помилка"
+
+
+class BackgroundJob(AbstractTimeStampModel):
+    """DB-backed job queue entry, picked up by `manage.py run_job_worker`"""
+    uuid = models.UUIDField(default=uuid.uuid4, primary_key=True, editable=False)
+    job_type = models.CharField(max_length=50, choices=BackgroundJobTypeChoice.choices)
+    status = models.CharField(
+        max_length=20,
+        choices=BackgroundJobStatusChoice.choices,
+        default=BackgroundJobStatusChoice.QUEUED,
+    )
+    payload = models.JSONField(default=dict, blank=True)
+    result = models.JSONField(default=dict, blank=True)
+    progress = models.PositiveSmallIntegerField(default=0, verbose_name="Прогрес, %")
+    progress_message = models.CharField(max_length=255, blank=True, default="")
+    error = models.TextField(blank=True, default="")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True, default="")
+
+    invoice = models.ForeignKey(
+        Invoice,
+        on_delete=models.CASCADE,
+        related_name="jobs",
+        null=True,
+        blank=True,
+    )
+
+    class Meta:
+        ordering = ["created_at"]
+        indexes = [
+            models.Index(fields=["status", "run_after"], name="core_job_status_run_after_idx"),
+        ]
+
+    def update_progress(self, progress: int, message: str = "") -> None:
+        """Write progress straight to the row so pollers see it outside the job transaction"""
+        self.progress = progress
+        self.progress_message = message
+        BackgroundJob.objects.filter(pk=self.pk).update(
+            progress=progress,
+            progress_message=message,
+            updated_at=timezone.now(),
+        )
+
+    def __str__(self):
+        return f"{self.job_type} {self.uuid} ({self.status})"
+
+
 class Notifications(AbstractTimeStampModel):
     uuid = models.UUIDField(default=uuid.uuid4, primary_key=True, editable=False)
     message = models.TextField()
@@ -0,0 +1,113 @@
+"""
+Service status engine: next service mileage, status and overdue km of car services.
+
+Plans of any number of cars are flattened into columns (one row per car and
+service) and evaluated with NumPy in one pass, so recomputing the whole fleet
+costs a few array operations instead of a Python loop over the plan JSON.
+create_car_service_plan() and create_service_events_from_services() are thin
+wrappers evaluating the plan of one car.
+"""
+import numpy as np
+
+from .models import ServiceStatusChoice
+
+# CRITICAL once the mileage is this far past the next service
+CRITICAL_OVERRUN = 1.2
+# IMPORTANT within this share of the interval before the next service
+IMPORTANT_WINDOW = 0.1
+
+
+def service_plan_columns(plans: list[tuple[int, list[dict]]]) -> dict:
+    """
+    Columns of [(current mileage, services), ...] plans, one row per car and service:
+    last_service_km, interval_km, mileage (of the service's car) and plan (index in `plans`).
+    """
+    counts = [len(services) for _, services in plans]
+    rows = sum(counts)
+    return {
+        "last_service_km": np.fromiter(
+            (service.get("last_service_km") or 0 for _, services in plans for service in services),
+            dtype=np.int64, count=rows,
+        ),
+        "interval_km": np.fromiter(
+            (service.get("interval_km") or 0 for _, services in plans for service in services),
+            dtype=np.int64, count=rows,
+        ),
+        "mileage": np.repeat(np.fromiter((mileage for mileage, _ in plans), dtype=np.int64, count=len(plans)), counts),
+        "plan": np.repeat(np.arange(len(plans)), counts),
+    }
+
+
+def compute_service_status(last_service_km, interval_km, mileage) -> dict:
+    """
+    Evaluate services given as equally long (or broadcastable) arrays.
+
+    Statuses:
+    - UNKNOWN: last_service_km == 0 (never serviced, or not recorded)
+    - CRITICAL: mileage is at least 20% past next_service_km
+    - IMPORTANT: next_service_km is reached, or is less than 10% of the interval away
+    - NORMAL: otherwise
+
+    Returns arrays: known (last service recorded), next_service_km (last service + interval;
+    for unknown services one interval from the current mileage), status and overdue_km
+    (km past next_service_km, 0 when not due or unknown).
+    """
+    last_service_km = np.asarray(last_service_km, dtype=np.int64)
+    interval_km = np.asarray(interval_km, dtype=np.int64)
+    mileage = np.asarray(mileage, dtype=np.int64)
+
+    known = last_service_km != 0
+    next_service_km = np.where(known, last_service_km + interval_km, mileage + np.maximum(interval_km, 0))
+    status = np.select(
+        [
+            ~known,
+            mileage >= next_service_km * CRITICAL_OVERRUN,
+            mileage >= next_service_km,
+            mileage > next_service_km - interval_km * IMPORTANT_WINDOW,
+        ],
+        [
+            ServiceStatusChoice.UNKNOWN.value,
+            ServiceStatusChoice.CRITICAL.value,
+            ServiceStatusChoice.IMPORTANT.value,
+            ServiceStatusChoice.IMPORTANT.value,
+        ],
+        default=ServiceStatusChoice.NORMAL.value,
+    )
+    overdue_km = np.where(known, np.maximum(mileage - next_service_km, 0), 0)
+
+    return {
+        "known": known,
+        "next_service_km": next_service_km,
+        "status": status,
+        "overdue_km": overdue_km,
+    }
+
+
+def evaluate_service_plans(plans: list[tuple[int, list[dict]]]) -> list[list[dict]]:
+    """
+    Services of every plan with next_service (None when unknown), status and overdue_km
+    set, as copies; the input dicts are left untouched.
+    """
+    columns = service_plan_columns(plans)
+    result = compute_service_status(columns["last_service_km"], columns["interval_km"], columns["mileage"])
+
+    # tolist() once: plain ints and strs for the plan JSON, no per-element NumPy scalars
+    rows = zip(
+        result["known"].tolist(),
+        result["next_service_km"].tolist(),
+        result["status"].tolist(),
+        result["overdue_km"].tolist(),
+        strict=True,
+    )
+    evaluated = []
+    for _, services in plans:
+        plan = []
+        # rows runs over all plans, each plan takes the next len(services) of them
+        for service, (known, next_service_km, status, overdue_km) in zip(services, rows, strict=False):
+            service = service.copy()
+            service["next_service"] = next_service_km if known else None
+            service["status"] = status
+            service["overdue_km"] = overdue_km
+            plan.append(service)
+        evaluated.append(plan)
+    return evaluated
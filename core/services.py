@@ -1,17 +1,44 @@
 import logging
 from typing import Any
-from datetime import date
+from datetime import date, datetime
+from uuid import UUID
 
-from django.db.models import F, Value, Case, When, CharField
-from django.db.models.functions import Concat
+from django.db.models import F, Q, Count, Sum, Value, Case, When, CharField, DateField, DecimalField, IntegerField
+from django.db.models.functions import Coalesce, Concat, TruncMonth, Upper
 from .forms import OutlayFrom
+from django.conf import settings
+from django.core.files import File
 from django.db import transaction
+from django.db.backends.base.operations import BaseDatabaseOperations
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils import timezone
+from django.utils.http import content_disposition_header, http_date
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 import pymupdf
 import pdfplumber
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import bisect
+from itertools import islice
+import hashlib
+import multiprocessing
+import os
+import resource
+import signal
+import tempfile
+import time
 import re
-
-from .models import Owner, Car, Outlay, OutlayAmount, OutlayCategoryChoice, OutlayTypeChoice, CarStatusChoice, CarPhoto, CarServiceState, ServiceEvent
+import zipfile
+from urllib.parse import quote
+
+from .car_matching import get_car_match_index
+from .service_status import compute_service_status, evaluate_service_plans, service_plan_columns
+from .models import (
+    Owner, Car, Outlay, OutlayAmount, OutlayCategoryChoice, OutlayTypeChoice, CarStatusChoice, CarPhoto,
+    CarServiceState, ServiceEvent, Service, Invoice, InvoiceItem, InvoiceStatusChoice, InvoiceParseCache,
+    InvoiceBatch, BackgroundJob, BackgroundJobStatusChoice, BackgroundJobTypeChoice, CarCostMonthly,
+    outlay_amount_sum,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -410,8 +437,6 @@ def create_outlay(
     if item_count is not None:
         amount_data['item_count'] = item_count
     
-    outlay_amout_obj: OutlayAmount = OutlayAmount.objects.create(**amount_data)
-
     # For service type, don't set category (it should be None)
     # For other type, set category if provided
     final_category = None
@@ -420,18 +445,23 @@ def create_outlay(
     else:
         final_category = category if category else None
     
-    outlay_obj: Outlay = Outlay.objects.create(
-        type=type,
-        category=final_category,
-        category_name=category_name if type != 'service' else None,
-        service_name=service_name,
-        name=name,
-        comment=comment,
-        description=description,  # For backward compatibility
-        amount=outlay_amout_obj,
-        created_at=created_at
-    )
-    outlay_obj.cars.set([car])  # Set single car as list
+    with transaction.atomic():
+        outlay_amout_obj: OutlayAmount = OutlayAmount.objects.create(**amount_data)
+
+        outlay_obj: Outlay = Outlay.objects.create(
+            type=type,
+            category=final_category,
+            category_name=category_name if type != 'service' else None,
+            service_name=service_name,
+            name=name,
+            comment=comment,
+            description=description,  # For backward compatibility
+            amount=outlay_amout_obj,
+            created_at=created_at
+        )
+        outlay_obj.cars.set([car])  # Set single car as list
+
+        refresh_car_cost_monthly(outlay_cost_keys([outlay_obj.pk]))
 
     return outlay_obj
 
@@ -444,6 +474,78 @@ def get_outlays() -> list[dict]:
     )
 
 
+OUTLAY_PAGE_SIZE = 50
+OUTLAY_LIST_FIELDS = (
+    "uuid", "type", "category", "category_name", "service_name", "name", "comment", "description",
+    "created_at", "updated_at", "cars__mark", "cars__model", "cars__license_plate",
+    "amount__price_per_item", "amount__item_count", "amount__full_price",
+)
+
+
+def encode_outlay_cursor(created_at, outlay_uuid) -> str:
+    return f"{created_at.isoformat()}~{outlay_uuid}"
+
+
+def decode_outlay_cursor(cursor: str | None) -> tuple | None:
+    """(created_at, uuid) of an encode_outlay_cursor() value, None when absent or malformed"""
+    try:
+        created_at, outlay_uuid = cursor.split("~")
+        return datetime.fromisoformat(created_at), UUID(outlay_uuid)
+    except (AttributeError, ValueError):
+        return None
+
+
+def get_outlays_page(
+    filter_type: str = "all",
+    filter_category: str = "all",
+    after: str | None = None,
+    page_size: int = OUTLAY_PAGE_SIZE,
+) -> dict[str, Any]:
+    """
+    One page of the outlay list, newest first, as flat dicts (one per outlay and car).
+
+    Pages are keyset-paginated on (created_at, uuid): the page's outlays are picked
+    by a LIMIT subquery that walks core_outlay_created_uuid_idx, and the outer query
+    joins amounts and cars for those outlays only, so a page costs the same at any
+    depth and any table size.
+
+    Returns:
+        Dict with keys:
+            - outlays: List[Dict] - rows with OUTLAY_LIST_FIELDS
+            - next_cursor: str | None - `after` value of the next page
+    """
+    outlays_qs = Outlay.objects.all()
+    if filter_type in (OutlayTypeChoice.SERVICE, OutlayTypeChoice.OTHER):
+        outlays_qs = outlays_qs.filter(type=filter_type)
+    if filter_category != "all":
+        outlays_qs = outlays_qs.filter(category=filter_category)
+
+    cursor = decode_outlay_cursor(after)
+    if cursor:
+        created_at, outlay_uuid = cursor
+        outlays_qs = outlays_qs.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, uuid__lt=outlay_uuid)
+        )
+
+    ordering = ("-created_at", "-uuid")
+    page_uuids = outlays_qs.order_by(*ordering).values("uuid")[:page_size + 1]
+    rows = list(Outlay.objects.filter(uuid__in=page_uuids).order_by(*ordering).values(*OUTLAY_LIST_FIELDS))
+
+    # The extra outlay only tells whether there is a next page
+    seen = []
+    for index, row in enumerate(rows):
+        if not seen or seen[-1] != row["uuid"]:
+            seen.append(row["uuid"])
+            if len(seen) > page_size:
+                rows = rows[:index]
+                break
+
+    next_cursor = None
+    if len(seen) > page_size:
+        next_cursor = encode_outlay_cursor(rows[-1]["created_at"], rows[-1]["uuid"])
+    return {"outlays": rows, "next_cursor": next_cursor}
+
+
 def get_outlay_form_data(uuid):
     outlay: Outlay = Outlay.objects.get(uuid=uuid)
     amount: OutlayAmount = outlay.amount
@@ -468,7 +570,7 @@ def get_outlay_form_data(uuid):
 
 
 def get_outlay(uuid) -> Outlay:
-    return Outlay.objects.get(uuid=uuid)
+    return Outlay.objects.select_related("invoice_item__invoice").get(uuid=uuid)
 
 
 def update_outlay(uuid, form: OutlayFrom) -> Outlay:
@@ -478,6 +580,9 @@ def update_outlay(uuid, form: OutlayFrom) -> Outlay:
     cd = form.cleaned_data
 
     with transaction.atomic():
+        # Months the outlay counted towards before the edit (date or car may change)
+        cost_keys = outlay_cost_keys([outlay.pk])
+
         outlay.type = cd["service_type"]
         
         # For service type, don't set category (it should be None)
@@ -512,23 +617,161 @@ def update_outlay(uuid, form: OutlayFrom) -> Outlay:
 
         outlay.cars.set([cd["car"]])  # Set single car as list
 
+        refresh_car_cost_monthly(cost_keys | outlay_cost_keys([outlay.pk]))
+
     return outlay
 
 
+def delete_outlay(outlay: Outlay) -> None:
+    with transaction.atomic():
+        cost_keys = outlay_cost_keys([outlay.pk])
+        outlay.delete()
+        refresh_car_cost_monthly(cost_keys)
+
+
+def _month_range(month: date) -> tuple[datetime, datetime]:
+    """Aware [start, end) datetimes of a calendar month in the current time zone"""
+    start = timezone.make_aware(datetime(month.year, month.month, 1))
+    end = timezone.make_aware(datetime(month.year + month.month // 12, month.month % 12 + 1, 1))
+    return start, end
+
+
+def outlay_cost_keys(outlay_pks) -> set[tuple]:
+    """(car uuid, month) CarCostMonthly keys the given outlays count towards"""
+    return set(
+        Outlay.cars.through.objects
+        .filter(outlay_id__in=outlay_pks)
+        .annotate(month=TruncMonth("outlay__created_at", output_field=DateField()))
+        .values_list("car_id", "month")
+    )
+
+
+def aggregate_car_costs(links) -> list[CarCostMonthly]:
+    """
+    Unsaved CarCostMonthly rows for a queryset of outlay-car links (Outlay.cars.through),
+    one per car, month, type and category. An outlay of several cars counts fully for each.
+    """
+    rows = (
+        links
+        .annotate(
+            month=TruncMonth("outlay__created_at", output_field=DateField()),
+            category_key=Coalesce("outlay__category", Value("")),
+        )
+        .order_by()
+        .values("car_id", "month", "outlay__type", "category_key")
+        .annotate(total=outlay_amount_sum("outlay__amount__"), count=Count("pk"))
+    )
+    return [
+        CarCostMonthly(
+            car_id=row["car_id"],
+            month=row["month"],
+            type=row["outlay__type"],
+            category=row["category_key"],
+            total=row["total"],
+            count=row["count"],
+        )
+        for row in rows
+    ]
+
+
+def refresh_car_cost_monthly(keys: set[tuple]) -> None:
+    """
+    Recompute the CarCostMonthly rows of the given (car uuid, month) keys from their outlays.
+
+    Called after every outlay write with the keys of the outlay before and after the
+    change, so the rollup follows any change of amount, date, type, category or car
+    without tracking deltas. The car rows are locked first: concurrent writers of
+    one car queue up instead of racing on the delete and insert.
+    """
+    if not keys:
+        return
+
+    with transaction.atomic():
+        car_ids = sorted({car_id for car_id, _ in keys})
+        list(Car.objects.select_for_update().filter(pk__in=car_ids).order_by("pk").values_list("pk", flat=True))
+
+        rollup_q = Q()
+        links_q = Q()
+        for car_id, month in keys:
+            start, end = _month_range(month)
+            rollup_q |= Q(car_id=car_id, month=month)
+            links_q |= Q(car_id=car_id, outlay__created_at__gte=start, outlay__created_at__lt=end)
+
+        CarCostMonthly.objects.filter(rollup_q).delete()
+        CarCostMonthly.objects.bulk_create(aggregate_car_costs(Outlay.cars.through.objects.filter(links_q)))
+
+
+# Thousands separators (space, no-break / narrow no-break space) are dropped, the decimal comma becomes a dot
+PL_NUMBER_TRANSLATION = str.maketrans({" ": None, "\u00a0": None, "\u202f": None, ",": "."})
+PL_NUMBER_JUNK_RE = re.compile(r"[^\d,\.\-]")
+# Row / total validation tolerance, in grosz (0.01 PLN)
+AMOUNT_TOLERANCE_GROSZ = 1
+
+
+def parse_pl_decimal(value: str | None) -> Decimal:
+    """
+    Convert Polish number format straight to an exact Decimal.
+    '1 100,00' -> Decimal('1100.00')
+    '1.100,00' -> Decimal('1100.00') (dots next to a decimal comma group thousands)
+    '1 100,00 PLN' -> Decimal('1100.00') (stray text takes the slower regex path)
+    None or '' -> Decimal('0')
+
+    Raises:
+        InvalidOperation: if no number can be read from value
+    """
+    if value is None or not value.strip():
+        return Decimal("0")
+    if "," in value and "." in value:
+        value = value.replace(".", "")
+    try:
+        return Decimal(value.translate(PL_NUMBER_TRANSLATION))
+    except InvalidOperation:
+        return Decimal(PL_NUMBER_JUNK_RE.sub("", value).replace(",", "."))
+
+
+def parse_pl_grosz(value: str | None) -> int:
+    """
+    Convert Polish number format straight to integer grosz.
+    '1 100,50' -> 110050; the common two-decimal form needs no Decimal at all.
+    """
+    if value is None:
+        return 0
+    # Two str.replace calls beat str.translate for these short cells
+    digits = value.replace(" ", "").replace("\u00a0", "").strip()
+    if digits[-3:-2] == ",":
+        try:
+            return int(digits[:-3] + digits[-2:])
+        except ValueError:
+            pass
+    return to_grosz(parse_pl_decimal(value))
+
+
+def to_grosz(value) -> int:
+    """Amount in PLN (Decimal, float, int or Polish-formatted str) -> integer grosz"""
+    if isinstance(value, Decimal):
+        return int(value.scaleb(2).to_integral_value(ROUND_HALF_UP))
+    if isinstance(value, str):
+        return parse_pl_grosz(value)
+    # Two-decimal floats are off by far less than half a grosz, rounding restores them exactly
+    return round((value or 0) * 100)
+
+
+def format_grosz(value: int) -> str:
+    """110050 -> '1100.50'"""
+    return f"{Decimal(value).scaleb(-2):.2f}"
+
+
 def to_float_pl(value: str) -> float:
     """
     Convert Polish number format to float.
     '1 100,00' -> 1100.0
     '1 000,00' -> 1000.0
     """
-    if value is None:
-        return 0.0
-    value = value.replace("\u00a0", " ")
-    value = re.sub(r"[^\d,\.]", "", value)
-    value = value.replace(" ", "")
-    if "," in value:
-        value = value.replace(",", ".")
-    return float(value)
+    return float(parse_pl_decimal(value))
+
+
+# Literal \uXXXX as stored in the database ("\\u005C"), XXXX is 4 hex digits
+UNICODE_ESCAPE_RE = re.compile(r'\\u([0-9a-fA-F]{4})')
 
 
 def decode_unicode_escapes(text: str) -> str:
@@ -547,14 +790,10 @@ def decode_unicode_escapes(text: str) -> str:
             code = int(match.group(1), 16)
             return chr(code)
         
-        # Pattern to match \uXXXX where XXXX is 4 hex digits
-        # This handles the literal string "\\u005C" as stored in database
-        pattern = r'\\u([0-9a-fA-F]{4})'
-        
         # Check if text contains Unicode escape sequences
         if '\\u' in text:
             # Decode all \uXXXX sequences
-            text = re.sub(pattern, replace_unicode, text)
+            text = UNICODE_ESCAPE_RE.sub(replace_unicode, text)
         
     except Exception as e:
         logger.warning(f"Error decoding Unicode escapes: {e}")
@@ -572,7 +811,112 @@ def decode_unicode_escapes(text: str) -> str:
     return text
 
 
+PDFPLUMBER_TABLE_SETTINGS = {
+    "vertical_strategy": "lines",
+    "horizontal_strategy": "lines",
+    "intersection_tolerance": 5,
+    "snap_tolerance": 5,
+    "join_tolerance": 5,
+}
+# Below this page count process pool start-up costs more than it saves
+PDF_PARALLEL_MIN_PAGES = 4
+# Same for the pymupdf fast path, which reads a page in ~10 ms instead of ~400 ms
+PDF_PARALLEL_MIN_PAGES_PYMUPDF = 24
+
+
+def _extract_table_rows_from_pages(filepath: str, page_numbers: list[int]) -> dict[int, list]:
+    """Process pool worker: table rows of the given 1-based pages, keyed by page number."""
+    with pdfplumber.open(filepath, pages=page_numbers) as pdf:
+        return PDFCore(filepath, workers=1)._rows_from_pages(pdf.pages)
+
+
+def _read_invoice_pages(filepath: str, page_numbers: list[int], table_engine: str) -> list[tuple[dict, list]]:
+    """Process pool worker: (header fields, table rows) of the given 1-based pages, in order."""
+    parser = PDFCore(filepath, workers=1, table_engine=table_engine)
+    try:
+        with pymupdf.open(filepath) as doc:
+            return [parser._read_page(doc[page_no - 1]) for page_no in page_numbers]
+    finally:
+        parser._close_plumber()
+
+
+class InvoiceParseError(Exception):
+    """Invoice PDF was read but no usable data could be extracted from it"""
+
+
+class UnknownInvoiceLayoutError(InvoiceParseError):
+    """No registered vendor parser recognizes the PDF"""
+
+
+# Vendor parsers (PDFCore subclasses) in dispatch order, see register_invoice_parser
+INVOICE_PARSERS = []
+_INVOICE_PARSERS_BY_NIP = {}
+NIP_RE = re.compile(r'NIP[:\s]*(?:PL)?\s*(\d[\d\s-]{8,12}\d)', re.IGNORECASE)
+
+
+def register_invoice_parser(parser_cls):
+    """
+    Class decorator adding a vendor layout parser to the dispatch registry.
+
+    The parser declares its fingerprint in FINGERPRINT_NIPS (seller NIPs) and/or
+    FINGERPRINT_MARKERS (patterns that must all be found in the page 1 text).
+    """
+    INVOICE_PARSERS.append(parser_cls)
+    for nip in parser_cls.FINGERPRINT_NIPS:
+        _INVOICE_PARSERS_BY_NIP[nip] = parser_cls
+    return parser_cls
+
+
+def detect_invoice_parser(first_page_text: str):
+    """Vendor parser class for the page 1 text of an invoice, or None for unknown layouts"""
+    # NIP lookup is a dict hit per NIP on the page, no per-vendor scanning
+    for match in NIP_RE.finditer(first_page_text):
+        parser_cls = _INVOICE_PARSERS_BY_NIP.get(re.sub(r"\D", "", match.group(1)))
+        if parser_cls:
+            return parser_cls
+
+    for parser_cls in INVOICE_PARSERS:
+        markers = parser_cls.FINGERPRINT_MARKERS
+        if markers and all(marker.search(first_page_text) for marker in markers):
+            return parser_cls
+
+    return None
+
+
+def get_invoice_parser(filepath: str | Path, **kwargs):
+    """
+    Instantiate the vendor parser matching the PDF, reading only its first page.
+
+    Raises:
+        InvoiceParseError: the file is not a readable PDF
+        UnknownInvoiceLayoutError: no registered parser recognizes the layout
+    """
+    try:
+        with pymupdf.open(filepath) as doc:
+            first_page_text = doc[0].get_text() if doc.page_count else ""
+    except pymupdf.FileDataError as e:
+        raise InvoiceParseError("Не вдалося відкрити PDF файл.") from e
+
+    parser_cls = detect_invoice_parser(first_page_text)
+    if parser_cls is None:
+        raise UnknownInvoiceLayoutError("Невідомий формат фактури: постачальника не розпізнано.")
+
+    logger.info(f"{filepath}: parsing with {parser_cls.__name__} ({parser_cls.VENDOR})")
+    return parser_cls(filepath, **kwargs)
+
+
+@register_invoice_parser
 class PDFCore:
+    # Bump on any change that alters parse() output: cached results are keyed by it
+    PARSER_VERSION = "5"
+    # Default layout: fuel invoices issued in Puchały
+    VENDOR = "puchaly"
+    FINGERPRINT_NIPS = ()
+    FINGERPRINT_MARKERS = (
+        re.compile(r'Faktura\s+numer', re.IGNORECASE),
+        # "ł" comes out mangled from some PDF font encodings
+        re.compile(r'Data\s+wystawienia:\s+Pucha.y', re.IGNORECASE),
+    )
     TABLE_FIELDS = ('id', 'item_name', 'amount', 'price_netto', 'price_netto2', 'tax_percent', 'tax_price', 'price_brutto')
     REG_FIELDS = [
         ("invoice_number", re.compile(r'Faktura\s+numer\s+([A-Z\d/]+)', re.IGNORECASE)),
@@ -589,9 +933,17 @@ class PDFCore:
         ("to_pay", re.compile(r'Do zapłaty\s+([\d,\s]*[\d,]*)\s+', re.IGNORECASE)),
     ]
 
-    def __init__(self, filepath: str|Path):
+    # "auto": rebuild tables from pymupdf geometry, pdfplumber for pages where that fails
+    TABLE_ENGINES = ("auto", "pymupdf", "pdfplumber")
+
+    def __init__(self, filepath: str|Path, workers: int | None = None, table_engine: str = "auto"):
+        if table_engine not in self.TABLE_ENGINES:
+            raise ValueError(f"Unknown table engine: {table_engine}")
         self.__filepath: Path = Path(filepath)
+        self.__workers: int = workers if workers is not None else settings.PDF_PARSE_WORKERS
+        self.__table_engine = table_engine
         self.__data = {'table': []}
+        self.__plumber = None
 
     def get_text_data(self, field: str|list, reg: re.Pattern|None, string: str) -> dict:
         if type(field) == str and type(reg) == re.Pattern:
@@ -609,220 +961,1566 @@ class PDFCore:
 
     def _validate_row(self, row: dict) -> dict:
         """Validate row calculations and return validation errors."""
+        return self._validate_amounts(
+            to_grosz(row.get('price_netto', 0)),
+            to_grosz(row.get('tax_price', 0)),
+            to_grosz(row.get('price_brutto', 0)),
+            row.get('tax_percent', 0),
+        )
+
+    @staticmethod
+    def _validate_amounts(netto: int, tax: int, brutto: int, tax_percent) -> dict:
+        """Row checks on amounts in integer grosz, exact unlike float comparison."""
         errors = {}
-        tolerance = 0.01  # Tolerance for floating point comparison
-        
-        price_netto = row.get('price_netto', 0.0)
-        tax_price = row.get('tax_price', 0.0)
-        price_brutto = row.get('price_brutto', 0.0)
-        tax_percent = row.get('tax_percent', 0)
-        
+
         # Check: price_netto + tax_price = price_brutto
-        expected_brutto = price_netto + tax_price
-        if abs(expected_brutto - price_brutto) > tolerance:
-            errors['price_brutto'] = f'Очікується {expected_brutto:.2f}, знайдено {price_brutto:.2f}'
+        expected_brutto = netto + tax
+        if abs(expected_brutto - brutto) > AMOUNT_TOLERANCE_GROSZ:
+            errors['price_brutto'] = f'Очікується {format_grosz(expected_brutto)}, знайдено {format_grosz(brutto)}'
             errors['tax_price'] = 'Не відповідає розрахунку'
-        
-        # Check: price_netto * (1 + tax_percent/100) = price_brutto
+
+        # Check: price_netto * (1 + tax_percent/100) = price_brutto, compared in 1/100 grosz
         if tax_percent > 0:
-            expected_brutto_from_percent = price_netto * (1 + tax_percent / 100)
-            if abs(expected_brutto_from_percent - price_brutto) > tolerance:
-                errors['tax_percent'] = f'Очікується {expected_brutto_from_percent:.2f}, знайдено {price_brutto:.2f}'
+            expected_brutto_from_percent = netto * (100 + tax_percent)
+            if abs(expected_brutto_from_percent - brutto * 100) > AMOUNT_TOLERANCE_GROSZ * 100:
+                expected = Decimal(expected_brutto_from_percent).scaleb(-4)
+                errors['tax_percent'] = f'Очікується {expected:.2f}, знайдено {format_grosz(brutto)}'
                 if 'price_brutto' not in errors:
                     errors['price_brutto'] = 'Не відповідає розрахунку з ПДВ'
-        
+
         return errors
 
-    def _extract_table_with_pdfplumber(self) -> list:
-        """Extract table data using pdfplumber."""
+    def _rows_from_table(self, table: list, page_no: int) -> list:
+        """Build validated rows from one page table (list of cell lists, header first)."""
         rows = []
         car_vin_re = re.compile(r'[A-Z0-9]{5,}')
 
-        with pdfplumber.open(self.__filepath) as pdf:
-            for page_no, page in enumerate(pdf.pages, start=1):
-                logger.info("Processing page %d", page_no)
+        headers = [h.strip() if h else "" for h in table[0]]
+
+        if len(headers) < 8:
+            logger.warning("Unexpected header format on page %d: %s", page_no, headers)
+            return rows
 
-                table = page.extract_table({
-                    "vertical_strategy": "lines",
-                    "horizontal_strategy": "lines",
-                    "intersection_tolerance": 5,
-                    "snap_tolerance": 5,
-                    "join_tolerance": 5,
-                })
+        for raw in table[1:]:
+            if not raw or not raw[0] or not raw[0].strip().isdigit():
+                continue
 
-                if not table:
-                    logger.warning("No table found on page %d", page_no)
+            try:
+                item_name = " ".join(filter(None, raw[1].split())) if raw[1] else ""
+                # Decode Unicode escape sequences
+                item_name = decode_unicode_escapes(item_name)
+                # Truncate item_name to 1000 characters to avoid database error
+                if len(item_name) > 1000:
+                    item_name = item_name[:997] + "..."
+                
+                # Each money cell is parsed once, to integer grosz; the row keeps JSON-friendly
+                # floats, grosz / 100 is exactly the float of the printed two-decimal amount
+                price_netto = parse_pl_grosz(raw[3]) if raw[3] else 0
+                tax_price = parse_pl_grosz(raw[6]) if raw[6] else 0
+                price_brutto = parse_pl_grosz(raw[7]) if raw[7] else 0
+                tax_percent = int(re.sub(r"[^\d]", "", raw[5])) if raw[5] else 23
+
+                row = {
+                    'id': int(raw[0]),
+                    'item_name': item_name,
+                    'amount': int(re.sub(r"[^\d]", "", raw[2])) if raw[2] else 1,
+                    'price_netto': price_netto / 100,
+                    'price_netto2': parse_pl_grosz(raw[4]) / 100 if raw[4] else 0.0,
+                    'tax_percent': tax_percent,
+                    'tax_price': tax_price / 100,
+                    'price_brutto': price_brutto / 100,
+                }
+                
+                # Extract VIN if present in item_name
+                vin_match = car_vin_re.search(item_name)
+                if vin_match:
+                    row['current_car_vin'] = vin_match.group(0)
+                
+                # Validate row calculations
+                validation_errors = self._validate_amounts(price_netto, tax_price, price_brutto, tax_percent)
+                if validation_errors:
+                    row['validation_errors'] = validation_errors
+                
+                rows.append(row)
+
+            except Exception as e:
+                logger.warning("Skipped row %s (%s)", raw, e)
+
+        return rows
+
+    def _pdfplumber_page_rows(self, page) -> list:
+        """
+        Table rows of one pdfplumber page. The page is closed afterwards: pdfplumber
+        keeps parsed layout objects of every page it has touched until then.
+        """
+        page_no = page.page_number
+        logger.info("Processing page %d", page_no)
+
+        try:
+            table = page.extract_table(PDFPLUMBER_TABLE_SETTINGS)
+        finally:
+            page.close()
+
+        if not table:
+            logger.warning("No table found on page %d", page_no)
+            return []
+
+        return self._rows_from_table(table, page_no)
+
+    def _rows_from_pages(self, pages) -> dict[int, list]:
+        """Table rows of pdfplumber pages, keyed by 1-based page number."""
+        rows_by_page = {}
+
+        for page in pages:
+            rows = self._pdfplumber_page_rows(page)
+            if rows:
+                rows_by_page[page.page_number] = rows
+
+        return rows_by_page
+
+    @staticmethod
+    def _table_from_drawings(page, words: list) -> list | None:
+        """
+        Rebuild the ruled table of a pymupdf page from its vector lines and words.
+
+        Returns rows of cell strings like pdfplumber's extract_table, [] for a page
+        without any ruling, or None when lines exist but do not form a usable grid
+        (caller falls back to pdfplumber).
+        """
+        tol = PDFPLUMBER_TABLE_SETTINGS["snap_tolerance"]
+        horizontal = []  # (y, x0, x1)
+        vertical = []  # (x, y0, y1)
+
+        for drawing in page.get_drawings():
+            for item in drawing["items"]:
+                if item[0] == "l":
+                    p1, p2 = item[1], item[2]
+                    if abs(p1.y - p2.y) <= tol:
+                        horizontal.append(((p1.y + p2.y) / 2, min(p1.x, p2.x), max(p1.x, p2.x)))
+                    elif abs(p1.x - p2.x) <= tol:
+                        vertical.append(((p1.x + p2.x) / 2, min(p1.y, p2.y), max(p1.y, p2.y)))
+                elif item[0] == "re":
+                    rect = item[1]
+                    if rect.height <= tol:
+                        horizontal.append(((rect.y0 + rect.y1) / 2, rect.x0, rect.x1))
+                    elif rect.width <= tol:
+                        vertical.append(((rect.x0 + rect.x1) / 2, rect.y0, rect.y1))
+                    else:
+                        horizontal += [(rect.y0, rect.x0, rect.x1), (rect.y1, rect.x0, rect.x1)]
+                        vertical += [(rect.x0, rect.y0, rect.y1), (rect.x1, rect.y0, rect.y1)]
+
+        if not horizontal and not vertical:
+            # No ruling at all: the "lines" strategy of pdfplumber would not find a table either
+            return []
+        if len(horizontal) < 2 or len(vertical) < 2:
+            return None
+
+        # Keep the largest group of crossing lines: that is the item table,
+        # other boxes on the page (logos, address frames) form separate groups
+        parent = list(range(len(horizontal) + len(vertical)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for hi, (y, x0, x1) in enumerate(horizontal):
+            for vi, (x, y0, y1) in enumerate(vertical):
+                if x0 - tol <= x <= x1 + tol and y0 - tol <= y <= y1 + tol:
+                    parent[find(hi)] = find(len(horizontal) + vi)
+
+        groups = {}
+        for i in range(len(parent)):
+            groups.setdefault(find(i), []).append(i)
+        table_group = max(groups.values(), key=len)
+
+        def snap(values: list) -> list:
+            snapped = []
+            for value in sorted(values):
+                if not snapped or value - snapped[-1] > tol:
+                    snapped.append(value)
+            return snapped
+
+        ys = snap([horizontal[i][0] for i in table_group if i < len(horizontal)])
+        xs = snap([vertical[i - len(horizontal)][0] for i in table_group if i >= len(horizontal)])
+
+        if len(ys) < 2 or len(xs) < 2:
+            return None
+
+        cells = [[[] for _ in range(len(xs) - 1)] for _ in range(len(ys) - 1)]
+        for word in words:
+            cx = (word[0] + word[2]) / 2
+            cy = (word[1] + word[3]) / 2
+            col = bisect.bisect(xs, cx) - 1
+            row = bisect.bisect(ys, cy) - 1
+            if 0 <= col < len(xs) - 1 and 0 <= row < len(ys) - 1:
+                cells[row][col].append(word)
+
+        table = []
+        for row_cells in cells:
+            row = []
+            for cell_words in row_cells:
+                lines = {}
+                # words come in reading order; block/line numbers group them into text lines
+                for word in cell_words:
+                    lines.setdefault((word[5], word[6]), []).append(word[4])
+                row.append("\n".join(" ".join(line) for line in lines.values()))
+            table.append(row)
+
+        return table
+
+    def _extract_table_with_pdfplumber(self, workers: int = 1, pages: list[int] | None = None) -> list:
+        """
+        Extract table data using pdfplumber.
+
+        With workers > 1 and at least PDF_PARALLEL_MIN_PAGES pages, page ranges are
+        split across a process pool (extract_table is CPU-bound pure Python) and
+        merged back in page order.
+        """
+        rows_by_page = self._pdfplumber_rows_by_page(workers, pages)
+        return [row for page_no in sorted(rows_by_page) for row in rows_by_page[page_no]]
+
+    def _pdfplumber_rows_by_page(self, workers: int = 1, pages: list[int] | None = None) -> dict[int, list]:
+        if pages is None:
+            with pdfplumber.open(self.__filepath) as pdf:
+                pages = list(range(1, len(pdf.pages) + 1))
+
+        if workers > 1 and len(pages) >= PDF_PARALLEL_MIN_PAGES:
+            return self._extract_table_parallel(pages, workers)
+
+        with pdfplumber.open(self.__filepath, pages=pages) as pdf:
+            return self._rows_from_pages(pdf.pages)
+
+    def _extract_table_parallel(self, pages: list[int], workers: int) -> dict[int, list]:
+        workers = min(workers, len(pages))
+        # Contiguous ranges keep each worker's pdfplumber caches local to its pages
+        chunk_size = -(-len(pages) // workers)
+        page_ranges = [pages[start:start + chunk_size] for start in range(0, len(pages), chunk_size)]
+        logger.info("Extracting %d pages with %d workers", len(pages), len(page_ranges))
+
+        # fork: children inherit loaded Django/pdfplumber modules and never touch the DB
+        with ProcessPoolExecutor(
+            max_workers=len(page_ranges),
+            mp_context=multiprocessing.get_context("fork"),
+        ) as executor:
+            chunks = executor.map(
+                _extract_table_rows_from_pages,
+                [str(self.__filepath)] * len(page_ranges),
+                page_ranges,
+            )
+            rows_by_page = {}
+            for chunk in chunks:
+                rows_by_page.update(chunk)
+
+        return rows_by_page
+
+    def _scan_header_blocks(self, blocks_sorted: list) -> dict:
+        """Header fields (REG_FIELDS) found in the sorted text blocks of one page"""
+        fields = {}
+        i = 0
+        n = len(blocks_sorted)
+
+        for pattern_field in self.REG_FIELDS:
+            while i < n:
+                line = blocks_sorted[i][4]
+
+                if isinstance(pattern_field, tuple):
+                    field, pattern = pattern_field
+                    field_data = self.get_text_data(field, pattern, line)
+                    i += 1
+                    if field_data:
+                        fields.update(field_data)
+                        break
                     continue
 
-                headers = [h.strip() if h else "" for h in table[0]]
+                if isinstance(pattern_field, list):
+                    field_data = self.get_text_data(pattern_field, None, line)
+                    i += 1
+                    if field_data:
+                        fields.update(field_data)
+                        break
+                    continue
+
+                if isinstance(pattern_field, re.Pattern):
+                    # Skip table header pattern - the table is extracted separately
+                    i += 1
+                    break
+
+        return fields
+
+    def _read_page(self, page) -> tuple[dict, list]:
+        """
+        Header fields and table rows of one pymupdf page: the geometry fast path,
+        then pdfplumber for pages it cannot handle (per table engine).
+        """
+        page_no = page.number + 1
+        textpage = page.get_textpage()
+        fields = self._scan_header_blocks(sorted(
+            page.get_text("blocks", textpage=textpage),
+            key=lambda b: (round(b[1], 1), round(b[0], 1))
+        ))
+
+        table = None
+        if self.__table_engine != "pdfplumber":
+            words = page.get_text("words", textpage=textpage)
+            table = self._table_from_drawings(page, words)
+        del textpage
+
+        if table == []:
+            return fields, []
+        rows = self._rows_from_table(table, page_no) if table else []
+
+        if not rows and self.__table_engine != "pymupdf":
+            logger.info("pdfplumber fallback for page %d", page_no)
+            if self.__plumber is None:
+                self.__plumber = pdfplumber.open(self.__filepath)
+            rows = self._pdfplumber_page_rows(self.__plumber.pages[page_no - 1])
+        return fields, rows
+
+    def _close_plumber(self) -> None:
+        if self.__plumber is not None:
+            self.__plumber.close()
+            self.__plumber = None
+
+    def _read_pages_parallel(self, page_count: int):
+        """
+        (fields, rows) of every page in page order, read by a process pool in
+        contiguous page ranges. Yields as soon as each range, in order, is done.
+        """
+        workers = min(self.__workers, page_count)
+        chunk_size = -(-page_count // workers)
+        page_ranges = [
+            list(range(start, min(start + chunk_size, page_count + 1)))
+            for start in range(1, page_count + 1, chunk_size)
+        ]
+        logger.info("Reading %d pages with %d workers", page_count, len(page_ranges))
+
+        # fork: children inherit loaded Django/pymupdf modules and never touch the DB
+        with ProcessPoolExecutor(
+            max_workers=len(page_ranges),
+            mp_context=multiprocessing.get_context("fork"),
+        ) as executor:
+            for chunk in executor.map(
+                _read_invoice_pages,
+                [str(self.__filepath)] * len(page_ranges),
+                page_ranges,
+                [self.__table_engine] * len(page_ranges),
+            ):
+                yield from chunk
+
+    def iter_table_rows(self):
+        """
+        Yield table rows page by page in a single pymupdf pass, collecting header
+        fields on the way (available from parse() output / after exhaustion).
+
+        Memory stays flat with the page count: each page's text page and, for pages
+        the geometry fast path cannot handle, the pdfplumber page are released
+        before the next page is read. With workers > 1 and at least
+        PDF_PARALLEL_MIN_PAGES pages (PDF_PARALLEL_MIN_PAGES_PYMUPDF for the cheaper
+        pymupdf engines) page ranges are read by a process pool and buffered per
+        range. Only extraction streams: parse() collects the rows into one list, see
+        parse_invoice_file_sandboxed().
+        """
+        self.__data = {'table': [], 'vendor': self.VENDOR}
+        prev_id = None
+
+        try:
+            with pymupdf.open(self.__filepath) as doc:
+                min_pages = (
+                    PDF_PARALLEL_MIN_PAGES if self.__table_engine == "pdfplumber"
+                    else PDF_PARALLEL_MIN_PAGES_PYMUPDF
+                )
+                if self.__workers > 1 and doc.page_count >= min_pages:
+                    pages = self._read_pages_parallel(doc.page_count)
+                else:
+                    pages = (self._read_page(page) for page in doc)
+
+                for fields, rows in pages:
+                    # Later pages win, as when the pages are read one by one
+                    self.__data.update(fields)
+                    for row in rows:
+                        if prev_id is not None and row['id'] <= prev_id:
+                            logger.warning("Non-monotonic row id %s after %s", row['id'], prev_id)
+                        prev_id = row['id']
+                        yield row
+        finally:
+            self._close_plumber()
+
+    def iter_row_batches(self, batch_size: int):
+        """
+        iter_table_rows() in lists of up to batch_size rows, summing the table total
+        on the way. Once exhausted, summary() has the header fields and the total check.
+        """
+        self.__table_total = 0
+        rows = self.iter_table_rows()
+        while batch := list(islice(rows, batch_size)):
+            self.__table_total += sum(to_grosz(row.get('price_brutto', 0)) for row in batch)
+            yield batch
+
+    def summary(self) -> dict:
+        """parse() output without 'table': header fields, vendor and total_validation_error"""
+        data = {key: value for key, value in self.__data.items() if key != 'table'}
+
+        # Compare the table total with the PDF total, in integer grosz
+        pdf_total = data.get('price_brutto') or data.get('to_pay')
+        if pdf_total:
+            pdf_total = to_grosz(pdf_total)
+            difference = abs(self.__table_total - pdf_total)
+            if difference > AMOUNT_TOLERANCE_GROSZ:
+                data['total_validation_error'] = {
+                    'expected': float(format_grosz(pdf_total)),
+                    'found': float(format_grosz(self.__table_total)),
+                    'difference': float(format_grosz(difference)),
+                }
+        return data
+
+    def parse(self):
+        """
+        Header fields and all table rows. The whole table is returned as one list;
+        parse_invoice_file_sandboxed() uses iter_row_batches() to pass it on in batches.
+        """
+        table_rows = []
+        try:
+            for batch in self.iter_row_batches(INGEST_BATCH_SIZE):
+                table_rows.extend(batch)
+            data = self.summary()
+        except Exception as e:
+            logger.error("Error extracting invoice table: %s", e)
+            table_rows = []
+            data = {key: value for key, value in self.__data.items() if key != 'table'}
+
+        data['table'] = table_rows
+        return data
+
+
+SERVICE_GAS_UUID = "63d70638-32be-4959-8496-598a0c651f9d"
+
+
+def _to_decimal(val, default="0") -> Decimal:
+    if not val:
+        return Decimal(default)
+    if isinstance(val, (int, float)):
+        return Decimal(str(val))
+    return parse_pl_decimal(str(val))
+
+
+def normalize_car_key(vin_or_plate: str | None) -> str:
+    """Form of VIN / license plate used for matching: stripped and uppercased"""
+    return (vin_or_plate or "").strip().upper()
+
 
-                if len(headers) < 8:
-                    logger.warning("Unexpected header format: %s", headers)
+def find_car_by_vin_or_plate(vin_or_plate: str | None) -> Car | None:
+    """Find car by VIN code or license plate"""
+    vin_or_plate = normalize_car_key(vin_or_plate)
+    if not vin_or_plate:
+        return None
+
+    # Try to find by VIN code first; iexact is served by the UPPER() functional indexes
+    car = Car.objects.filter(vin_code__iexact=vin_or_plate).first()
+    if car:
+        return car
+
+    # Try to find by license plate
+    return Car.objects.filter(license_plate__iexact=vin_or_plate).first()
+
+
+def get_cars_by_vin_or_plate(values) -> dict[str, Car]:
+    """
+    Resolve many VINs / license plates with a single query.
+
+    Returns:
+        Dict normalized VIN or plate -> Car. A VIN match wins over a plate
+        match for the same key, as in find_car_by_vin_or_plate.
+    """
+    keys = {normalize_car_key(value) for value in values} - {""}
+    if not keys:
+        return {}
+
+    cars = (
+        Car.objects
+        .annotate(vin_upper=Upper("vin_code"), plate_upper=Upper("license_plate"))
+        .filter(Q(vin_upper__in=keys) | Q(plate_upper__in=keys))
+    )
+
+    cars_by_key = {}
+    for car in cars:
+        if car.plate_upper in keys:
+            cars_by_key.setdefault(car.plate_upper, car)
+    for car in cars:
+        if car.vin_upper in keys:
+            cars_by_key[car.vin_upper] = car
+    return cars_by_key
+
+
+def store_invoice_file(pdf_file) -> tuple[str, str]:
+    """
+    Stream an uploaded PDF to content-addressed storage, hashing it while writing.
+    Identical uploads end up in the same MEDIA_ROOT/invoices/<aa>/<sha256>.pdf file.
+
+    Returns:
+        (sha256 hex digest, path relative to MEDIA_ROOT)
+    """
+    upload_dir = Path(settings.MEDIA_ROOT) / "invoices"
+    upload_dir.mkdir(parents=True, exist_ok=True)
+
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=upload_dir, suffix=".part", delete=False) as tmp:
+        try:
+            for chunk in pdf_file.chunks():
+                digest.update(chunk)
+                tmp.write(chunk)
+        except Exception:
+            os.unlink(tmp.name)
+            raise
+
+    file_hash = digest.hexdigest()
+    file_path = upload_dir / file_hash[:2] / f"{file_hash}.pdf"
+
+    if file_path.exists():
+        os.unlink(tmp.name)
+    else:
+        file_path.parent.mkdir(exist_ok=True)
+        os.replace(tmp.name, file_path)
+
+    return file_hash, str(file_path.relative_to(settings.MEDIA_ROOT))
+
+
+def create_invoice_for_upload(pdf_file, name: str, batch: InvoiceBatch | None = None) -> tuple[Invoice, bool]:
+    """
+    Save uploaded PDF and create an Invoice in "parsing" state.
+    Parsing itself is done later by the job worker (see core.jobs).
+    A duplicate keeps its original batch.
+
+    Returns:
+        (invoice, created) - created is False when the same file was already
+        uploaded, then the existing invoice is returned
+    """
+    file_hash, file_path = store_invoice_file(pdf_file)
+
+    existing = (
+        Invoice.objects
+        .filter(file_hash=file_hash)
+        .exclude(status=InvoiceStatusChoice.FAILED)
+        .order_by("created_at")
+        .first()
+    )
+    if existing:
+        logger.info(f"Invoice file {file_hash} already uploaded as {existing.uuid}")
+        return existing, False
+
+    invoice = Invoice.objects.create(
+        name=name,
+        file_path=file_path,
+        file_hash=file_hash,
+        original_filename=pdf_file.name,
+        status=InvoiceStatusChoice.PARSING,
+        batch=batch,
+    )
+    return invoice, True
+
+
+def iter_invoice_batch_files(uploaded_files):
+    """
+    Yield (filename, file, error) for every invoice of a batch upload.
+    PDFs are yielded as is, ZIP archives member by member: a member is read
+    straight from the archive while it is stored, never extracted as a whole.
+    file is None when error is set.
+    """
+    for uploaded in uploaded_files:
+        filename = Path(uploaded.name).name
+        suffix = Path(filename).suffix.lower()
+
+        if suffix == ".pdf":
+            yield filename, uploaded, ""
+            continue
+        if suffix != ".zip":
+            yield filename, None, "Файл не є PDF або ZIP"
+            continue
+
+        try:
+            archive = zipfile.ZipFile(uploaded)
+        except zipfile.BadZipFile:
+            yield filename, None, "Пошкоджений ZIP архів"
+            continue
+
+        with archive:
+            for info in archive.infolist():
+                member_name = Path(info.filename).name
+                # Directories and macOS metadata (__MACOSX/._invoice.pdf)
+                if info.is_dir() or not member_name or member_name.startswith("."):
+                    continue
+                if Path(member_name).suffix.lower() != ".pdf":
+                    yield member_name, None, "Файл не є PDF"
                     continue
+                # ZipExtFile never reads past the declared size, so this also bounds zip bombs
+                if info.file_size > settings.INVOICE_BATCH_MAX_FILE_SIZE:
+                    yield member_name, None, "Файл завеликий"
+                    continue
+                with archive.open(info) as member:
+                    yield member_name, File(member, name=member_name), ""
 
-                for raw in table[1:]:
-                    if not raw or not raw[0] or not raw[0].strip().isdigit():
-                        continue
 
-                    try:
-                        item_name = " ".join(filter(None, raw[1].split())) if raw[1] else ""
-                        # Decode Unicode escape sequences
-                        item_name = decode_unicode_escapes(item_name)
-                        # Truncate item_name to 1000 characters to avoid database error
-                        if len(item_name) > 1000:
-                            item_name = item_name[:997] + "..."
-                        
-                        row = {
-                            'id': int(raw[0]),
-                            'item_name': item_name,
-                            'amount': int(re.sub(r"[^\d]", "", raw[2])) if raw[2] else 1,
-                            'price_netto': to_float_pl(raw[3]) if raw[3] else 0.0,
-                            'price_netto2': to_float_pl(raw[4]) if raw[4] else 0.0,
-                            'tax_percent': int(re.sub(r"[^\d]", "", raw[5])) if raw[5] else 23,
-                            'tax_price': to_float_pl(raw[6]) if raw[6] else 0.0,
-                            'price_brutto': to_float_pl(raw[7]) if raw[7] else 0.0,
-                        }
-                        
-                        # Extract VIN if present in item_name
-                        vin_match = car_vin_re.search(item_name)
-                        if vin_match:
-                            row['current_car_vin'] = vin_match.group(0)
-                        
-                        # Validate row calculations
-                        validation_errors = self._validate_row(row)
-                        if validation_errors:
-                            row['validation_errors'] = validation_errors
-                        
-                        rows.append(row)
+def create_invoice_batch(uploaded_files, name: str = "") -> tuple[InvoiceBatch, list[Invoice]]:
+    """
+    Store every invoice of a multi-file / ZIP upload and record one batch entry per file.
+    Files are streamed to storage one at a time, so memory use does not grow with the batch.
+    Parsing is not started here, see jobs.enqueue_invoice_parses.
 
-                    except Exception as e:
-                        logger.warning("Skipped row %s (%s)", raw, e)
+    Returns:
+        (batch, newly created invoices) - duplicates and rejected files are only recorded in batch.entries
+    """
+    batch = InvoiceBatch.objects.create(name=name or f"Пакет від {timezone.localtime():%d.%m.%Y %H:%M}")
+    entries = []
+    created_invoices = []
+
+    for filename, pdf_file, error in iter_invoice_batch_files(uploaded_files):
+        if len(entries) >= settings.INVOICE_BATCH_MAX_FILES:
+            entries.append({
+                "filename": filename,
+                "invoice": None,
+                "duplicate": False,
+                "error": f"Перевищено ліміт {settings.INVOICE_BATCH_MAX_FILES} файлів, решту пропущено",
+            })
+            break
+
+        entry = {"filename": filename, "invoice": None, "duplicate": False, "error": error}
+        if pdf_file is not None:
+            try:
+                invoice, created = create_invoice_for_upload(pdf_file, filename[:55], batch=batch)
+            except Exception as e:
+                logger.exception(f"Error saving invoice {filename} of batch {batch.uuid}")
+                entry["error"] = f"Помилка збереження: {e}"
+            else:
+                entry["invoice"] = str(invoice.uuid)
+                entry["duplicate"] = not created
+                if created:
+                    created_invoices.append(invoice)
+        entries.append(entry)
 
-        return rows
+    batch.entries = entries
+    batch.save(update_fields=["entries", "updated_at"])
+    logger.info(f"Invoice batch {batch.uuid}: {len(entries)} file(s), {len(created_invoices)} new invoice(s)")
+    return batch, created_invoices
 
-    def parse(self):
-        self.__data = {'table': []}
-        
-        # Extract non-table data using pymupdf (existing logic)
-        doc = pymupdf.open(self.__filepath)
 
-        for page in doc:
-            blocks_sorted = sorted(
-                page.get_text("blocks"),
-                key=lambda b: (round(b[1], 1), round(b[0], 1))
-            )
+def get_invoice_batch_summary(batch: InvoiceBatch) -> dict:
+    """
+    Per-file results of a batch and its totals.
+    The outcome of each invoice comes from its latest finished parse job (see jobs.handle_invoice_parse),
+    so the summary takes two queries whatever the batch size.
 
-            i = 0
-            n = len(blocks_sorted)
-
-            for pattern_field in self.REG_FIELDS:
-                while i < n:
-                    line = blocks_sorted[i][4]
-
-                    if isinstance(pattern_field, tuple):
-                        field, pattern = pattern_field
-                        field_data = self.get_text_data(field, pattern, line)
-                        i += 1
-                        if field_data:
-                            self.__data.update(field_data)
-                            break
-                        continue
-
-                    if isinstance(pattern_field, list):
-                        field_data = self.get_text_data(pattern_field, None, line)
-                        i += 1
-                        if field_data:
-                            self.__data.update(field_data)
-                            break
-                        continue
-
-                    if isinstance(pattern_field, re.Pattern):
-                        # Skip table header pattern - we'll extract table with pdfplumber
-                        i += 1
-                        break
+    Returns:
+        Dict with:
+            - rows: List[Dict] - batch entry + invoice, result (job result dict or None)
+            - totals: Dict - files, created, duplicates, rejected, parsed, parsing, failed,
+              items_count, cars_matched, validation_errors, amount
+    """
+    invoice_uuids = {entry["invoice"] for entry in batch.entries if entry.get("invoice")}
+    invoices = {
+        str(invoice.uuid): invoice
+        for invoice in Invoice.objects
+        .filter(uuid__in=invoice_uuids)
+        .only("uuid", "name", "status", "parse_error", "invoice_amount")
+    }
+
+    results = {}
+    jobs = (
+        BackgroundJob.objects
+        .filter(
+            invoice_id__in=invoice_uuids,
+            job_type=BackgroundJobTypeChoice.INVOICE_PARSE,
+            status=BackgroundJobStatusChoice.DONE,
+        )
+        .order_by("finished_at")
+        .values_list("invoice_id", "result")
+    )
+    for invoice_id, result in jobs:
+        results[str(invoice_id)] = result
+
+    totals = {
+        "files": len(batch.entries),
+        "created": 0,
+        "duplicates": 0,
+        "rejected": 0,
+        "parsed": 0,
+        "parsing": 0,
+        "failed": 0,
+        "items_count": 0,
+        "cars_matched": 0,
+        "validation_errors": 0,
+        "amount": Decimal("0"),
+    }
+    rows = []
+    counted = set()
+
+    for entry in batch.entries:
+        invoice = invoices.get(entry.get("invoice"))
+        result = results.get(entry.get("invoice"))
+        rows.append({**entry, "invoice": invoice, "result": result})
+
+        if entry.get("error") or invoice is None:
+            totals["rejected"] += 1
+            continue
+        totals["duplicates" if entry.get("duplicate") else "created"] += 1
+
+        # The same file uploaded twice in one batch is counted once
+        if entry["invoice"] in counted:
+            continue
+        counted.add(entry["invoice"])
+
+        totals[invoice.status] += 1
+        if invoice.status == InvoiceStatusChoice.PARSED:
+            totals["amount"] += invoice.invoice_amount or 0
+        if result:
+            totals["items_count"] += result.get("items_count", 0)
+            totals["cars_matched"] += result.get("cars_matched", 0)
+            totals["validation_errors"] += result.get("validation_errors", 0)
+
+    return {"rows": rows, "totals": totals}
+
+
+BYTE_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class FileRange:
+    """Read-only window of `length` bytes of an open file, starting at `start`"""
+
+    def __init__(self, file, start: int, length: int):
+        self._file = file
+        self._remaining = length
+        file.seek(start)
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self) -> None:
+        self._file.close()
 
-        # Extract table data using pdfplumber
+
+def parse_byte_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    First and last byte of a single-range `Range: bytes=...` header.
+
+    Returns None when the header is absent, malformed or asks for several
+    ranges (the whole file is sent then). Raises ValueError when the range
+    lies outside the file.
+    """
+    match = BYTE_RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError(header)
+        return max(0, size - length), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first > last:
+        raise ValueError(header)
+    return first, last
+
+
+def protected_file_response(
+    request,
+    relative_path: str,
+    filename: str,
+    as_attachment: bool = False,
+    content_type: str = "application/pdf",
+    root: str | Path | None = None,
+    internal_url: str | None = None,
+):
+    """
+    Response serving a file stored under root (MEDIA_ROOT by default) to an already
+    authorized user.
+
+    With PROTECTED_MEDIA_SERVER = "nginx" only an X-Accel-Redirect header to
+    internal_url (PROTECTED_MEDIA_INTERNAL_URL by default) is returned and nginx
+    sends the bytes (and answers Range requests) from its internal location.
+    Otherwise the file is streamed in chunks with FileResponse, honouring single
+    byte ranges so PDF viewers can seek.
+    """
+    file_path = Path(root or settings.MEDIA_ROOT) / relative_path
+    if not file_path.is_file():
+        raise Http404("Файл не знайдено")
+
+    if settings.PROTECTED_MEDIA_SERVER == "nginx":
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = (internal_url or settings.PROTECTED_MEDIA_INTERNAL_URL) + quote(relative_path)
+        response["Content-Disposition"] = content_disposition_header(as_attachment, filename)
+        return response
+
+    stat = file_path.stat()
+    last_modified = http_date(stat.st_mtime)
+    byte_range = None
+    if_range = request.headers.get("If-Range")
+    if not if_range or if_range == last_modified:
         try:
-            table_rows = self._extract_table_with_pdfplumber()
-            self.__data['table'] = table_rows
-            
-            # Calculate total from table and compare with PDF total
-            total_from_table = sum(row.get('price_brutto', 0.0) for row in table_rows)
-            pdf_total = self.__data.get('price_brutto') or self.__data.get('to_pay')
-            
-            if pdf_total:
-                # Convert PDF total to float if it's a string
-                if isinstance(pdf_total, str):
-                    pdf_total_float = to_float_pl(pdf_total)
-                else:
-                    pdf_total_float = float(pdf_total)
-                
-                tolerance = 0.01
-                if abs(total_from_table - pdf_total_float) > tolerance:
-                    self.__data['total_validation_error'] = {
-                        'expected': pdf_total_float,
-                        'found': total_from_table,
-                        'difference': abs(total_from_table - pdf_total_float)
-                    }
-            
+            byte_range = parse_byte_range(request.headers.get("Range"), stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{stat.st_size}"
+            return response
+
+    file = open(file_path, "rb")  # noqa: SIM115 - FileResponse closes it when the response is done
+    if byte_range is None:
+        response = FileResponse(file, as_attachment=as_attachment, filename=filename, content_type=content_type)
+    else:
+        first, last = byte_range
+        response = FileResponse(
+            FileRange(file, first, last - first + 1),
+            status=206,
+            as_attachment=as_attachment,
+            filename=filename,
+            content_type=content_type,
+        )
+        response["Content-Length"] = last - first + 1
+        response["Content-Range"] = f"bytes {first}-{last}/{stat.st_size}"
+    response["Accept-Ranges"] = "bytes"
+    response["Last-Modified"] = last_modified
+    return response
+
+
+def _address_space_bytes() -> int:
+    """Current virtual memory size of this process (Linux), 0 if unknown"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+# Seconds of CPU time between the RLIMIT_CPU soft limit (SIGXCPU) and the hard one (SIGKILL)
+CPU_HARD_LIMIT_GRACE = 5
+
+
+def _parse_in_sandbox(filepath: str, cpu_seconds: int, memory_mb: int, conn) -> None:
+    """Runs in a forked child: apply resource limits, parse, send the outcome to the parent."""
+    # Own process group, so the parent can kill anything the parse starts along with it
+    os.setsid()
+    # Forked from a job worker: its SIGTERM handler must not run here, the parent kills us
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        if cpu_seconds:
+            # Soft limit sends SIGXCPU, hard limit SIGKILL shortly after
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + CPU_HARD_LIMIT_GRACE))
+        if memory_mb:
+            # On top of what the forked interpreter already maps
+            limit = _address_space_bytes() + memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+        # One process: rlimits are per process, a page pool would multiply the budget
+        parser = get_invoice_parser(filepath, workers=1)
+        result = {"status": "ok", "discard_rows": False}
+        try:
+            # Rows cross the pipe batch by batch: the child never holds or pickles the whole table
+            for batch in parser.iter_row_batches(INGEST_BATCH_SIZE):
+                conn.send({"status": "rows", "rows": batch})
+            result["data"] = parser.summary()
+        except MemoryError:
+            raise
         except Exception as e:
-            logger.error("Error extracting table with pdfplumber: %s", e)
-            self.__data['table'] = []
+            # As PDFCore.parse(): a broken table yields no rows, the parent drops the batches sent so far
+            logger.error("Error extracting invoice table: %s", e)
+            result["data"] = {}
+            result["discard_rows"] = True
+    except MemoryError:
+        result = {"status": "error", "reason": "memory"}
+    except InvoiceParseError as e:
+        result = {"status": "error", "reason": "invalid", "message": str(e)}
+    except Exception as e:
+        logger.exception(f"Sandboxed parse of {filepath} failed: {e}")
+        result = {"status": "error", "reason": "error", "message": str(e)}
+
+    peak_kb = (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+    result["peak_memory_mb"] = round(peak_kb / 1024, 1)
+    conn.send(result)
+    conn.close()
+
+
+def _kill_sandbox(process) -> None:
+    """SIGKILL the sandbox child and its process group"""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        # Killed before it called setsid()
+        process.kill()
+
+
+def _children_cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def parse_invoice_file_sandboxed(
+    filepath: str | Path,
+    timeout: int | None = None,
+    cpu_seconds: int | None = None,
+    memory_mb: int | None = None,
+) -> dict:
+    """
+    Run the vendor parser in a child process with CPU time / address space limits
+    and a wall-clock timeout, so a hostile or huge PDF cannot take the worker down.
+
+    The child streams table rows in batches of INGEST_BATCH_SIZE, so its memory and
+    each pipe message stay bounded by the batch. This process still assembles
+    data["table"] in full: invoice_data, InvoiceParseCache and the re-parse diff keep
+    the whole table, so memory here remains O(rows).
+
+    Returns:
+        Dict with keys:
+            - status: "ok" or "error"
+            - data: Dict - parser output (status "ok")
+            - reason: str - timeout, cpu, memory, invalid, crashed or error (status "error")
+            - message: str - user-facing error (status "error")
+            - duration_s: float - wall-clock parse time
+            - peak_memory_mb: float | None - peak RSS of the parse process (and its children)
+    """
+    timeout = timeout if timeout is not None else settings.PDF_PARSE_TIMEOUT
+    cpu_seconds = cpu_seconds if cpu_seconds is not None else settings.PDF_PARSE_CPU_SECONDS
+    memory_mb = memory_mb if memory_mb is not None else settings.PDF_PARSE_MAX_MEMORY_MB
+
+    ctx = multiprocessing.get_context("fork")
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_parse_in_sandbox, args=(str(filepath), cpu_seconds, memory_mb, child_conn))
+
+    started = time.monotonic()
+    # CPU time of the child, read once it is reaped
+    children_cpu = _children_cpu_seconds()
+    process.start()
+    child_conn.close()
+
+    deadline = started + timeout if timeout else None
+    rows = []
+    result = None
+    timed_out = False
+    try:
+        while result is None:
+            # poll() also returns when the child dies and closes the pipe
+            timed_out = not parent_conn.poll(None if deadline is None else max(deadline - time.monotonic(), 0))
+            if timed_out:
+                break
+            message = parent_conn.recv()
+            if message["status"] == "rows":
+                rows.extend(message["rows"])
+            else:
+                result = message
+    except EOFError:
+        pass
+    except BaseException:
+        # Worker shutdown mid-parse: the child must not outlive it
+        _kill_sandbox(process)
+        process.join()
+        raise
+    finally:
+        parent_conn.close()
+
+    if timed_out:
+        _kill_sandbox(process)
+    process.join()
+    duration = round(time.monotonic() - started, 3)
+    cpu_used = _children_cpu_seconds() - children_cpu
+
+    if result is not None and result["status"] == "ok":
+        result["data"]["table"] = [] if result.pop("discard_rows") else rows
+
+    if result is None:
+        if timed_out:
+            reason = "timeout"
+        elif process.exitcode == -signal.SIGXCPU:
+            reason = "cpu"
+        elif process.exitcode == -signal.SIGKILL and cpu_seconds and cpu_used >= cpu_seconds:
+            # RLIMIT_CPU hard limit: the parse ignored or outlived SIGXCPU
+            reason = "cpu"
+        elif process.exitcode == -signal.SIGKILL:
+            # Not killed by us: the kernel OOM killer
+            reason = "memory"
+        else:
+            reason = "crashed"
+        result = {"status": "error", "reason": reason, "peak_memory_mb": None}
+
+    result["duration_s"] = duration
+    if result["status"] == "error" and not result.get("message"):
+        result["message"] = {
+            "timeout": f"Обробка PDF триває занадто довго (ліміт {timeout} с).",
+            "cpu": f"Обробка PDF триває занадто довго (ліміт {cpu_seconds} с процесорного часу).",
+            "memory": f"PDF завеликий: перевищено ліміт пам'яті ({memory_mb} МБ).",
+            "crashed": "Процес обробки PDF аварійно завершився.",
+        }.get(result["reason"], "Помилка обробки PDF.")
+
+    logger.info(
+        f"Parsed {filepath} in sandbox: {result['status']} {result.get('reason', '')} "
+        f"{duration}s, peak {result['peak_memory_mb']} MB"
+    )
+    return result
+
+
+def get_parsed_invoice_data(invoice: Invoice) -> dict:
+    """
+    Vendor parser output for the invoice file, cached per file hash and parser version.
+    Parsing runs in the sandbox, its duration and peak memory go to invoice.parse_stats.
+
+    Raises:
+        InvoiceParseError: unknown layout, unreadable file, or the PDF hit a sandbox limit
+    """
+    file_path = Path(settings.MEDIA_ROOT) / invoice.file_path
+
+    if invoice.file_hash:
+        cached = InvoiceParseCache.objects.filter(
+            file_hash=invoice.file_hash,
+            parser_version=PDFCore.PARSER_VERSION,
+        ).values_list("data", flat=True).first()
+        if cached is not None:
+            logger.info(f"Parse cache hit for {invoice.file_hash}")
+            invoice.parse_stats = {"cached": True}
+            return cached
+
+    result = parse_invoice_file_sandboxed(file_path)
+    invoice.parse_stats = {
+        "cached": False,
+        "duration_s": result["duration_s"],
+        "peak_memory_mb": result["peak_memory_mb"],
+    }
+
+    if result["status"] == "error":
+        invoice.parse_stats["reason"] = result["reason"]
+        Invoice.objects.filter(pk=invoice.pk).update(parse_stats=invoice.parse_stats)
+        if result["reason"] in ("error", "crashed"):
+            # Unexpected failure, the job worker retries it
+            raise RuntimeError(result["message"])
+        raise InvoiceParseError(result["message"])
+
+    parsed_data = result["data"]
+    if invoice.file_hash and parsed_data.get("table"):
+        InvoiceParseCache.objects.get_or_create(
+            file_hash=invoice.file_hash,
+            parser_version=PDFCore.PARSER_VERSION,
+            defaults={"data": parsed_data},
+        )
+    return parsed_data
 
-        return self.__data
+
+# Rows per ingest batch (one INSERT per model), keeps bulk_create well below the Postgres bind-parameter limit
+INGEST_BATCH_SIZE = 500
+
+
+def invoice_item_from_row(invoice: Invoice, row: dict) -> InvoiceItem:
+    """Unsaved InvoiceItem for a PDFCore table row, raises on malformed values"""
+    # Names are stored decoded, so views render them as is
+    item_name = decode_unicode_escapes(row.get("item_name", ""))
+
+    return InvoiceItem(
+        invoice=invoice,
+        item_id=str(row.get("id")),
+        item_name=item_name[:1000] if item_name else "",  # Ensure max length
+        amount=_to_decimal(row.get("amount", "1")),
+        price_netto=_to_decimal(row.get("price_netto")),
+        tax_percent=_to_decimal(row.get("tax_percent", "23")),
+        tax_price=_to_decimal(row.get("tax_price")),
+        price_brutto=_to_decimal(row.get("price_brutto")),
+        current_car_vin=row.get("current_car_vin"),
+    )
+
+
+def db_value_errors(instance) -> dict:
+    """
+    Values of an unsaved instance PostgreSQL would reject: too long strings, too many
+    digits before the decimal point, integers out of the column range. bulk_create()
+    fails the whole batch on one such value, so ingest checks rows up front and skips them.
+
+    Returns:
+        Dict field name -> error, empty when the instance can be inserted
+    """
+    errors = {}
+    for field in instance._meta.concrete_fields:
+        if field.primary_key or field.is_relation:
+            continue
+        value = getattr(instance, field.attname)
+        if value is None:
+            continue
+
+        if isinstance(field, DecimalField):
+            value = Decimal(str(value))
+            max_whole_digits = field.max_digits - field.decimal_places
+            if not value.is_finite() or (value and value.adjusted() >= max_whole_digits):
+                errors[field.name] = f"{value}: більше {max_whole_digits} цифр до коми"
+        elif isinstance(field, IntegerField):
+            # Ranges of the PostgreSQL column types; SQLite would accept anything
+            low, high = BaseDatabaseOperations.integer_field_ranges.get(field.get_internal_type(), (None, None))
+            if (low is not None and value < low) or (high is not None and value > high):
+                errors[field.name] = f"{value}: поза межами {low}..{high}"
+        elif field.max_length and isinstance(value, str) and len(value) > field.max_length:
+            errors[field.name] = f"довше {field.max_length} символів"
+    return errors
+
+
+INVOICE_OUTLAY_COMMENT_PREFIX = "Автоматично створено з фактури: "
+INVOICE_OUTLAY_COMMENT_RE = re.compile(
+    rf"^{INVOICE_OUTLAY_COMMENT_PREFIX}(?P<invoice>.*), позиція: (?P<item_id>\S+)$"
+)
+
+
+def invoice_outlay_comment(invoice: Invoice, item_id: str) -> str:
+    """Comment of an outlay created from an invoice line (the line itself is Outlay.invoice_item)"""
+    return f"{INVOICE_OUTLAY_COMMENT_PREFIX}{invoice.name}, позиція: {item_id}"
+
+
+def parse_invoice_outlay_comment(comment: str | None) -> tuple[str, str] | None:
+    """(invoice name, item id) of an invoice_outlay_comment(), None for other comments"""
+    match = INVOICE_OUTLAY_COMMENT_RE.match(comment or "")
+    if match is None:
+        return None
+    return match["invoice"], match["item_id"]
+
+
+def invoice_item_outlay(invoice: Invoice, item: InvoiceItem, service_gas: Service) -> tuple[OutlayAmount, Outlay]:
+    """Unsaved outlay (and its amount) booking an invoice line"""
+    # Same values create_outlay() would store; bulk_create skips OutlayAmount.save()
+    amount = OutlayAmount(
+        price_per_item=item.price_netto,
+        item_count=int(item.amount),
+        full_price=item.price_brutto,
+    )
+    outlay = Outlay(
+        type=OutlayTypeChoice.SERVICE,
+        service_name=service_gas.name,
+        name=item.item_name[:255] if item.item_name else f"Витрата з фактури {invoice.name}",
+        comment=invoice_outlay_comment(invoice, item.item_id),
+        amount=amount,
+        invoice_item=item,
+    )
+    return amount, outlay
+
+
+def ingest_invoice_rows(invoice: Invoice, parsed_data: dict) -> dict:
+    """
+    Create InvoiceItem rows (and outlays for matched cars) from PDFCore output.
+
+    parsed_data["table"] may be any iterable of rows (e.g. PDFCore.iter_table_rows()).
+    Rows are consumed in batches of INGEST_BATCH_SIZE: each batch resolves its cars
+    with one query and is written with bulk_create, so queries grow per batch, not
+    per line, and memory stays bounded by the batch. Must be called inside a
+    transaction (see parse_invoice). Rows with values the database would reject
+    (see db_value_errors) are skipped and reported instead of failing the batch; a
+    line whose quantity does not fit an outlay keeps its item but gets no outlay.
+    Lines matched to a car by VIN suffix or edit distance get no outlay either: the
+    match is stored with needs_review and booked by confirm_invoice_car_match().
+
+    Returns:
+        Dict with keys:
+            - items_count: int - number of created items
+            - car_matches: Dict - item uuid -> matched car info
+            - validation_errors: Dict - item uuid -> row validation errors
+            - rejected_rows: Dict - row id -> field errors of the skipped rows
+            - rejected_outlays: Dict - item uuid -> field errors of outlays not booked
+    """
+    rows = iter(parsed_data.get("table", []))
+    total_amount = Decimal("0")
+    validation_errors_summary = {}
+    car_matches = {}  # Store car matches for UI display
+
+    # Get ServiceGas
+    service_gas = Service.objects.filter(uuid=SERVICE_GAS_UUID).first()
+    if service_gas is None:
+        logger.warning(f"ServiceGas with UUID {SERVICE_GAS_UUID} not found")
+
+    # Built lazily, most invoices match exactly
+    match_index = None
+    fuzzy_matches = {}
+    items_count = 0
+    outlays_count = 0
+    cost_keys = set()
+    rejected_rows = {}
+    rejected_outlays = {}
+
+    while batch := list(islice(rows, INGEST_BATCH_SIZE)):
+        cars_by_key = get_cars_by_vin_or_plate(row.get("current_car_vin") for row in batch)
+        items = []
+        amounts = []
+        outlays = []
+        outlay_cars = []
+
+        for row in batch:
+            try:
+                item = invoice_item_from_row(invoice, row)
+            except Exception:
+                logger.exception("Error creating invoice item", extra={"row": row})
+                continue
+
+            errors = db_value_errors(item)
+            if errors:
+                logger.warning(f"Invoice {invoice.uuid}: skipped row {item.item_id}: {errors}")
+                rejected_rows[item.item_id] = errors
+                continue
+
+            items.append(item)
+            total_amount += item.price_brutto
+
+            # Store validation errors if any
+            if row.get("validation_errors"):
+                validation_errors_summary[str(item.uuid)] = row["validation_errors"]
+
+            current_car_vin = item.current_car_vin
+            if not current_car_vin:
+                continue
+
+            car = cars_by_key.get(normalize_car_key(current_car_vin))
+            if car is not None:
+                car_match = {
+                    'car_uuid': str(car.uuid),
+                    'car_name': f"{car.mark} {car.model} {car.year}",
+                    'vin_or_plate': current_car_vin
+                }
+            else:
+                # OCR noise, partial VIN, spaced plate - fuzzy match against the whole fleet
+                fuzzy_key = (current_car_vin, item.item_name)
+                if fuzzy_key not in fuzzy_matches:
+                    if match_index is None:
+                        match_index = get_car_match_index()
+                    fuzzy_matches[fuzzy_key] = match_index.match(current_car_vin, item.item_name)
+                fuzzy = fuzzy_matches[fuzzy_key]
+
+                if fuzzy is None:
+                    car_matches[str(item.uuid)] = {
+                        'car_found': False,
+                        'vin_or_plate': current_car_vin
+                    }
+                    continue
+
+                car_match = {
+                    'car_uuid': fuzzy["car_uuid"],
+                    'car_name': fuzzy["car_name"],
+                    'vin_or_plate': current_car_vin,
+                    'match_method': fuzzy["method"],
+                    'matched_key': fuzzy["key"],
+                    'needs_review': fuzzy["needs_review"],
+                }
+
+            car_matches[str(item.uuid)] = car_match
+            if car_match.get('needs_review'):
+                # Booked by confirm_invoice_car_match() once a user checks the car
+                continue
+
+            if service_gas:
+                amount, outlay = invoice_item_outlay(invoice, item, service_gas)
+                errors = db_value_errors(amount)
+                if errors:
+                    logger.warning(f"Invoice {invoice.uuid}: no outlay for row {item.item_id}: {errors}")
+                    rejected_outlays[str(item.uuid)] = errors
+                    continue
+                amounts.append(amount)
+                outlays.append(outlay)
+                outlay_cars.append(Outlay.cars.through(outlay_id=outlay.uuid, car_id=car_match['car_uuid']))
+
+        InvoiceItem.objects.bulk_create(items)
+        OutlayAmount.objects.bulk_create(amounts)
+        Outlay.objects.bulk_create(outlays)
+        Outlay.cars.through.objects.bulk_create(outlay_cars)
+        if outlays:
+            cost_keys |= outlay_cost_keys([outlay.pk for outlay in outlays])
+        items_count += len(items)
+        outlays_count += len(outlays)
+
+    refresh_car_cost_monthly(cost_keys)
+
+    logger.info(f"Invoice {invoice.uuid}: created {items_count} items and {outlays_count} outlays")
+
+    invoice.invoice_amount = total_amount
+
+    # Store validation errors, total validation, and car matches in invoice_data
+    if validation_errors_summary:
+        invoice.invoice_data["validation_errors"] = validation_errors_summary
+    if parsed_data.get("total_validation_error"):
+        invoice.invoice_data["total_validation_error"] = parsed_data["total_validation_error"]
+    if car_matches:
+        invoice.invoice_data["car_matches"] = car_matches
+    if rejected_rows:
+        invoice.invoice_data["rejected_rows"] = rejected_rows
+    if rejected_outlays:
+        invoice.invoice_data["rejected_outlays"] = rejected_outlays
+
+    return {
+        "items_count": items_count,
+        "car_matches": car_matches,
+        "validation_errors": validation_errors_summary,
+        "rejected_rows": rejected_rows,
+        "rejected_outlays": rejected_outlays,
+    }
+
+
+def confirm_invoice_car_match(item: InvoiceItem) -> Outlay | None:
+    """
+    Book an invoice line whose car was only suggested (needs_review, see ingest_invoice_rows)
+    after a user checked it: create its outlay for the suggested car.
+
+    Returns:
+        The created outlay, None when the line has no suggestion to confirm
+    """
+    with transaction.atomic():
+        # Locked: a double click must not book the line twice
+        invoice = Invoice.objects.select_for_update().get(pk=item.invoice_id)
+        car_match = invoice.invoice_data.get("car_matches", {}).get(str(item.uuid))
+        if not car_match or not car_match.get("needs_review"):
+            return None
+        if not Car.objects.filter(uuid=car_match["car_uuid"]).exists():
+            logger.warning(f"Invoice {invoice.uuid}: suggested car {car_match['car_uuid']} no longer exists")
+            return None
+        service_gas = Service.objects.filter(uuid=SERVICE_GAS_UUID).first()
+        if service_gas is None:
+            logger.warning(f"ServiceGas with UUID {SERVICE_GAS_UUID} not found")
+            return None
+
+        amount, outlay = invoice_item_outlay(invoice, item, service_gas)
+        errors = db_value_errors(amount)
+        if errors:
+            logger.warning(f"Invoice {invoice.uuid}: no outlay for row {item.item_id}: {errors}")
+            invoice.invoice_data.setdefault("rejected_outlays", {})[str(item.uuid)] = errors
+            outlay = None
+        else:
+            amount.save()
+            outlay.save()
+            outlay.cars.add(car_match["car_uuid"])
+            refresh_car_cost_monthly(outlay_cost_keys([outlay.pk]))
+
+        car_match["needs_review"] = False
+        car_match["confirmed"] = True
+        invoice.save(update_fields=["invoice_data", "updated_at"])
+
+    return outlay
+
+
+def parse_invoice(invoice: Invoice, progress=None) -> dict:
+    """
+    Parse the stored PDF of an invoice and create its items.
+
+    Args:
+        invoice: Invoice in "parsing" state with file_path set
+        progress: optional callable(percent, message) for status reporting
+
+    Returns:
+        Summary dict from ingest_invoice_rows
+
+    Raises:
+        InvoiceParseError: if the vendor layout is unknown or no table rows were found in the PDF
+    """
+    def report(percent: int, message: str):
+        if progress:
+            progress(percent, message)
+
+    report(10, "Читання PDF")
+    parsed_data = get_parsed_invoice_data(invoice)
+
+    if not parsed_data.get("table"):
+        logger.warning("No table data found", extra={"parsed_data": parsed_data})
+        raise InvoiceParseError("Не вдалося знайти позиції у фактурі. Формат PDF не підтримується.")
+
+    report(60, "Створення позицій фактури")
+    with transaction.atomic():
+        invoice.invoice_data = dict(parsed_data)
+        summary = ingest_invoice_rows(invoice, parsed_data)
+        invoice.status = InvoiceStatusChoice.PARSED
+        invoice.parse_error = ""
+        invoice.parser_version = PDFCore.PARSER_VERSION
+        invoice.save(update_fields=[
+            "invoice_data", "invoice_amount", "status", "parse_error", "parser_version", "parse_stats", "updated_at",
+        ])
+
+    report(100, "Готово")
+    return summary
+
+
+# Item fields refreshed by a re-parse, a changed current_car_vin replaces the item instead
+INVOICE_ITEM_DIFF_FIELDS = ["item_name", "amount", "price_netto", "tax_percent", "tax_price", "price_brutto"]
+
+
+def _comparable(value):
+    """Parsed values may carry more decimals than the DB column keeps"""
+    if isinstance(value, Decimal):
+        return value.quantize(Decimal("0.01"))
+    return value
+
+
+def diff_invoice_items(invoice: Invoice, rows: list[dict]) -> dict:
+    """
+    Compare freshly parsed rows with the stored items of an invoice, matched by item_id (the LP column).
+
+    Returns:
+        Dict with keys:
+            - added: List[Dict] - rows without a stored item, or whose VIN changed
+            - changed: List[InvoiceItem] - stored items with the new values already set
+            - removed: List[InvoiceItem] - stored items missing from the rows, or whose VIN changed
+            - unchanged: int
+            - rows: Dict - item_id -> row
+    """
+    stored = {}
+    removed = []
+    for item in invoice.items.all():
+        if item.item_id in stored:
+            removed.append(item)
+        else:
+            stored[item.item_id] = item
+
+    added = []
+    changed = []
+    unchanged = 0
+    rows_by_id = {}
+
+    for row in rows:
+        try:
+            fresh = invoice_item_from_row(invoice, row)
+        except Exception:
+            logger.exception("Error creating invoice item", extra={"row": row})
+            continue
+        rows_by_id[fresh.item_id] = row
+
+        item = stored.pop(fresh.item_id, None)
+        errors = db_value_errors(fresh)
+        if errors:
+            # Keep what is stored rather than write values the database rejects
+            logger.warning(f"Invoice {invoice.uuid}: ignored re-parsed row {fresh.item_id}: {errors}")
+            if item is not None:
+                unchanged += 1
+        elif item is None:
+            added.append(row)
+        elif (item.current_car_vin or None) != (fresh.current_car_vin or None):
+            # The line now points to another car: recreate it so its outlay is re-matched
+            removed.append(item)
+            added.append(row)
+        elif any(_comparable(getattr(item, f)) != _comparable(getattr(fresh, f)) for f in INVOICE_ITEM_DIFF_FIELDS):
+            for field in INVOICE_ITEM_DIFF_FIELDS:
+                setattr(item, field, getattr(fresh, field))
+            changed.append(item)
+        else:
+            unchanged += 1
+
+    removed.extend(stored.values())
+    return {"added": added, "changed": changed, "removed": removed, "unchanged": unchanged, "rows": rows_by_id}
+
+
+def apply_invoice_reparse(invoice: Invoice, parsed_data: dict, diff: dict) -> dict:
+    """
+    Write a diff_invoice_items() result in bulk: changed items and the amounts of their
+    outlays are updated, removed items are deleted together with their outlays, added
+    rows go through ingest_invoice_rows (car matching, outlays). Unchanged items and
+    their outlays are left as they are. Must be called inside a transaction.
+
+    Returns:
+        Dict with added, changed, removed and unchanged item counts
+    """
+    changed, removed, added = diff["changed"], diff["removed"], diff["added"]
+
+    outlays_by_item = {}
+    if changed or removed or added:
+        # Only linked outlays: invoice names are not unique, so a comment cannot tell
+        # which invoice an unlinked outlay came from (backfill_outlay_invoice_items links them)
+        outlays = Outlay.objects.filter(invoice_item__invoice=invoice).select_related("amount")
+        for outlay in outlays:
+            outlays_by_item.setdefault(outlay.invoice_item_id, []).append(outlay)
+
+    cost_keys = set()
+    if changed:
+        InvoiceItem.objects.bulk_update(changed, INVOICE_ITEM_DIFF_FIELDS, batch_size=INGEST_BATCH_SIZE)
+        outlays = []
+        amounts = []
+        now = timezone.now()
+        for item in changed:
+            amount = OutlayAmount(
+                price_per_item=item.price_netto,
+                item_count=int(item.amount),
+                full_price=item.price_brutto,
+            )
+            amount_valid = not db_value_errors(amount)
+            for outlay in outlays_by_item.get(item.pk, []):
+                outlay.name = item.item_name[:255] if item.item_name else outlay.name
+                outlay.updated_at = now
+                outlays.append(outlay)
+                if amount_valid:
+                    outlay.amount.price_per_item = amount.price_per_item
+                    outlay.amount.item_count = amount.item_count
+                    outlay.amount.full_price = amount.full_price
+                    amounts.append(outlay.amount)
+        Outlay.objects.bulk_update(outlays, ["name", "updated_at"], batch_size=INGEST_BATCH_SIZE)
+        OutlayAmount.objects.bulk_update(
+            amounts, ["price_per_item", "item_count", "full_price"], batch_size=INGEST_BATCH_SIZE,
+        )
+        cost_keys |= outlay_cost_keys([outlay.pk for outlay in outlays])
+
+    # Outlays of removed items (including those re-added with another VIN: ingest creates their outlays anew)
+    stale_outlays = [outlay for item in removed for outlay in outlays_by_item.get(item.pk, [])]
+    if stale_outlays:
+        cost_keys |= outlay_cost_keys([outlay.pk for outlay in stale_outlays])
+        Outlay.objects.filter(pk__in=[outlay.pk for outlay in stale_outlays]).delete()
+        # Outlay.amount is PROTECT, amounts go after their outlays
+        OutlayAmount.objects.filter(pk__in=[outlay.amount_id for outlay in stale_outlays]).delete()
+    # Added rows are rolled up by ingest_invoice_rows below
+    refresh_car_cost_monthly(cost_keys)
+    if removed:
+        InvoiceItem.objects.filter(pk__in=[item.pk for item in removed]).delete()
+
+    old_car_matches = (invoice.invoice_data or {}).get("car_matches", {})
+    invoice.invoice_data = dict(parsed_data)
+    summary = ingest_invoice_rows(invoice, {"table": added})
+
+    # Car matches and validation errors are keyed by item uuid, rebuilt for the items that exist now
+    car_matches = {}
+    validation_errors = {}
+    for item_uuid, item_id in invoice.items.values_list("uuid", "item_id"):
+        item_uuid = str(item_uuid)
+        car_match = summary["car_matches"].get(item_uuid) or old_car_matches.get(item_uuid)
+        if car_match:
+            car_matches[item_uuid] = car_match
+        # Validation errors follow the new rows of every item, not only the added ones
+        row_errors = diff["rows"].get(item_id, {}).get("validation_errors")
+        if row_errors:
+            validation_errors[item_uuid] = row_errors
+
+    for key, value in (("car_matches", car_matches), ("validation_errors", validation_errors)):
+        if value:
+            invoice.invoice_data[key] = value
+        else:
+            invoice.invoice_data.pop(key, None)
+
+    invoice.invoice_amount = invoice.items.aggregate(total=Sum("price_brutto"))["total"] or Decimal("0")
+    invoice.status = InvoiceStatusChoice.PARSED
+    invoice.parse_error = ""
+    invoice.parser_version = PDFCore.PARSER_VERSION
+    invoice.save(update_fields=[
+        "invoice_data", "invoice_amount", "status", "parse_error", "parser_version", "parse_stats", "updated_at",
+    ])
+
+    return {
+        "added": summary["items_count"],
+        "changed": len(changed),
+        "removed": len(removed),
+        "unchanged": diff["unchanged"],
+    }
 
 
 def create_car_service_plan(plan_schema: dict, current_mileage: int) -> list:
     """
     Створює розрахований план сервісів з визначеними статусами на основі поточного пробігу.
-    
-    Статуси:
+
+    Статуси, next_service та overdue_km рахує service_status.compute_service_status():
     - UNKNOWN: якщо last_service_km == 0
     - CRITICAL: якщо пробіг перевищив next_service_km більш ніж на 20%
     - IMPORTANT: якщо пробіг наближається до next_service_km (за 10% до або вже перевищив)
     - NORMAL: якщо ще є час до наступного сервісу
     """
-    from .models import ServiceStatusChoice
-    
     services = plan_schema.get("services")
 
     if not services:
         raise ValueError("No services found in schema")
 
-    result = []
-
-    for service in services:
-        service = service.copy()
-
-        last_service = service.get("last_service_km", 0)
-        interval = service.get("interval_km", 0)
-
-        if last_service == 0:
-            service["status"] = ServiceStatusChoice.UNKNOWN
-            service["next_service"] = None
-            result.append(service)
-            continue
-
-        # Обчислюємо next_service_km
-        next_service_km = last_service + interval
-        service["next_service"] = next_service_km
-
-        # Визначаємо статус на основі поточного пробігу та next_service_km
-        # Критично - якщо пробіг перевищив next_service_km більш ніж на 20%
-        # Важливо - якщо пробіг наближається до next_service_km (за 10% до або вже перевищив)
-        # В Нормі - якщо ще є час до наступного сервісу
-        if current_mileage >= next_service_km * 1.2:  # Перевищено більш ніж на 20%
-            service["status"] = ServiceStatusChoice.CRITICAL  # Критично
-        elif current_mileage >= next_service_km:  # Перевищено або досягнуто
-            service["status"] = ServiceStatusChoice.IMPORTANT  # Важливо
-        elif current_mileage > next_service_km - (interval * 0.1):  # За 10% до наступного сервісу
-            service["status"] = ServiceStatusChoice.IMPORTANT  # Важливо
-        else:
-            service["status"] = ServiceStatusChoice.NORMAL  # В Нормі
-
-        result.append(service)
-
-    return result
+    return evaluate_service_plans([(current_mileage, services)])[0]
 
 def save_or_update_car_service_state(car, service_plan: dict, mileage: int) -> CarServiceState:
     """Зберегти або оновити CarServiceState з розрахованими сервісами"""
@@ -892,7 +2590,7 @@ def recalculate_car_service_plan(car_id, new_mileage: int):
 def create_service_events_from_services(car, services: list, mileage: int):
     """
     Створює ServiceEvent записи безпосередньо зі списку сервісів.
-    Враховує всі поля моделі ServiceEvent включаючи статуси.
+    Статуси та next_service_km рахує service_status.compute_service_status().
     
     Args:
         car: Car instance
@@ -910,77 +2608,50 @@ def create_service_events_from_services(car, services: list, mileage: int):
     
     if not isinstance(services, list):
         raise ValueError("services повинно бути списком")
-    
-    created_events = []
+
+    services = [service for service in services if isinstance(service, dict)]
+    columns = service_plan_columns([(mileage, services)])
+    result = compute_service_status(columns["last_service_km"], columns["interval_km"], mileage)
+
+    # Existing events of the car in one query, to avoid duplicates
+    existing = set(
+        ServiceEvent.objects.filter(car=car).values_list("service_type", "last_service_km")
+    )
     today = date.today()
-    
-    for service in services:
-        if not isinstance(service, dict):
-            continue
-        
-        # Отримуємо дані з сервісу
-        last_service_km = service.get("last_service_km", 0)
-        interval_km = service.get("interval_km", 0)
-        
-        # Визначаємо service_type
+    created_events = []
+
+    rows = zip(
+        services,
+        columns["last_service_km"].tolist(),
+        columns["interval_km"].tolist(),
+        result["known"].tolist(),
+        result["next_service_km"].tolist(),
+        result["status"].tolist(),
+        strict=True,
+    )
+    for service, last_service_km, interval_km, known, next_service_km, status in rows:
+        # service_type обмежено 50 символами (максимум для поля)
         service_type = service.get("name", service.get("key", "Unknown Service"))
-        
-        # Обмежуємо довжину service_type до 50 символів (максимум для поля)
         if len(service_type) > 50:
             service_type = service_type[:47] + "..."
-        
-        # Обчислюємо next_service_km
-        if last_service_km > 0:
-            next_service_km = last_service_km + interval_km
-        else:
-            # Для невідомих сервісів встановлюємо next_service_km на основі поточного пробігу
-            next_service_km = mileage + interval_km if interval_km > 0 else mileage
-        
-        # Визначаємо статус на основі поточного пробігу та next_service_km
-        from .models import ServiceStatusChoice
-        
-        if last_service_km == 0:
-            status = ServiceStatusChoice.UNKNOWN
-            is_completed = False
-        else:
-            # Визначаємо статус на основі поточного пробігу
-            # Критично - якщо пробіг перевищив next_service_km більш ніж на 20%
-            # Важливо - якщо пробіг наближається до next_service_km (за 10% до або вже перевищив)
-            # В Нормі - якщо ще є час до наступного сервісу
-            if mileage >= next_service_km * 1.2:  # Перевищено більш ніж на 20%
-                status = ServiceStatusChoice.CRITICAL  # Критично
-            elif mileage >= next_service_km:  # Перевищено або досягнуто
-                status = ServiceStatusChoice.IMPORTANT  # Важливо
-            elif mileage > next_service_km - (interval_km * 0.1):  # За 10% до наступного сервісу
-                status = ServiceStatusChoice.IMPORTANT  # Важливо
-            else:
-                status = ServiceStatusChoice.NORMAL  # В Нормі
-            
-            is_completed = last_service_km > 0
-        
-        # Перевіряємо, чи не існує вже такий івент (щоб уникнути дублікатів)
-        # Використовуємо тільки поля, які точно існують в БД
-        existing_event = ServiceEvent.objects.filter(
+
+        if (service_type, last_service_km) in existing:
+            continue
+        existing.add((service_type, last_service_km))
+
+        created_events.append(ServiceEvent(
             car=car,
             service_type=service_type,
-            last_service_km=last_service_km
-        ).first()
-        
-        if not existing_event:
-            event = ServiceEvent.objects.create(
-                car=car,
-                service_type=service_type,
-                mileage_km=mileage,  # Поточний пробіг автомобіля
-                next_service_km=next_service_km,
-                last_service_km=last_service_km,
-                interval_km=interval_km,
-                date=today,
-                status=status,
-                is_completed=is_completed
-            )
-            created_events.append(event)
-    
-    return created_events
+            mileage_km=mileage,  # Поточний пробіг автомобіля
+            next_service_km=next_service_km,
+            last_service_km=last_service_km,
+            interval_km=interval_km,
+            date=today,
+            status=status,
+            is_completed=known,
+        ))
+
+    return ServiceEvent.objects.bulk_create(created_events)
 
 
 def parse_events_for_car_by_json(car, service_plan: dict, mileage: int):
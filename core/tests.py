@@ -1 +1,1219 @@
-from django.test import TestCase
+import csv
+import hashlib
+import io
+import os
+import signal
+import tempfile
+import time
+from io import StringIO
+from pathlib import Path
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from types import SimpleNamespace
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import transaction
+from django.http import FileResponse, Http404
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from core.car_matching import CarMatchIndex
+from core.invoice_samples import make_synthetic_invoice
+from core.management.commands.calc_planed_service import recompute_chunk
+from core.management.commands.rebuild_car_cost_monthly import rollup_key
+from core.exports import (
+    OUTLAY_EXPORT_HEADERS,
+    outlay_export_links,
+    purge_old_exports,
+    run_outlay_export,
+    stream_csv,
+    write_outlays_xlsx,
+)
+from core.service_status import evaluate_service_plans
+from core.jobs import (
+    STALE_JOB_TIMEOUT,
+    WorkerShutdown,
+    claim_next_job,
+    enqueue_job,
+    requeue_stale_jobs,
+)
+from core.models import (
+    BackgroundJob,
+    BackgroundJobStatusChoice,
+    BackgroundJobTypeChoice,
+    Car,
+    CarCostMonthly,
+    CarServiceState,
+    Invoice,
+    InvoiceItem,
+    InvoiceParseCache,
+    InvoiceStatusChoice,
+    Outlay,
+    OutlayAmount,
+    Service,
+    ServiceEvent,
+    ServiceStatusChoice,
+)
+from core.services import (
+    SERVICE_GAS_UUID,
+    PDFCore,
+    aggregate_car_costs,
+    apply_invoice_reparse,
+    confirm_invoice_car_match,
+    create_car_service_plan,
+    create_invoice_for_upload,
+    create_outlay,
+    create_service_events_from_services,
+    delete_outlay,
+    diff_invoice_items,
+    get_outlays_page,
+    get_parsed_invoice_data,
+    parse_invoice_file_sandboxed,
+    ingest_invoice_rows,
+    invoice_outlay_comment,
+    parse_byte_range,
+    parse_pl_decimal,
+    parse_pl_grosz,
+    protected_file_response,
+    update_outlay,
+)
+
+
+class JobWorkerRecoveryTests(TestCase):
+    def setUp(self):
+        # run_job_worker installs its own SIGTERM handler
+        self.addCleanup(signal.signal, signal.SIGTERM, signal.getsignal(signal.SIGTERM))
+        self.job = enqueue_job(BackgroundJobTypeChoice.INVOICE_PARSE)
+
+    def abandon(self, job):
+        """State left behind by a worker killed mid-job (SIGKILL, OOM, lost host)"""
+        BackgroundJob.objects.filter(pk=job.pk).update(
+            updated_at=timezone.now() - STALE_JOB_TIMEOUT - timedelta(seconds=1),
+        )
+
+    def test_job_of_killed_worker_is_claimed_again(self):
+        claimed = claim_next_job("host:1")
+        self.abandon(claimed)
+
+        self.assertIsNone(claim_next_job("host:2"))
+        self.assertEqual(requeue_stale_jobs(), 1)
+
+        reclaimed = claim_next_job("host:2")
+        self.assertEqual(reclaimed.pk, self.job.pk)
+        self.assertEqual(reclaimed.locked_by, "host:2")
+        self.assertEqual(reclaimed.attempts, 2)
+
+    def test_recently_updated_job_is_not_requeued(self):
+        claim_next_job("host:1")
+
+        self.assertEqual(requeue_stale_jobs(), 0)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, BackgroundJobStatusChoice.RUNNING)
+
+    def test_worker_picks_up_job_of_killed_worker(self):
+        self.abandon(claim_next_job("host:1"))
+
+        call_command("run_job_worker", "--once", "--concurrency", "1", stdout=mock.MagicMock())
+
+        self.job.refresh_from_db()
+        # Run again by the new worker: it has no invoice, so it fails permanently
+        self.assertEqual(self.job.status, BackgroundJobStatusChoice.FAILED)
+        self.assertEqual(self.job.attempts, 2)
+        self.assertEqual(self.job.locked_by, "")
+
+    def test_terminated_worker_releases_its_job(self):
+        with mock.patch("core.management.commands.run_job_worker.run_job", side_effect=WorkerShutdown):
+            call_command("run_job_worker", "--once", "--concurrency", "1", stdout=mock.MagicMock())
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, BackgroundJobStatusChoice.QUEUED)
+        self.assertEqual(self.job.attempts, 0)
+        self.assertEqual(self.job.locked_by, "")
+        self.assertEqual(claim_next_job("host:2").pk, self.job.pk)
+
+
+class CarCostMonthlyTests(TestCase):
+    def setUp(self):
+        self.car = Car.objects.create(
+            mark="Toyota", model="Corolla", color="white", year=2020,
+            vin_code="JTDBR32E720000001", license_plate="WX1234A", mileage=1000,
+        )
+        self.other_car = Car.objects.create(
+            mark="Skoda", model="Octavia", color="black", year=2021,
+            vin_code="TMBJJ7NE0L0000002", license_plate="WX5678B", mileage=500,
+        )
+        self.this_month = timezone.localdate().replace(day=1)
+
+    def rollup(self):
+        return {
+            rollup_key(row): (row.total, row.count)
+            for row in CarCostMonthly.objects.all()
+        }
+
+    def assert_rollup_matches_outlays(self):
+        """Same rows as rebuild_car_cost_monthly computes, and the command finds no drift"""
+        expected = {
+            rollup_key(row): (row.total, row.count)
+            for row in aggregate_car_costs(Outlay.cars.through.objects.all())
+        }
+        self.assertEqual(self.rollup(), expected)
+
+        out = StringIO()
+        call_command("rebuild_car_cost_monthly", "--dry-run", stdout=out)
+        self.assertIn("+0 ~0 -0", out.getvalue())
+        self.assertIn("Dry run, nothing written.", out.getvalue())
+
+    def edit(self, outlay, **changes):
+        cleaned_data = {
+            "car": self.car, "service_type": "other", "category": "fuel", "category_name": None,
+            "service_name": None, "name": outlay.name, "comment": None, "description": None,
+            "date": outlay.created_at, "price_type": "full", "full_price": outlay.amount.full_price,
+            "price_per_item": None, "item_count": None,
+        }
+        cleaned_data.update(changes)
+        return update_outlay(outlay.uuid, SimpleNamespace(cleaned_data=cleaned_data))
+
+    def test_create(self):
+        create_outlay(type="other", name="Paliwo", car=self.car, full_price=Decimal("100.00"), category="fuel")
+        create_outlay(type="other", name="Paliwo", car=self.car, price_per_item=Decimal("20.00"), item_count=3, category="fuel")
+        create_outlay(type="service", name="Serwis", car=self.car, full_price=Decimal("250.00"))
+        create_outlay(type="other", name="Paliwo", car=self.other_car, full_price=Decimal("40.00"), category="fuel")
+
+        self.assertEqual(self.rollup(), {
+            (self.car.pk, self.this_month, "other", "fuel"): (Decimal("160.00"), 2),
+            (self.car.pk, self.this_month, "service", ""): (Decimal("250.00"), 1),
+            (self.other_car.pk, self.this_month, "other", "fuel"): (Decimal("40.00"), 1),
+        })
+        self.assert_rollup_matches_outlays()
+
+    def test_edit_amount_month_and_car(self):
+        outlay = create_outlay(type="other", name="Paliwo", car=self.car, full_price=Decimal("100.00"), category="fuel")
+        create_outlay(type="other", name="Paliwo", car=self.car, full_price=Decimal("30.00"), category="fuel")
+
+        self.edit(outlay, full_price=Decimal("120.00"))
+        self.assertEqual(self.rollup(), {
+            (self.car.pk, self.this_month, "other", "fuel"): (Decimal("150.00"), 2),
+        })
+        self.assert_rollup_matches_outlays()
+
+        last_month = (self.this_month - timedelta(days=1)).replace(day=1)
+        moved_at = timezone.make_aware(datetime(last_month.year, last_month.month, 15))
+        outlay = self.edit(Outlay.objects.get(pk=outlay.pk), date=moved_at, car=self.other_car)
+        self.assertEqual(self.rollup(), {
+            (self.car.pk, self.this_month, "other", "fuel"): (Decimal("30.00"), 1),
+            (self.other_car.pk, last_month, "other", "fuel"): (Decimal("120.00"), 1),
+        })
+        self.assert_rollup_matches_outlays()
+
+    def test_delete(self):
+        outlay = create_outlay(type="other", name="Paliwo", car=self.car, full_price=Decimal("100.00"), category="fuel")
+        kept = create_outlay(type="service", name="Serwis", car=self.car, full_price=Decimal("250.00"))
+
+        delete_outlay(outlay)
+        self.assertEqual(self.rollup(), {
+            (self.car.pk, self.this_month, "service", ""): (Decimal("250.00"), 1),
+        })
+        self.assert_rollup_matches_outlays()
+
+        delete_outlay(kept)
+        self.assertEqual(self.rollup(), {})
+        self.assert_rollup_matches_outlays()
+
+    def test_rebuild_repairs_drift_unless_dry_run(self):
+        outlay = create_outlay(type="other", name="Paliwo", car=self.car, full_price=Decimal("100.00"), category="fuel")
+        # An edit outside the services (e.g. the admin) leaves the rollup behind
+        OutlayAmount.objects.filter(pk=outlay.amount_id).update(full_price=Decimal("90.00"))
+
+        out = StringIO()
+        call_command("rebuild_car_cost_monthly", "--dry-run", stdout=out)
+        self.assertIn("+0 ~1 -0", out.getvalue())
+        self.assertEqual(self.rollup()[(self.car.pk, self.this_month, "other", "fuel")], (Decimal("100.00"), 1))
+
+        call_command("rebuild_car_cost_monthly", stdout=StringIO())
+        self.assert_rollup_matches_outlays()
+
+
+class OutlayPageTests(TestCase):
+    def setUp(self):
+        self.car = Car.objects.create(
+            mark="Toyota", model="Corolla", color="white", year=2020,
+            vin_code="JTDBR32E720000001", license_plate="WX1234A", mileage=1000,
+        )
+        self.other_car = Car.objects.create(
+            mark="Skoda", model="Octavia", color="black", year=2021,
+            vin_code="TMBJJ7NE0L0000002", license_plate="WX5678B", mileage=500,
+        )
+        now = timezone.now().replace(microsecond=0)
+        # Three outlays share a timestamp, the uuid breaks the tie
+        stamps = [now, now, now, now - timedelta(hours=1), now - timedelta(hours=2), now - timedelta(days=1)]
+        self.outlays = []
+        for index, created_at in enumerate(stamps):
+            outlay = create_outlay(
+                type="service" if index % 2 else "other", name=f"Wydatek {index}", car=self.car,
+                full_price=Decimal("10.00"),
+            )
+            Outlay.objects.filter(pk=outlay.pk).update(created_at=created_at)
+            self.outlays.append(outlay)
+        # An outlay of two cars is listed once per car, and the pair stays on one page
+        self.outlays[1].cars.add(self.other_car)
+        self.newest_first = list(Outlay.objects.order_by("-created_at", "-uuid").values_list("uuid", flat=True))
+
+    def walk(self, page_size, **filters):
+        pages = []
+        after = None
+        while True:
+            page = get_outlays_page(after=after, page_size=page_size, **filters)
+            pages.append(page["outlays"])
+            after = page["next_cursor"]
+            if after is None:
+                return pages
+            self.assertLess(len(pages), 10)
+
+    def page_uuids(self, rows):
+        return list(dict.fromkeys(row["uuid"] for row in rows))
+
+    def test_pages_cover_every_outlay_once(self):
+        for page_size in (1, 2, 4, 5, 6, 7):
+            with self.subTest(page_size=page_size):
+                pages = self.walk(page_size)
+
+                uuids = [uuid for rows in pages for uuid in self.page_uuids(rows)]
+                self.assertEqual(uuids, self.newest_first)
+                self.assertTrue(all(len(self.page_uuids(rows)) == page_size for rows in pages[:-1]))
+                self.assertEqual(len(pages), -(-len(self.newest_first) // page_size))
+
+    def test_outlay_of_two_cars_is_not_split_across_pages(self):
+        shared = self.outlays[1].uuid
+        for page_size in range(1, 7):
+            with self.subTest(page_size=page_size):
+                pages = self.walk(page_size)
+
+                holding = [rows for rows in pages if any(row["uuid"] == shared for row in rows)]
+                self.assertEqual(len(holding), 1)
+                plates = {row["cars__license_plate"] for row in holding[0] if row["uuid"] == shared}
+                self.assertEqual(plates, {"WX1234A", "WX5678B"})
+
+    def test_last_page_has_no_cursor(self):
+        # Exactly one full page: the extra outlay probe finds nothing
+        page = get_outlays_page(page_size=len(self.newest_first))
+        self.assertIsNone(page["next_cursor"])
+
+        page = get_outlays_page(page_size=len(self.newest_first) - 1)
+        last = get_outlays_page(after=page["next_cursor"], page_size=len(self.newest_first) - 1)
+        self.assertEqual(self.page_uuids(last["outlays"]), self.newest_first[-1:])
+        self.assertIsNone(last["next_cursor"])
+
+    def test_filters_and_malformed_cursor(self):
+        pages = self.walk(1, filter_type="service")
+        services = [uuid for uuid in self.newest_first if Outlay.objects.get(pk=uuid).type == "service"]
+        self.assertEqual([uuid for rows in pages for uuid in self.page_uuids(rows)], services)
+
+        # A malformed cursor starts from the first page
+        page = get_outlays_page(after="not-a-cursor", page_size=2)
+        self.assertEqual(self.page_uuids(page["outlays"]), self.newest_first[:2])
+
+
+def legacy_service_status(last_service_km, interval_km, mileage):
+    """Status rules of create_car_service_plan() before core.service_status"""
+    if last_service_km == 0:
+        return ServiceStatusChoice.UNKNOWN, None
+    next_service_km = last_service_km + interval_km
+    if mileage >= next_service_km * 1.2:
+        return ServiceStatusChoice.CRITICAL, next_service_km
+    if mileage >= next_service_km:
+        return ServiceStatusChoice.IMPORTANT, next_service_km
+    if mileage > next_service_km - (interval_km * 0.1):
+        return ServiceStatusChoice.IMPORTANT, next_service_km
+    return ServiceStatusChoice.NORMAL, next_service_km
+
+
+class ServiceStatusTests(TestCase):
+    # (last_service_km, interval_km, mileage, status, next_service_km)
+    CASES = [
+        (0, 10000, 50000, ServiceStatusChoice.UNKNOWN, None),
+        (0, 0, 50000, ServiceStatusChoice.UNKNOWN, None),
+        # next service at 20000: critical from 24000, important after 19000
+        (10000, 10000, 15000, ServiceStatusChoice.NORMAL, 20000),
+        (10000, 10000, 19000, ServiceStatusChoice.NORMAL, 20000),
+        (10000, 10000, 19001, ServiceStatusChoice.IMPORTANT, 20000),
+        (10000, 10000, 19999, ServiceStatusChoice.IMPORTANT, 20000),
+        (10000, 10000, 20000, ServiceStatusChoice.IMPORTANT, 20000),
+        (10000, 10000, 23999, ServiceStatusChoice.IMPORTANT, 20000),
+        (10000, 10000, 24000, ServiceStatusChoice.CRITICAL, 20000),
+        # Thresholds that are not whole kilometres: 15007 * 1.2 = 18008.4, 15007 - 1500.0 = 13507
+        (7, 15000, 13507, ServiceStatusChoice.NORMAL, 15007),
+        (7, 15000, 13508, ServiceStatusChoice.IMPORTANT, 15007),
+        (7, 15000, 18008, ServiceStatusChoice.IMPORTANT, 15007),
+        (7, 15000, 18009, ServiceStatusChoice.CRITICAL, 15007),
+        # No interval: due at the last service itself
+        (5000, 0, 4999, ServiceStatusChoice.NORMAL, 5000),
+        (5000, 0, 5000, ServiceStatusChoice.IMPORTANT, 5000),
+        (5000, 0, 6000, ServiceStatusChoice.CRITICAL, 5000),
+    ]
+
+    def test_thresholds(self):
+        for last_service_km, interval_km, mileage, status, next_service_km in self.CASES:
+            with self.subTest(last_service_km=last_service_km, interval_km=interval_km, mileage=mileage):
+                self.assertEqual(legacy_service_status(last_service_km, interval_km, mileage), (status, next_service_km))
+
+                service = {"key": "oil", "last_service_km": last_service_km, "interval_km": interval_km}
+                [planned] = create_car_service_plan({"services": [service]}, mileage)
+                self.assertEqual(planned["status"], status)
+                self.assertEqual(planned["next_service"], next_service_km)
+                overdue_km = max(mileage - next_service_km, 0) if next_service_km is not None else 0
+                self.assertEqual(planned["overdue_km"], overdue_km)
+
+    def test_plans_of_many_cars_match_the_previous_implementation(self):
+        plans = [
+            (mileage, [
+                {"key": f"service-{i}", "last_service_km": last_service_km, "interval_km": interval_km}
+                for i, (last_service_km, interval_km, _, _, _) in enumerate(self.CASES)
+            ])
+            for mileage in (0, 4999, 5000, 13508, 19000, 19001, 18009, 24000, 50000)
+        ]
+
+        for (mileage, services), evaluated in zip(plans, evaluate_service_plans(plans), strict=True):
+            for service, result in zip(services, evaluated, strict=True):
+                with self.subTest(mileage=mileage, service=service):
+                    status, next_service_km = legacy_service_status(
+                        service["last_service_km"], service["interval_km"], mileage,
+                    )
+                    self.assertEqual((result["status"], result["next_service"]), (status, next_service_km))
+                    self.assertEqual(result["key"], service["key"])
+                    self.assertNotIn("status", service)
+
+    def test_service_events(self):
+        car = Car.objects.create(
+            mark="Toyota", model="Corolla", color="white", year=2020,
+            vin_code="JTDBR32E720000001", license_plate="WX1234A", mileage=19500,
+        )
+        services = [
+            {"name": "Olej", "last_service_km": 10000, "interval_km": 10000},
+            {"name": "Filtr powietrza", "last_service_km": 4000, "interval_km": 10000},
+            {"name": "Rozrząd", "last_service_km": 0, "interval_km": 60000},
+            {"name": "Płyn hamulcowy", "last_service_km": 5000, "interval_km": 40000},
+        ]
+
+        create_service_events_from_services(car, services, car.mileage)
+        # Existing events are not duplicated
+        create_service_events_from_services(car, services, car.mileage)
+
+        self.assertEqual(
+            list(
+                ServiceEvent.objects.filter(car=car).order_by("pk")
+                .values_list("service_type", "status", "next_service_km", "is_completed")
+            ),
+            [
+                ("Olej", ServiceStatusChoice.IMPORTANT, 20000, True),
+                ("Filtr powietrza", ServiceStatusChoice.CRITICAL, 14000, True),
+                # Unknown services are due one interval from the current mileage
+                ("Rozrząd", ServiceStatusChoice.UNKNOWN, 79500, False),
+                ("Płyn hamulcowy", ServiceStatusChoice.NORMAL, 45000, True),
+            ],
+        )
+
+
+class CalcPlanedServiceTests(TestCase):
+    def setUp(self):
+        self.states = []
+        # Five plans: three out of date, one already current, one without services
+        for index, (mileage, state_mileage, services) in enumerate([
+            (19500, 15000, [{"key": "oil", "last_service_km": 10000, "interval_km": 10000}]),
+            (30000, 15000, [
+                {"key": "oil", "last_service_km": 10000, "interval_km": 10000},
+                {"key": "belt", "last_service_km": 0, "interval_km": 60000},
+            ]),
+            (5000, 4000, [{"key": "oil", "last_service_km": 1000, "interval_km": 10000}]),
+            (15000, 15000, [{"key": "oil", "last_service_km": 10000, "interval_km": 10000}]),
+            (15000, 15000, []),
+        ]):
+            car = Car.objects.create(
+                mark="Toyota", model="Corolla", color="white", year=2020,
+                vin_code=f"JTDBR32E72000000{index}", license_plate=f"WX100{index}", mileage=mileage,
+            )
+            self.states.append(CarServiceState.objects.create(
+                car=car, mileage=state_mileage, service_plan={"services": services},
+            ))
+        # The current plan is stored already evaluated
+        current = self.states[3]
+        current.service_plan["services"] = create_car_service_plan(current.service_plan, current.car.mileage)
+        current.save()
+
+    def plans(self):
+        return list(CarServiceState.objects.order_by("pk").values_list("mileage", "service_plan"))
+
+    def run_command(self, *args):
+        out = StringIO()
+        call_command("calc_planed_service", "--workers", "1", "--chunk-size", "2", *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_reports_without_writing(self):
+        before = self.plans()
+
+        out = self.run_command("--dry-run")
+
+        self.assertEqual(self.plans(), before)
+        self.assertIn("Dry run, nothing written.", out)
+        self.assertIn("5 plan(s), 3 changed, 1 skipped, 5 service(s)", out)
+        # One progress line per chunk of two plans
+        self.assertEqual([line.split(",")[0] for line in out.splitlines()[:3]], ["2 plan(s)", "4 plan(s)", "5 plan(s)"])
+
+    def test_changed_plans_are_written_once(self):
+        out = self.run_command()
+
+        self.assertNotIn("Dry run", out)
+        self.assertIn("5 plan(s), 3 changed, 1 skipped", out)
+        for state in self.states:
+            state.refresh_from_db()
+        self.assertEqual(self.states[0].mileage, 19500)
+        self.assertEqual(
+            [(service["key"], service["status"], service["next_service"]) for service in self.states[1].service_plan["services"]],
+            [("oil", ServiceStatusChoice.CRITICAL, 20000), ("belt", ServiceStatusChoice.UNKNOWN, None)],
+        )
+        self.assertEqual(self.states[4].service_plan, {"services": []})
+
+        self.assertIn("5 plan(s), 0 changed, 1 skipped", self.run_command())
+
+    def test_chunk_stats(self):
+        stats = recompute_chunk(self.states[0].pk, self.states[1].pk, dry_run=True)
+
+        self.assertEqual(
+            {key: stats[key] for key in ("states", "changed", "skipped", "services")},
+            {"states": 2, "changed": 2, "skipped": 0, "services": 3},
+        )
+        self.assertTrue(all(stats[key] >= 0 for key in ("load_s", "compute_s", "write_s")))
+
+
+class InvoiceIngestTests(TestCase):
+    def setUp(self):
+        Service.objects.create(uuid=SERVICE_GAS_UUID, name="Gas", location="Warszawa")
+        self.car = Car.objects.create(
+            mark="Toyota", model="Corolla", color="white", year=2020,
+            vin_code="JTDBR32E720000001", license_plate="WX1234A", mileage=1000,
+        )
+        self.invoice = Invoice.objects.create(name="FV 1/2026", file_path="invoices/fv1.pdf")
+
+    def row(self, row_id, amount="1", price="10.00"):
+        return {
+            "id": row_id,
+            "item_name": f"Pozycja {row_id}",
+            "amount": amount,
+            "price_netto": price,
+            "tax_price": "0",
+            "price_brutto": price,
+            "current_car_vin": self.car.vin_code,
+        }
+
+    def test_rows_the_database_would_reject_do_not_fail_the_invoice(self):
+        rows = [
+            self.row(1),
+            # 34567 does not fit OutlayAmount.item_count (smallint)
+            self.row(2, amount="34567"),
+            # 9 digits before the comma, price_brutto holds 8
+            self.row(3, price="123456789.00"),
+            self.row(4),
+        ]
+
+        summary = ingest_invoice_rows(self.invoice, {"table": rows})
+
+        self.assertEqual(summary["items_count"], 3)
+        self.assertEqual(list(summary["rejected_rows"]), ["3"])
+        self.assertIn("price_brutto", summary["rejected_rows"]["3"])
+        item_2 = InvoiceItem.objects.get(invoice=self.invoice, item_id="2")
+        self.assertEqual(list(summary["rejected_outlays"]), [str(item_2.uuid)])
+        self.assertIn("item_count", summary["rejected_outlays"][str(item_2.uuid)])
+
+        self.assertEqual(
+            sorted(Outlay.objects.values_list("invoice_item__item_id", flat=True)), ["1", "4"],
+        )
+        self.assertEqual(self.invoice.invoice_amount, Decimal("30.00"))
+        self.assertEqual(self.invoice.invoice_data["rejected_rows"], summary["rejected_rows"])
+
+
+class InvoiceReparseTests(TestCase):
+    def setUp(self):
+        Service.objects.create(uuid=SERVICE_GAS_UUID, name="Gas", location="Warszawa")
+        self.car = Car.objects.create(
+            mark="Toyota", model="Corolla", color="white", year=2020,
+            vin_code="JTDBR32E720000001", license_plate="WX1234A", mileage=1000,
+        )
+        self.invoice = self.ingested_invoice("INV-1", [self.row(1), self.row(2), self.row(3)])
+
+    def row(self, row_id, price="10.00"):
+        return {
+            "id": row_id,
+            "item_name": f"Pozycja {row_id}",
+            "amount": "1",
+            "price_netto": price,
+            "tax_price": "0",
+            "price_brutto": price,
+            "current_car_vin": self.car.vin_code,
+        }
+
+    def ingested_invoice(self, name, rows):
+        invoice = Invoice.objects.create(name=name, file_path=f"invoices/{name}.pdf")
+        with transaction.atomic():
+            ingest_invoice_rows(invoice, {"table": rows})
+            invoice.save()
+        return invoice
+
+    def outlay_prices(self, invoice):
+        return dict(
+            Outlay.objects.filter(invoice_item__invoice=invoice)
+            .values_list("invoice_item__item_id", "amount__full_price")
+        )
+
+    def test_diff_matches_rows_to_stored_items_by_id(self):
+        rows = [self.row(1), self.row(2, price="15.00"), self.row(4)]
+
+        diff = diff_invoice_items(self.invoice, rows)
+
+        self.assertEqual([row["id"] for row in diff["added"]], [4])
+        self.assertEqual([item.item_id for item in diff["changed"]], ["2"])
+        self.assertEqual(diff["changed"][0].price_brutto, Decimal("15.00"))
+        self.assertEqual([item.item_id for item in diff["removed"]], ["3"])
+        self.assertEqual(diff["unchanged"], 1)
+
+    def test_changed_vin_replaces_the_item(self):
+        other_car = Car.objects.create(
+            mark="Skoda", model="Octavia", color="black", year=2021,
+            vin_code="TMBJJ7NE0L0000002", license_plate="WX5678B", mileage=500,
+        )
+        moved = dict(self.row(2), current_car_vin=other_car.vin_code)
+
+        diff = diff_invoice_items(self.invoice, [self.row(1), moved, self.row(3)])
+
+        self.assertEqual([row["id"] for row in diff["added"]], [2])
+        self.assertEqual([item.item_id for item in diff["removed"]], ["2"])
+        self.assertEqual(diff["changed"], [])
+        self.assertEqual(diff["unchanged"], 2)
+
+    def test_apply_writes_the_diff(self):
+        rows = [self.row(1), self.row(2, price="15.00"), self.row(4)]
+        diff = diff_invoice_items(self.invoice, rows)
+
+        with transaction.atomic():
+            counts = apply_invoice_reparse(self.invoice, {"table": rows}, diff)
+
+        self.assertEqual(counts, {"added": 1, "changed": 1, "removed": 1, "unchanged": 1})
+        self.assertEqual(
+            self.outlay_prices(self.invoice),
+            {"1": Decimal("10.00"), "2": Decimal("15.00"), "4": Decimal("10.00")},
+        )
+        self.assertEqual(OutlayAmount.objects.count(), Outlay.objects.count())
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.invoice_amount, Decimal("35.00"))
+
+    def test_apply_leaves_outlays_of_other_invoices_alone(self):
+        # INV-12 starts with the comment prefix of INV-1
+        other = self.ingested_invoice("INV-12", [self.row(3)])
+        unlinked = Outlay.objects.create(
+            name="Pozycja 3",
+            amount=OutlayAmount.objects.create(price_per_item=Decimal("7"), item_count=1, full_price=Decimal("7")),
+            comment=invoice_outlay_comment(self.invoice, "3"),
+        )
+        rows = [self.row(1), self.row(2)]
+        diff = diff_invoice_items(self.invoice, rows)
+
+        with transaction.atomic():
+            apply_invoice_reparse(self.invoice, {"table": rows}, diff)
+
+        self.assertEqual(self.outlay_prices(self.invoice), {"1": Decimal("10.00"), "2": Decimal("10.00")})
+        self.assertEqual(self.outlay_prices(other), {"3": Decimal("10.00")})
+        self.assertTrue(Outlay.objects.filter(pk=unlinked.pk).exists())
+
+
+class InvoiceUploadDedupTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.media_root = Path(media_root.name)
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def upload(self, content=b"%PDF-1.4 faktura", name="fv.pdf"):
+        return SimpleUploadedFile(name, content, content_type="application/pdf")
+
+    def stored_files(self):
+        return sorted(path.relative_to(self.media_root) for path in self.media_root.rglob("*") if path.is_file())
+
+    def test_same_file_returns_the_existing_invoice(self):
+        first, created = create_invoice_for_upload(self.upload(name="fv.pdf"), "FV 1")
+        self.assertTrue(created)
+        self.assertEqual(first.file_hash, hashlib.sha256(b"%PDF-1.4 faktura").hexdigest())
+
+        again, created = create_invoice_for_upload(self.upload(name="kopia.pdf"), "FV 1 kopia")
+
+        self.assertFalse(created)
+        self.assertEqual(again.pk, first.pk)
+        self.assertEqual(Invoice.objects.count(), 1)
+        # One content-addressed copy, no .part leftovers
+        self.assertEqual(self.stored_files(), [Path(first.file_path)])
+
+    def test_different_file_is_a_new_invoice(self):
+        first, _ = create_invoice_for_upload(self.upload(), "FV 1")
+        second, created = create_invoice_for_upload(self.upload(b"%PDF-1.4 inna faktura"), "FV 2")
+
+        self.assertTrue(created)
+        self.assertNotEqual(second.file_hash, first.file_hash)
+        self.assertEqual(len(self.stored_files()), 2)
+
+    def test_failed_invoice_is_uploaded_again(self):
+        failed, _ = create_invoice_for_upload(self.upload(), "FV 1")
+        Invoice.objects.filter(pk=failed.pk).update(status=InvoiceStatusChoice.FAILED)
+
+        retried, created = create_invoice_for_upload(self.upload(), "FV 1")
+
+        self.assertTrue(created)
+        self.assertNotEqual(retried.pk, failed.pk)
+        self.assertEqual(retried.status, InvoiceStatusChoice.PARSING)
+        self.assertEqual(retried.file_path, failed.file_path)
+
+        # Later uploads of the same file find the new invoice
+        again, created = create_invoice_for_upload(self.upload(), "FV 1")
+        self.assertFalse(created)
+        self.assertEqual(again.pk, retried.pk)
+
+    def test_parse_cache_is_reused_per_file_and_parser_version(self):
+        parsed = {"table": [{"id": 1, "item_name": "Olej"}], "total": "10.00"}
+        sandbox_result = {"status": "ok", "data": parsed, "duration_s": 0.5, "peak_memory_mb": 40}
+        first, _ = create_invoice_for_upload(self.upload(), "FV 1")
+        # Same content under another invoice, e.g. after a failed upload
+        second = Invoice.objects.create(name="FV 1", file_path=first.file_path, file_hash=first.file_hash)
+
+        with mock.patch("core.services.parse_invoice_file_sandboxed", return_value=sandbox_result) as sandbox:
+            self.assertEqual(get_parsed_invoice_data(first), parsed)
+            self.assertEqual(get_parsed_invoice_data(second), parsed)
+            self.assertEqual(sandbox.call_count, 1)
+            self.assertEqual(first.parse_stats["cached"], False)
+            self.assertEqual(second.parse_stats, {"cached": True})
+
+            with mock.patch.object(PDFCore, "PARSER_VERSION", "test-next"):
+                get_parsed_invoice_data(second)
+            self.assertEqual(sandbox.call_count, 2)
+
+        self.assertEqual(
+            sorted(InvoiceParseCache.objects.values_list("parser_version", flat=True)),
+            sorted([PDFCore.PARSER_VERSION, "test-next"]),
+        )
+
+    def test_empty_parse_is_not_cached(self):
+        sandbox_result = {"status": "ok", "data": {"table": []}, "duration_s": 0.1, "peak_memory_mb": 30}
+        invoice, _ = create_invoice_for_upload(self.upload(), "FV 1")
+
+        with mock.patch("core.services.parse_invoice_file_sandboxed", return_value=sandbox_result):
+            get_parsed_invoice_data(invoice)
+
+        self.assertFalse(InvoiceParseCache.objects.exists())
+
+
+class BackfillOutlayInvoiceItemsTests(TestCase):
+    def setUp(self):
+        self.uploaded_at = timezone.now() - timedelta(days=30)
+        # Invoice names are not unique: the same invoice number uploaded twice, an hour apart
+        self.first = self.invoice_with_item(self.uploaded_at)
+        self.second = self.invoice_with_item(self.uploaded_at + timedelta(hours=1))
+
+    def invoice_with_item(self, created_at):
+        invoice = Invoice.objects.create(name="FV 7/2025", file_path="invoices/fv7.pdf")
+        Invoice.objects.filter(pk=invoice.pk).update(created_at=created_at)
+        invoice.refresh_from_db()
+        InvoiceItem.objects.create(
+            invoice=invoice, item_id="1", item_name="Olej", amount=1,
+            price_netto=Decimal("10"), price_brutto=Decimal("12.30"),
+        )
+        return invoice
+
+    def legacy_outlay(self, invoice, delay):
+        """Outlay created on upload before Outlay.invoice_item existed"""
+        outlay = Outlay.objects.create(
+            comment=invoice_outlay_comment(invoice, "1"),
+            amount=OutlayAmount.objects.create(item_count=1, price_per_item=Decimal("10")),
+        )
+        Outlay.objects.filter(pk=outlay.pk).update(created_at=invoice.created_at + delay)
+        return outlay
+
+    def test_outlays_link_to_the_invoice_uploaded_just_before_them(self):
+        first_outlay = self.legacy_outlay(self.first, timedelta(milliseconds=125))
+        second_outlay = self.legacy_outlay(self.second, timedelta(seconds=2))
+        # Long after both uploads: no invoice in the window, left alone
+        late_outlay = self.legacy_outlay(self.second, timedelta(days=1))
+
+        call_command("backfill_outlay_invoice_items", stdout=mock.MagicMock())
+
+        first_outlay.refresh_from_db()
+        second_outlay.refresh_from_db()
+        late_outlay.refresh_from_db()
+        self.assertEqual(first_outlay.invoice_item, self.first.items.get())
+        self.assertEqual(second_outlay.invoice_item, self.second.items.get())
+        self.assertIsNone(late_outlay.invoice_item)
+
+
+def fleet_car(vin, plate="WX1234A"):
+    return {"uuid": vin, "mark": "Skoda", "model": "Octavia", "year": 2021, "vin_code": vin, "license_plate": plate}
+
+
+class CarMatchIndexTests(TestCase):
+    # Two cars two edits apart, as in a fleet bought in one batch
+    FIRST_VIN = "TMBJG7NE0L0000111"
+    SECOND_VIN = "TMBJG7NE0L0000122"
+
+    def setUp(self):
+        self.index = CarMatchIndex([fleet_car(self.FIRST_VIN, "WX1111A"), fleet_car(self.SECOND_VIN, "WX2222A")])
+
+    def test_exact_and_ocr_matches_are_booked(self):
+        self.assertFalse(self.index.match(self.FIRST_VIN)["needs_review"])
+        ocr = self.index.match(self.FIRST_VIN.replace("0", "O"))
+        self.assertEqual((ocr["car_uuid"], ocr["method"], ocr["needs_review"]), (self.FIRST_VIN, "ocr", False))
+
+    def test_fuzzy_match_between_close_vins_needs_review(self):
+        match = self.index.match("TMBJG7NE0L0000101")
+
+        self.assertEqual((match["car_uuid"], match["method"], match["distance"]), (self.FIRST_VIN, "fuzzy", 1))
+        self.assertTrue(match["needs_review"])
+
+    def test_keys_beyond_max_edit_distance_are_not_matched(self):
+        index = CarMatchIndex([fleet_car("TMBJG7NE0L0000111", "KR12345")])
+
+        self.assertEqual(index._search_trie("KR123456789", 2), (3, set()))
+        self.assertIsNone(index.match("KR123456789"))
+        # max_distance + 1 edits away
+        self.assertEqual(index._search_trie("KR12345678", 2), (3, set()))
+        self.assertIsNone(index.match("KR12345678"))
+
+    def test_vin_as_close_to_both_cars_is_not_matched(self):
+        self.assertIsNone(self.index.match("TMBJG7NE0L0000112"))
+        self.assertIsNone(self.index.match("TMBJG7NE0L0000199"))
+
+    def test_shared_vin_suffix_is_not_matched(self):
+        index = CarMatchIndex([
+            fleet_car("TMBJG7NE0L0000111", "WX1111A"),
+            fleet_car("WVWZZZ1KZAW000111", "WX2222A"),
+        ])
+
+        self.assertIsNone(index.match("000111"))
+        match = index.match("E0L0000111")
+        self.assertEqual((match["car_uuid"], match["method"]), ("TMBJG7NE0L0000111", "suffix"))
+        self.assertTrue(match["needs_review"])
+
+
+class InvoiceCarReviewTests(TestCase):
+    def setUp(self):
+        Service.objects.create(uuid=SERVICE_GAS_UUID, name="Gas", location="Warszawa")
+        self.first = Car.objects.create(
+            mark="Skoda", model="Octavia", color="grey", year=2021,
+            vin_code=CarMatchIndexTests.FIRST_VIN, license_plate="WX1111A", mileage=1000,
+        )
+        Car.objects.create(
+            mark="Skoda", model="Octavia", color="grey", year=2021,
+            vin_code=CarMatchIndexTests.SECOND_VIN, license_plate="WX2222A", mileage=1000,
+        )
+        self.invoice = Invoice.objects.create(name="FV 9/2026", file_path="invoices/fv9.pdf")
+
+    def test_fuzzy_match_is_booked_only_after_confirmation(self):
+        row = {
+            "id": 1, "item_name": "Olej", "amount": "1", "price_netto": "10.00",
+            "tax_price": "0", "price_brutto": "12.30", "current_car_vin": "TMBJG7NE0L0000101",
+        }
+
+        summary = ingest_invoice_rows(self.invoice, {"table": [row]})
+        self.invoice.save()
+
+        item = self.invoice.items.get()
+        car_match = summary["car_matches"][str(item.uuid)]
+        self.assertEqual((car_match["car_uuid"], car_match["needs_review"]), (str(self.first.uuid), True))
+        self.assertFalse(Outlay.objects.exists())
+
+        outlay = confirm_invoice_car_match(item)
+
+        self.assertEqual(list(outlay.cars.all()), [self.first])
+        self.assertEqual(outlay.invoice_item, item)
+        self.invoice.refresh_from_db()
+        self.assertFalse(self.invoice.invoice_data["car_matches"][str(item.uuid)]["needs_review"])
+        # Confirmed once, a second click books nothing
+        self.assertIsNone(confirm_invoice_car_match(item))
+        self.assertEqual(Outlay.objects.count(), 1)
+
+
+class PolishNumberTests(SimpleTestCase):
+    def test_parse_pl_decimal(self):
+        cases = {
+            "1 234,56": Decimal("1234.56"),
+            "1\u00a0234,56": Decimal("1234.56"),
+            "1.234,56": Decimal("1234.56"),
+            "-12,5": Decimal("-12.5"),
+            "1 100,00 PLN": Decimal("1100.00"),
+            "-12,50 zł": Decimal("-12.50"),
+            "": Decimal("0"),
+            "  ": Decimal("0"),
+            None: Decimal("0"),
+        }
+        for value, expected in cases.items():
+            with self.subTest(value=value):
+                self.assertEqual(parse_pl_decimal(value), expected)
+
+    def test_parse_pl_grosz(self):
+        cases = {
+            "1 234,56": 123456,
+            "1.234,56": 123456,
+            "-12,5": -1250,
+            "-0,50": -50,
+            "7": 700,
+            "": 0,
+            None: 0,
+        }
+        for value, expected in cases.items():
+            with self.subTest(value=value):
+                self.assertEqual(parse_pl_grosz(value), expected)
+
+    def test_parse_pl_grosz_rounds_half_up(self):
+        self.assertEqual(parse_pl_grosz("0,005"), 1)
+        self.assertEqual(parse_pl_grosz("0,004"), 0)
+        self.assertEqual(parse_pl_grosz("1 234,565"), 123457)
+        self.assertEqual(parse_pl_grosz("-0,005"), -1)
+
+    def test_garbage_raises(self):
+        for value in ("abc", "PLN", "1,2,3"):
+            with self.subTest(value=value):
+                with self.assertRaises(InvalidOperation):
+                    parse_pl_decimal(value)
+                with self.assertRaises(InvalidOperation):
+                    parse_pl_grosz(value)
+
+
+class ByteRangeTests(SimpleTestCase):
+    def test_single_ranges(self):
+        self.assertEqual(parse_byte_range("bytes=0-99", 1000), (0, 99))
+        self.assertEqual(parse_byte_range("bytes=-100", 1000), (900, 999))
+        self.assertEqual(parse_byte_range("bytes=900-", 1000), (900, 999))
+        # Clamped to the file
+        self.assertEqual(parse_byte_range("bytes=0-99", 50), (0, 49))
+        self.assertEqual(parse_byte_range("bytes=-100", 50), (0, 49))
+
+    def test_unsatisfiable_ranges_raise(self):
+        for header in ("bytes=1000-", "bytes=1000-1100", "bytes=-0", "bytes=5-2"):
+            with self.subTest(header=header):
+                with self.assertRaises(ValueError):
+                    parse_byte_range(header, 1000)
+
+    def test_multi_range_and_malformed_headers_are_ignored(self):
+        for header in (None, "", "bytes=0-1,5-9", "bytes=-", "bytes=a-b", "items=0-99", "bytes 0-99"):
+            with self.subTest(header=header):
+                self.assertIsNone(parse_byte_range(header, 1000))
+
+
+class ProtectedFileResponseTests(SimpleTestCase):
+    CONTENT = bytes(range(256)) * 4
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        with open(f"{media_root.name}/invoice.pdf", "wb") as file:
+            file.write(self.CONTENT)
+        settings = override_settings(MEDIA_ROOT=media_root.name, PROTECTED_MEDIA_SERVER="django")
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.factory = RequestFactory()
+
+    def get(self, **headers):
+        request = self.factory.get("/", headers=headers)
+        response = protected_file_response(request, "invoice.pdf", "FV 1.pdf")
+        self.addCleanup(response.close)
+        return response
+
+    def body(self, response):
+        return b"".join(response.streaming_content)
+
+    def test_whole_file(self):
+        response = self.get()
+
+        self.assertIsInstance(response, FileResponse)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(self.body(response), self.CONTENT)
+
+    def test_first_bytes(self):
+        response = self.get(Range="bytes=0-99")
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 0-99/1024")
+        self.assertEqual(response["Content-Length"], "100")
+        self.assertEqual(self.body(response), self.CONTENT[:100])
+
+    def test_last_bytes(self):
+        response = self.get(Range="bytes=-100")
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 924-1023/1024")
+        self.assertEqual(self.body(response), self.CONTENT[-100:])
+
+    def test_start_past_the_end_is_416(self):
+        response = self.get(Range="bytes=2000-")
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */1024")
+
+    def test_multi_range_and_malformed_headers_send_the_whole_file(self):
+        for header in ("bytes=0-1,5-9", "bytes=x-y", "pages=1-2"):
+            with self.subTest(header=header):
+                response = self.get(Range=header)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.body(response), self.CONTENT)
+
+    def test_stale_if_range_sends_the_whole_file(self):
+        response = self.get(Range="bytes=0-99", **{"If-Range": "Mon, 01 Jan 2001 00:00:00 GMT"})
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_file_is_404(self):
+        with self.assertRaises(Http404):
+            protected_file_response(self.factory.get("/"), "missing.pdf", "missing.pdf")
+
+    @override_settings(PROTECTED_MEDIA_SERVER="nginx")
+    def test_nginx_serves_the_bytes(self):
+        response = protected_file_response(
+            self.factory.get("/", headers={"Range": "bytes=0-99"}), "invoice.pdf", "FV 1.pdf", as_attachment=True,
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-media/invoice.pdf")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="FV 1.pdf"')
+        self.assertEqual(response.content, b"")
+
+
+class OutlayXlsxExportTests(TestCase):
+    def setUp(self):
+        self.car = Car.objects.create(
+            mark="Toyota", model="Corolla", color="white", year=2020,
+            vin_code="JTDBR32E720000001", license_plate="WX1234A", mileage=1000,
+        )
+        self.fuel = create_outlay(
+            type="other", name="Paliwo", car=self.car, price_per_item=Decimal("6.50"), item_count=40,
+            category="fuel", comment="Orlen, ПДВ: 23",
+        )
+        self.service = create_outlay(
+            type="service", name="Przegląd", car=self.car, full_price=Decimal("450.00"), service_name="ASO",
+        )
+        Outlay.objects.filter(pk=self.service.pk).update(created_at=self.fuel.created_at + timedelta(minutes=1))
+
+    def read_back(self):
+        file = io.BytesIO()
+        rows = write_outlays_xlsx(outlay_export_links(), file)
+        file.seek(0)
+        return rows, load_workbook(file)["Витрати"]
+
+    def test_headers_and_rows(self):
+        rows, sheet = self.read_back()
+
+        self.assertEqual(rows, 2)
+        values = [list(row) for row in sheet.iter_rows(values_only=True)]
+        self.assertEqual(values[0], OUTLAY_EXPORT_HEADERS)
+        self.assertEqual(len(values), 3)
+
+        fuel = dict(zip(OUTLAY_EXPORT_HEADERS, values[1], strict=True))
+        self.assertEqual(fuel["Дата"], self.fuel.created_at.strftime("%d.%m.%Y"))
+        self.assertEqual(fuel["Тип витрати"], "Інші")
+        self.assertEqual(fuel["Категорія"], "Паливо")
+        self.assertEqual(fuel["Автомобіль"], "Toyota Corolla 2020")
+        self.assertEqual(fuel["Номерний знак"], "WX1234A")
+        self.assertEqual(fuel["Кількість"], 40)
+        self.assertEqual(fuel["Ціна за одиницю (PLN)"], 6.5)
+        self.assertEqual(fuel["Загальна сума (PLN)"], 260)
+        self.assertEqual(fuel["ПДВ %"], 23)
+        self.assertEqual(fuel["Коментар"], "Orlen, ПДВ: 23")
+
+        service = dict(zip(OUTLAY_EXPORT_HEADERS, values[2], strict=True))
+        self.assertEqual(service["Тип витрати"], "Сервіс")
+        self.assertEqual(service["Назва витрати"], "Przegląd")
+        self.assertEqual(service["Сервіс"], "ASO")
+        self.assertEqual(service["Загальна сума (PLN)"], 450)
+        self.assertIsNone(service["Кількість"])
+
+    def test_layout(self):
+        _, sheet = self.read_back()
+
+        self.assertEqual(sheet.freeze_panes, "A2")
+        self.assertTrue(sheet["A1"].font.bold)
+        self.assertEqual(sheet["I2"].alignment.horizontal, "right")
+        self.assertEqual(sheet["D2"].alignment.horizontal, "left")
+        # Widths come from the header or the longest value, capped at MAX_COLUMN_WIDTH
+        self.assertEqual(sheet.column_dimensions["H"].width, len("Номерний знак") + 2)
+
+
+class CsvFormulaInjectionTests(TestCase):
+    def test_streamed_cells_that_start_a_formula_are_quoted(self):
+        rows = [
+            ["=HYPERLINK(\"http://example.com\")", "+48 600", "-1", "@SUM(A1)", "\tTAB", "Olej 5W-30"],
+            [Decimal("-12.50"), -3, "", None, "a=b", "e-mail@example.com"],
+        ]
+
+        body = b"".join(stream_csv(["A", "B", "C", "D", "E", "F"], iter(rows))).decode("utf-8-sig")
+
+        self.assertEqual(
+            list(csv.reader(io.StringIO(body))),
+            [
+                ["A", "B", "C", "D", "E", "F"],
+                ["'=HYPERLINK(\"http://example.com\")", "'+48 600", "'-1", "'@SUM(A1)", "'\tTAB", "Olej 5W-30"],
+                # Numbers keep their sign
+                ["-12.50", "-3", "", "", "a=b", "e-mail@example.com"],
+            ],
+        )
+
+    def test_fleet_csv_export_is_escaped(self):
+        car = Car.objects.create(
+            mark="Toyota", model="Corolla", color="white", year=2020,
+            vin_code="JTDBR32E720000001", license_plate="WX1234A", mileage=1000,
+        )
+        create_outlay(
+            type="other", name="=1+2", car=car, full_price=Decimal("10.00"), category="fuel", comment="@admin",
+        )
+        exports_root = tempfile.TemporaryDirectory()
+        self.addCleanup(exports_root.cleanup)
+
+        with override_settings(EXPORTS_ROOT=exports_root.name):
+            result = run_outlay_export("job-1", {}, "csv")
+
+        with open(Path(exports_root.name) / result["file_path"], newline="", encoding="utf-8-sig") as file:
+            header, row = list(csv.reader(file))
+        self.assertEqual(header, OUTLAY_EXPORT_HEADERS)
+        row = dict(zip(header, row, strict=True))
+        self.assertEqual(row["Назва витрати"], "'=1+2")
+        self.assertEqual(row["Коментар"], "'@admin")
+        self.assertEqual(row["Загальна сума (PLN)"], "10.00")
+
+
+class OutlayExportStorageTests(SimpleTestCase):
+    def setUp(self):
+        self.media_root = Path(self.temp_dir())
+        self.exports_root = Path(self.temp_dir())
+        settings = override_settings(
+            MEDIA_ROOT=self.media_root, EXPORTS_ROOT=self.exports_root, EXPORT_RETENTION_DAYS=7,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def temp_dir(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return directory.name
+
+    def export_file(self, directory, name, age_days=0):
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / name
+        path.write_bytes(b"x")
+        stamp = time.time() - age_days * 86400
+        os.utime(path, (stamp, stamp))
+        return path
+
+    def test_expired_exports_are_purged(self):
+        fresh = self.export_file(self.exports_root, "fresh.xlsx", age_days=6)
+        expired = self.export_file(self.exports_root, "expired.csv", age_days=8)
+        leftover = self.export_file(self.exports_root, "tmp1234.part", age_days=8)
+        invoice = self.export_file(self.media_root / "invoices", "fv.pdf", age_days=30)
+
+        self.assertEqual(purge_old_exports(), 2)
+
+        self.assertTrue(fresh.exists())
+        self.assertTrue(invoice.exists())
+        self.assertFalse(expired.exists() or leftover.exists())
+
+    def test_export_is_written_outside_media(self):
+        expired = self.export_file(self.exports_root, "expired.csv", age_days=8)
+
+        with mock.patch("core.exports.fleet_export_links") as links, \
+                mock.patch("core.exports.write_outlays_csv", return_value=0):
+            links.return_value.count.return_value = 0
+            result = run_outlay_export("job-1", {}, "csv")
+
+        self.assertEqual(result["file_path"], "job-1.csv")
+        self.assertTrue((self.exports_root / "job-1.csv").is_file())
+        self.assertEqual(list(self.media_root.iterdir()), [])
+        self.assertFalse(expired.exists())
+
+
+class ParallelInvoiceParseTests(SimpleTestCase):
+    def test_parallel_pages_match_sequential_parse(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / "invoice.pdf"
+        expected = make_synthetic_invoice(path, pages=3, rows_per_page=10)
+
+        sequential = PDFCore(path, workers=1).parse()
+        with mock.patch("core.services.PDF_PARALLEL_MIN_PAGES_PYMUPDF", 2), \
+                self.assertLogs("core.services", "INFO") as logs:
+            parallel = PDFCore(path, workers=2).parse()
+
+        self.assertIn("Reading 3 pages with 2 workers", "\n".join(logs.output))
+
+        self.assertEqual(len(sequential["table"]), expected["rows"])
+        self.assertEqual(parallel, sequential)
+
+
+def sleep_forever(*args, **kwargs):
+    time.sleep(60)
+
+
+def spin(*args, **kwargs):
+    while True:
+        pass
+
+
+def spin_ignoring_sigxcpu(*args, **kwargs):
+    signal.signal(signal.SIGXCPU, signal.SIG_IGN)
+    spin()
+
+
+class SandboxLimitTests(SimpleTestCase):
+    def parse(self, target, **limits):
+        limits = {"timeout": 30, "cpu_seconds": 0, "memory_mb": 0, **limits}
+        with mock.patch("core.services.get_invoice_parser", side_effect=target):
+            return parse_invoice_file_sandboxed("invoice.pdf", **limits)
+
+    def test_wall_clock_timeout(self):
+        result = self.parse(sleep_forever, timeout=1)
+
+        self.assertEqual((result["status"], result["reason"]), ("error", "timeout"))
+        self.assertLess(result["duration_s"], 10)
+
+    def test_cpu_soft_limit(self):
+        result = self.parse(spin, cpu_seconds=1)
+
+        self.assertEqual((result["status"], result["reason"]), ("error", "cpu"))
+
+    def test_cpu_hard_limit_is_not_reported_as_memory(self):
+        with mock.patch("core.services.CPU_HARD_LIMIT_GRACE", 1):
+            result = self.parse(spin_ignoring_sigxcpu, cpu_seconds=1)
+
+        self.assertEqual((result["status"], result["reason"]), ("error", "cpu"))
+
+    def test_timeout_kills_processes_started_by_the_parse(self):
+        pid_file = Path(tempfile.mkdtemp()) / "pid"
+
+        def fork_and_sleep(*args, **kwargs):
+            pid = os.fork()
+            if pid == 0:
+                time.sleep(60)
+                os._exit(0)
+            pid_file.write_text(str(pid))
+            time.sleep(60)
+
+        self.parse(fork_and_sleep, timeout=1)
+
+        pid = int(pid_file.read_text())
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and process_running(pid):
+            time.sleep(0.1)
+        self.assertFalse(process_running(pid))
+
+
+def process_running(pid: int) -> bool:
+    """Alive and not a zombie waiting for init to reap it"""
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            return stat.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
@@ -21,6 +21,9 @@ urlpatterns = [
     path("services/delete/<uuid:pk>/", view.ServiceDeleteView.as_view(), name="service-delete"),
     path("services/<uuid:pk>/", view.ServiceDetailView.as_view(), name="service-detail"),
     path("outlay/", view.OutlayView.as_view(), name="outlay"),
+    path("outlay/export/", view.OutlayExportView.as_view(), name="outlay-export"),
+    path("outlay/export/<uuid:pk>/", view.OutlayExportDetailView.as_view(), name="outlay-export-detail"),
+    path("outlay/export/<uuid:pk>/download/", view.OutlayExportDownloadView.as_view(), name="outlay-export-download"),
     path("outlay/<uuid:pk>/", view.OutlatDetailView.as_view(), name="outlay_detail"),
     path("outlay/<uuid:pk>/delete", view.OutlayDeleteView.as_view(), name="outlay_delete"),
     path("car-service-plan/create/", view.CarServiceCreate.as_view(), name="car-service-plan-create"),
@@ -29,11 +32,20 @@ urlpatterns = [
     path("cars/<uuid:car_pk>/service-plan/service/<str:service_key>/update/", view.CarServiceUpdateView.as_view(), name="car-service-update"),
     path("cars/<uuid:pk>/outlays/", view.CarOutlaysView.as_view(), name="car-outlays"),
     path("cars/<uuid:pk>/outlays/export/", view.CarOutlaysExportView.as_view(), name="car-outlays-export"),
+    path("cars/<uuid:pk>/export/<slug:dataset>/", view.CarCsvExportView.as_view(), name="car-csv-export"),
     path("invoices/", view.InvoiceListView.as_view(), name="invoice-list"),
     path("invoices/upload/", view.InvoiceUploadView.as_view(), name="invoice-upload"),
+    path("invoices/batch/upload/", view.InvoiceBatchUploadView.as_view(), name="invoice-batch-upload"),
+    path("invoices/batch/<uuid:pk>/", view.InvoiceBatchDetailView.as_view(), name="invoice-batch-detail"),
     path("invoices/<uuid:pk>/", view.InvoiceDetailView.as_view(), name="invoice-detail"),
     path("invoices/<uuid:pk>/delete/", view.InvoiceDeleteView.as_view(), name="invoice-delete"),
+    path("invoices/<uuid:pk>/status/", view.InvoiceStatusView.as_view(), name="invoice-status"),
     path("invoice-items/<uuid:pk>/update/", view.InvoiceItemUpdateView.as_view(), name="invoice-item-update"),
     path("invoice-items/<uuid:pk>/delete/", view.InvoiceItemDeleteView.as_view(), name="invoice-item-delete"),
+    path(
+        "invoice-items/<uuid:pk>/confirm-car/",
+        view.InvoiceItemCarConfirmView.as_view(),
+        name="invoice-item-confirm-car",
+    ),
     path("notifications/", view.NotificationsView.as_view(), name="notifications"),
 ]
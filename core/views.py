@@ -20,7 +20,9 @@ from .forms import (
     OutlayFrom, 
     CarServiceForm,
     InvoiceUploadForm,
-    InvoiceItemForm
+    InvoiceBatchUploadForm,
+    InvoiceItemForm,
+    OutlayExportForm
 )
 from .models import (
     Car, 
@@ -31,14 +33,19 @@ from .models import (
     CarServiceState,
     ServiceEventSchema,
     Invoice,
+    InvoiceBatch,
     InvoiceItem,
     OutlayTypeChoice,
     OutlayCategoryChoice,
-    Notifications
+    Notifications,
+    BackgroundJob,
+    BackgroundJobTypeChoice,
+    BackgroundJobStatusChoice
 )
 from .services import create_outlay
 from django.utils import timezone
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse
 from django.core.exceptions import ValidationError
@@ -52,15 +59,22 @@ from .services import (
     update_car_with_photos, 
     delete_car, 
     get_outlay, 
+    get_outlays_page,
     create_outlay, 
     get_outlay_form_data, 
     update_outlay,
+    delete_outlay,
     save_or_update_car_service_state,
     create_service_events_from_services,
-    PDFCore,
     decode_unicode_escapes,
     create_car_service_plan,
+    create_invoice_for_upload,
+    create_invoice_batch,
+    get_invoice_batch_summary,
+    protected_file_response,
+    confirm_invoice_car_match,
 )
+from .jobs import enqueue_invoice_parse, enqueue_invoice_parses, enqueue_outlay_export
 from .constants import DEFAULT_SERVICE_SCHEMA
 
 logger = logging.getLogger(__name__)
@@ -133,22 +147,15 @@ class CarDetailView(LoginRequiredMixin, DetailView):
     model = Car
     template_name = "car/detail.html"
 
+    def get_queryset(self):
+        return Car.objects.with_outlays_total()
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["form"] = AddCarForm(instance=self.object)
         context["photos"] = CarPhoto.objects.filter(car=self.object)
-        # Get outlays for this car
-        outlays = Outlay.objects.filter(cars=self.object).select_related('amount').order_by('-created_at', '-updated_at')
-        context["outlays"] = outlays
-        
-        # Calculate total outlay amount
-        total = 0
-        for outlay in outlays:
-            if outlay.amount.full_price:
-                total += float(outlay.amount.full_price)
-            elif outlay.amount.price_per_item and outlay.amount.item_count:
-                total += float(outlay.amount.price_per_item) * int(outlay.amount.item_count)
-        context["outlays_total"] = total
+        # Outlay count and total come from the queryset annotation
+        context["outlays_total"] = self.object.outlays_total
         
         # Get car service state if exists
         try:
@@ -403,71 +410,18 @@ class OutlayView(LoginRequiredMixin, View):
     template_name = "outlay.html"
 
     def get(self, request):
-        # Get filter parameter
+        return self.render_list(request, OutlayFrom())
+
+    def render_list(self, request, form):
         filter_type = request.GET.get('type', 'all')  # all, service, other
         filter_category = request.GET.get('category', 'all')  # all, fuel, parts, documents, another
-        
-        # Get all outlays
-        outlays_qs = Outlay.objects.select_related('amount').prefetch_related('cars').order_by('-created_at', '-updated_at')
-        
-        # Apply type filter
-        if filter_type == 'service':
-            outlays_qs = outlays_qs.filter(type='service')
-        elif filter_type == 'other':
-            outlays_qs = outlays_qs.filter(type='other')
-        
-        # Apply category filter
-        if filter_category != 'all':
-            outlays_qs = outlays_qs.filter(category=filter_category)
-        
-        # Convert to list of dicts for template compatibility
-        outlays = []
-        for outlay in outlays_qs:
-            cars_list = list(outlay.cars.all())
-            if cars_list:
-                for car in cars_list:
-                    outlays.append({
-                        'uuid': outlay.uuid,
-                        'type': outlay.type,
-                        'category': outlay.category,
-                        'category_name': outlay.category_name,
-                        'service_name': outlay.service_name,
-                        'name': outlay.name,
-                        'comment': outlay.comment,
-                        'description': outlay.description,  # For backward compatibility
-                        'created_at': outlay.created_at,
-                        'updated_at': outlay.updated_at,
-                        'cars__mark': car.mark,
-                        'cars__model': car.model,
-                        'cars__license_plate': car.license_plate,
-                        'amount__price_per_item': outlay.amount.price_per_item,
-                        'amount__item_count': outlay.amount.item_count,
-                        'amount__full_price': outlay.amount.full_price,
-                    })
-            else:
-                # If no cars associated, still show the outlay
-                outlays.append({
-                    'uuid': outlay.uuid,
-                    'type': outlay.type,
-                    'category': outlay.category,
-                    'category_name': outlay.category_name,
-                    'service_name': outlay.service_name,
-                    'name': outlay.name,
-                    'comment': outlay.comment,
-                    'description': outlay.description,  # For backward compatibility
-                    'created_at': outlay.created_at,
-                    'updated_at': outlay.updated_at,
-                    'cars__mark': '',
-                    'cars__model': '',
-                    'cars__license_plate': '',
-                    'amount__price_per_item': outlay.amount.price_per_item,
-                    'amount__item_count': outlay.amount.item_count,
-                    'amount__full_price': outlay.amount.full_price,
-                })
+        page = get_outlays_page(filter_type, filter_category, after=request.GET.get('after'))
         
         context = {
-            "outlays": outlays,
-            "form": OutlayFrom(),
+            "outlays": page["outlays"],
+            "next_cursor": page["next_cursor"],
+            "is_first_page": not request.GET.get('after'),
+            "form": form,
             "filter_type": filter_type,
             "filter_category": filter_category,
         }
@@ -483,98 +437,14 @@ class OutlayView(LoginRequiredMixin, View):
         
         if not form.is_valid():
             # If form is invalid, render with errors
-            filter_type = request.GET.get('type', 'all')
-            filter_category = request.GET.get('category', 'all')
-            outlays_qs = Outlay.objects.select_related('amount').prefetch_related('cars').order_by('-created_at', '-updated_at')
-            
-            if filter_type == 'service':
-                outlays_qs = outlays_qs.filter(type='service')
-            elif filter_type == 'other':
-                outlays_qs = outlays_qs.filter(type='other')
-            
-            if filter_category != 'all':
-                outlays_qs = outlays_qs.filter(category=filter_category)
-            
-            outlays = []
-            for outlay in outlays_qs:
-                cars_list = list(outlay.cars.all())
-                if cars_list:
-                    for car in cars_list:
-                        outlays.append({
-                            'uuid': outlay.uuid,
-                            'type': outlay.type,
-                            'category': outlay.category,
-                            'category_name': outlay.category_name,
-                            'service_name': outlay.service_name,
-                            'name': outlay.name,
-                            'comment': outlay.comment,
-                            'description': outlay.description,
-                            'created_at': outlay.created_at,
-                            'updated_at': outlay.updated_at,
-                            'cars__mark': car.mark,
-                            'cars__model': car.model,
-                            'cars__license_plate': car.license_plate,
-                            'amount__price_per_item': outlay.amount.price_per_item,
-                            'amount__item_count': outlay.amount.item_count,
-                            'amount__full_price': outlay.amount.full_price,
-                        })
-            
-            context = {
-                "outlays": outlays,
-                "form": form,
-                "filter_type": filter_type,
-                "filter_category": filter_category,
-            }
-            return render(request, self.template_name, context)
+            return self.render_list(request, form)
         
         cd = form.cleaned_data
         
         # Validate name for service type
         if cd['service_type'] == 'service' and not cd.get('name'):
             form.add_error('name', 'Назва витрати обов\'язкова для типу "Сервіс"')
-            filter_type = request.GET.get('type', 'all')
-            filter_category = request.GET.get('category', 'all')
-            outlays_qs = Outlay.objects.select_related('amount').prefetch_related('cars').order_by('-created_at', '-updated_at')
-            
-            if filter_type == 'service':
-                outlays_qs = outlays_qs.filter(type='service')
-            elif filter_type == 'other':
-                outlays_qs = outlays_qs.filter(type='other')
-            
-            if filter_category != 'all':
-                outlays_qs = outlays_qs.filter(category=filter_category)
-            
-            outlays = []
-            for outlay in outlays_qs:
-                cars_list = list(outlay.cars.all())
-                if cars_list:
-                    for car in cars_list:
-                        outlays.append({
-                            'uuid': outlay.uuid,
-                            'type': outlay.type,
-                            'category': outlay.category,
-                            'category_name': outlay.category_name,
-                            'service_name': outlay.service_name,
-                            'name': outlay.name,
-                            'comment': outlay.comment,
-                            'description': outlay.description,
-                            'created_at': outlay.created_at,
-                            'updated_at': outlay.updated_at,
-                            'cars__mark': car.mark,
-                            'cars__model': car.model,
-                            'cars__license_plate': car.license_plate,
-                            'amount__price_per_item': outlay.amount.price_per_item,
-                            'amount__item_count': outlay.amount.item_count,
-                            'amount__full_price': outlay.amount.full_price,
-                        })
-            
-            context = {
-                "outlays": outlays,
-                "form": form,
-                "filter_type": filter_type,
-                "filter_category": filter_category,
-            }
-            return render(request, self.template_name, context)
+            return self.render_list(request, form)
         
         # Create outlay using service function
         outlay = create_outlay(
@@ -602,36 +472,13 @@ class OutlatDetailView(LoginRequiredMixin, View):
     def get(self, request, pk):
         outlay = get_outlay(pk)
         
-        # Try to find related invoice from comment
-        invoice = None
-        if outlay.comment and "Автоматично створено з фактури:" in outlay.comment:
-            import re
-            match = re.search(r'Автоматично створено з фактури:\s*([^,]+)', outlay.comment)
-            if match:
-                invoice_name = match.group(1).strip()
-                try:
-                    invoice = Invoice.objects.filter(name=invoice_name).first()
-                except Exception as e:
-                    logger.exception(f"Error finding invoice for outlay {pk}: {e}")
+        # Invoice the outlay was created from, joined by get_outlay()
+        invoice = outlay.invoice_item.invoice if outlay.invoice_item else None
         
         # Handle invoice PDF download
         if request.GET.get('download_invoice') == 'true' and invoice:
-            from django.http import Http404, HttpResponse
-            from django.conf import settings
-            import os
-            
-            file_path = Path(settings.MEDIA_ROOT) / invoice.file_path
-            if not file_path.exists():
-                raise Http404("PDF файл не знайдено")
-            
-            filename = os.path.basename(invoice.file_path)
-            
-            with open(file_path, 'rb') as f:
-                file_content = f.read()
-            
-            response = HttpResponse(file_content, content_type='application/pdf')
-            response['Content-Disposition'] = f'attachment; filename="{filename}"'
-            return response
+            filename = invoice.original_filename or os.path.basename(invoice.file_path)
+            return protected_file_response(request, invoice.file_path, filename, as_attachment=True)
         
         # Check if edit mode is requested
         edit_mode = request.GET.get('edit', 'false').lower() == 'true'
@@ -739,7 +586,7 @@ class OutlayDeleteView(LoginRequiredMixin, View):
                 cars = list(outlay.cars.all())
                 car_uuid = cars[0].uuid if cars else None
             
-            outlay.delete()
+            delete_outlay(outlay)
             
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                 return JsonResponse({
@@ -1007,20 +854,15 @@ class CarOutlaysView(LoginRequiredMixin, DetailView):
     template_name = "car/outlays.html"
     context_object_name = "car"
 
+    def get_queryset(self):
+        return Car.objects.with_outlays_total()
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         # Get outlays for this car
         outlays = Outlay.objects.filter(cars=self.object).select_related('amount').order_by('-created_at', '-updated_at')
         context["outlays"] = outlays
-        
-        # Calculate total outlay amount
-        total = 0
-        for outlay in outlays:
-            if outlay.amount.full_price:
-                total += float(outlay.amount.full_price)
-            elif outlay.amount.price_per_item and outlay.amount.item_count:
-                total += float(outlay.amount.price_per_item) * int(outlay.amount.item_count)
-        context["outlays_total"] = total
+        context["outlays_total"] = self.object.outlays_total
         
         return context
 
@@ -1034,146 +876,19 @@ class CarOutlaysExportView(LoginRequiredMixin, View):
         except Car.DoesNotExist:
             return redirect('cars')
         
-        # Get outlays for this car
-        outlays = Outlay.objects.filter(cars=car).select_related('amount').order_by('created_at')
-        
-        # Create Excel file
+        # Write the workbook to a temp file, FileResponse streams it in chunks and closes (deletes) it
         try:
-            import openpyxl
-            from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-            from openpyxl.utils import get_column_letter
-            from django.http import HttpResponse
+            from .exports import XLSX_CONTENT_TYPE, outlay_export_links, write_outlays_xlsx
+            from django.http import FileResponse
             from datetime import datetime
             
-            wb = openpyxl.Workbook()
-            ws = wb.active
-            ws.title = "Витрати"
-            
-            # Header style
-            header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-            header_font = Font(bold=True, color="FFFFFF", size=12)
-            border_style = Border(
-                left=Side(style='thin'),
-                right=Side(style='thin'),
-                top=Side(style='thin'),
-                bottom=Side(style='thin')
-            )
-            
-            # Headers for Financial Director and Accountant
-            headers = [
-                "Дата",
-                "Тип витрати",
-                "Категорія",
-                "Назва витрати",
-                "Сервіс",
-                "Автомобіль",
-                "VIN код",
-                "Номерний знак",
-                "Кількість",
-                "Ціна за одиницю (PLN)",
-                "Загальна сума (PLN)",
-                "ПДВ %",
-                "Сума ПДВ (PLN)",
-                "Коментар",
-                "Створено",
-                "Оновлено"
-            ]
-            
-            # Write headers
-            for col_num, header in enumerate(headers, 1):
-                cell = ws.cell(row=1, column=col_num, value=header)
-                cell.fill = header_fill
-                cell.font = header_font
-                cell.alignment = Alignment(horizontal='center', vertical='center')
-                cell.border = border_style
-            
-            # Write data
-            for row_num, outlay in enumerate(outlays, 2):
-                car_obj = outlay.cars.first()
-                
-                # Calculate values from OutlayAmount structure
-                # Priority: use what's stored, calculate if needed
-                price_per_item = float(outlay.amount.price_per_item) if outlay.amount.price_per_item else None
-                item_count = float(outlay.amount.item_count) if outlay.amount.item_count else None
-                total_price = float(outlay.amount.full_price) if outlay.amount.full_price else None
-                
-                # If total_price is missing but we have price_per_item and item_count, calculate it
-                if not total_price and price_per_item and item_count:
-                    total_price = price_per_item * item_count
-                
-                # If price_per_item is missing but we have total_price and item_count, calculate it
-                if not price_per_item and total_price and item_count and item_count > 0:
-                    price_per_item = total_price / item_count
-                
-                # If item_count is missing but we have total_price and price_per_item, calculate it
-                if not item_count and total_price and price_per_item and price_per_item > 0:
-                    item_count = total_price / price_per_item
-                
-                # Extract tax info if available (from comment or other sources)
-                tax_percent = None
-                tax_price = None
-                if outlay.comment:
-                    import re
-                    tax_match = re.search(r'ПДВ[:\s]+(\d+(?:\.\d+)?)', outlay.comment, re.IGNORECASE)
-                    if tax_match:
-                        tax_percent = float(tax_match.group(1))
-                
-                # Get display values
-                type_display = dict(OutlayTypeChoice.choices).get(outlay.type, outlay.type)
-                category_display = ""
-                if outlay.category:
-                    category_display = dict(OutlayCategoryChoice.choices).get(outlay.category, outlay.category)
-                elif outlay.category_name:
-                    category_display = outlay.category_name
-                
-                row_data = [
-                    outlay.created_at.strftime("%d.%m.%Y") if outlay.created_at else "",
-                    type_display,
-                    category_display,
-                    outlay.name or "",
-                    outlay.service_name or "",
-                    f"{car_obj.mark} {car_obj.model} {car_obj.year}" if car_obj else "",
-                    car_obj.vin_code if car_obj else "",
-                    car_obj.license_plate if car_obj else "",
-                    item_count if item_count else "",
-                    price_per_item if price_per_item else "",
-                    total_price if total_price else "",
-                    tax_percent if tax_percent else "",
-                    tax_price if tax_price else "",
-                    outlay.comment or "",
-                    outlay.created_at.strftime("%d.%m.%Y %H:%M") if outlay.created_at else "",
-                    outlay.updated_at.strftime("%d.%m.%Y %H:%M") if outlay.updated_at else "",
-                ]
-                
-                for col_num, value in enumerate(row_data, 1):
-                    cell = ws.cell(row=row_num, column=col_num, value=value)
-                    cell.border = border_style
-                    if col_num in [9, 10, 11, 12, 13]:  # Numeric columns
-                        cell.alignment = Alignment(horizontal='right', vertical='center')
-                    else:
-                        cell.alignment = Alignment(horizontal='left', vertical='center')
-            
-            # Auto-adjust column widths
-            for col_num, header in enumerate(headers, 1):
-                column_letter = get_column_letter(col_num)
-                max_length = len(header)
-                for row in ws[column_letter]:
-                    if row.value:
-                        max_length = max(max_length, len(str(row.value)))
-                ws.column_dimensions[column_letter].width = min(max_length + 2, 50)
-            
-            # Freeze first row
-            ws.freeze_panes = 'A2'
-            
-            # Create response
-            response = HttpResponse(
-                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
-            filename = f"Витрати_{car.mark}_{car.model}_{car.year}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-            response['Content-Disposition'] = f'attachment; filename="{filename}"'
-            
-            wb.save(response)
-            return response
+            export_file = tempfile.TemporaryFile()  # noqa: SIM115 - closed (and deleted) by FileResponse
+            try:
+                write_outlays_xlsx(outlay_export_links(car=car), export_file)
+            except Exception:
+                export_file.close()
+                raise
+            export_file.seek(0)
             
         except ImportError:
             # If openpyxl is not installed, return error message
@@ -1185,6 +900,102 @@ class CarOutlaysExportView(LoginRequiredMixin, View):
             from django.contrib import messages
             messages.error(request, f'Помилка експорту: {str(e)}')
             return redirect('car-outlays', pk=pk)
+        
+        filename = f"Витрати_{car.mark}_{car.model}_{car.year}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        return FileResponse(export_file, as_attachment=True, filename=filename, content_type=XLSX_CONTENT_TYPE)
+
+
+class OutlayExportView(LoginRequiredMixin, View):
+    """Fleet-wide outlay export: the file is written by a job worker, the page only queues it"""
+    template_name = "outlay_export/create.html"
+
+    def get(self, request):
+        return self.render_page(request, OutlayExportForm())
+
+    def post(self, request):
+        form = OutlayExportForm(request.POST)
+        if not form.is_valid():
+            return self.render_page(request, form)
+
+        job = enqueue_outlay_export(form.get_filters(), form.cleaned_data["format"])
+        return redirect("outlay-export-detail", pk=job.uuid)
+
+    def render_page(self, request, form):
+        return render(request, self.template_name, {
+            "form": form,
+            "exports": BackgroundJob.objects.filter(
+                job_type=BackgroundJobTypeChoice.OUTLAY_EXPORT
+            ).order_by("-created_at")[:10],
+        })
+
+
+class OutlayExportDetailView(LoginRequiredMixin, DetailView):
+    """Export job status, the page reloads until the file is ready"""
+    template_name = "outlay_export/detail.html"
+    context_object_name = "job"
+
+    def get_queryset(self):
+        return BackgroundJob.objects.filter(job_type=BackgroundJobTypeChoice.OUTLAY_EXPORT)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        filters = self.object.payload.get("filters", {})
+        owner = Owner.objects.filter(uuid=filters["owner"]).first() if filters.get("owner") else None
+        context.update({
+            "filters": filters,
+            "owner": owner,
+            "type_display": dict(OutlayTypeChoice.choices).get(filters.get("type")),
+            "category_display": dict(OutlayCategoryChoice.choices).get(filters.get("category")),
+            "is_pending": self.object.status in (BackgroundJobStatusChoice.QUEUED, BackgroundJobStatusChoice.RUNNING),
+            # Files are deleted after EXPORT_RETENTION_DAYS
+            "file_available": bool(self.object.result) and (
+                Path(settings.EXPORTS_ROOT) / self.object.result.get("file_path", "")
+            ).is_file(),
+            "retention_days": settings.EXPORT_RETENTION_DAYS,
+        })
+        return context
+
+
+class OutlayExportDownloadView(LoginRequiredMixin, View):
+    def get(self, request, pk):
+        from .exports import EXPORT_FORMATS
+
+        job = get_object_or_404(
+            BackgroundJob,
+            uuid=pk,
+            job_type=BackgroundJobTypeChoice.OUTLAY_EXPORT,
+            status=BackgroundJobStatusChoice.DONE,
+        )
+        return protected_file_response(
+            request,
+            job.result["file_path"],
+            job.result["filename"],
+            as_attachment=True,
+            content_type=EXPORT_FORMATS[job.result["format"]],
+            root=settings.EXPORTS_ROOT,
+            internal_url=settings.EXPORTS_INTERNAL_URL,
+        )
+
+
+class CarCsvExportView(LoginRequiredMixin, View):
+    """
+    Car outlays, invoice items or service events as CSV (?format=tsv for TSV),
+    streamed row by row from the database cursor
+    """
+
+    def get(self, request, pk, dataset):
+        from .exports import CAR_CSV_DATASETS, CSV_DIALECTS, stream_car_csv
+
+        car = get_object_or_404(Car, uuid=pk)
+        fmt = request.GET.get("format", "csv")
+        if dataset not in CAR_CSV_DATASETS or fmt not in CSV_DIALECTS:
+            raise Http404("Unknown export")
+
+        content_type, prefix, body = stream_car_csv(car, dataset, fmt)
+        filename = f"{prefix}_{car.mark}_{car.model}_{car.year}_{timezone.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+        response = StreamingHttpResponse(body, content_type=f"{content_type}; charset=utf-8")
+        response["Content-Disposition"] = content_disposition_header(True, filename)
+        return response
 
 
 class ServiceEventSchemaDefaultView(LoginRequiredMixin, TemplateView):
@@ -1234,170 +1045,74 @@ class InvoiceUploadView(LoginRequiredMixin, View):
         pdf_file = form.cleaned_data["pdf_file"]
         name = form.cleaned_data.get("name") or pdf_file.name
 
-        # ---------- save file ----------
-        upload_dir = Path(settings.MEDIA_ROOT) / "invoices"
-        upload_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            invoice, created = create_invoice_for_upload(pdf_file, name)
+            if created:
+                enqueue_invoice_parse(invoice)
+        except Exception as e:
+            logger.exception("Error saving invoice PDF")
+            form.add_error("pdf_file", f"Помилка обробки PDF: {e}")
+            return render(request, self.template_name, {"form": form})
+
+        if not created:
+            return redirect(f"{reverse('invoice-detail', kwargs={'pk': invoice.uuid})}?duplicate=1")
+        return redirect("invoice-detail", pk=invoice.uuid)
 
-        file_path = upload_dir / pdf_file.name
-        with open(file_path, "wb+") as f:
-            for chunk in pdf_file.chunks():
-                f.write(chunk)
 
-        # ---------- parse ----------
+class InvoiceBatchUploadView(LoginRequiredMixin, View):
+    """Several PDFs or a ZIP archive at once, every invoice is parsed by the job workers in parallel"""
+    template_name = "invoice/batch_upload.html"
+
+    def get(self, request):
+        return render(request, self.template_name, {
+            "form": InvoiceBatchUploadForm()
+        })
+
+    def post(self, request):
+        form = InvoiceBatchUploadForm(request.POST, request.FILES)
+        if not form.is_valid():
+            return render(request, self.template_name, {"form": form})
+
         try:
-            parser = PDFCore(file_path)
-            parsed_data = parser.parse()
-
-            table_data = parsed_data.get("table", [])
-            if not table_data:
-                logger.warning("No table data found", extra={"parsed_data": parsed_data})
-                form.add_error(
-                    "pdf_file",
-                    "Не вдалося знайти позиції у фактурі. Формат PDF не підтримується."
-                )
-                return render(request, self.template_name, {"form": form})
+            batch, invoices = create_invoice_batch(form.cleaned_data["files"], form.cleaned_data.get("name"))
+            enqueue_invoice_parses(invoices)
+        except Exception as e:
+            logger.exception("Error saving invoice batch")
+            form.add_error("files", f"Помилка обробки файлів: {e}")
+            return render(request, self.template_name, {"form": form})
 
-            # ---------- create invoice ----------
-            invoice = Invoice.objects.create(
-                name=name,
-                file_path=str(file_path.relative_to(settings.MEDIA_ROOT)),
-                invoice_data=parsed_data,
-            )
+        return redirect("invoice-batch-detail", pk=batch.uuid)
 
-            total_amount = Decimal("0")
 
-            def to_decimal(val, default="0"):
-                if not val:
-                    return Decimal(default)
-                if isinstance(val, (int, float)):
-                    return Decimal(str(val))
-                return Decimal(str(val).replace(" ", "").replace(",", "."))
+class InvoiceBatchDetailView(LoginRequiredMixin, DetailView):
+    model = InvoiceBatch
+    template_name = "invoice/batch_detail.html"
+    context_object_name = "batch"
 
-            # ---------- create items ----------
-            validation_errors_summary = {}
-            SERVICE_GAS_UUID = "63d70638-32be-4959-8496-598a0c651f9d"
-            car_matches = {}  # Store car matches for UI display
-            
-            # Get ServiceGas
-            try:
-                service_gas = Service.objects.get(uuid=SERVICE_GAS_UUID)
-            except Service.DoesNotExist:
-                logger.warning(f"ServiceGas with UUID {SERVICE_GAS_UUID} not found")
-                service_gas = None
-            
-            def find_car_by_vin_or_plate(vin_or_plate):
-                """Find car by VIN code or license plate"""
-                if not vin_or_plate:
-                    return None
-                
-                vin_or_plate = vin_or_plate.strip()
-                if not vin_or_plate:
-                    return None
-                
-                # Try to find by VIN code first
-                car = Car.objects.filter(vin_code__iexact=vin_or_plate).first()
-                if car:
-                    return car
-                
-                # Try to find by license plate
-                car = Car.objects.filter(license_plate__iexact=vin_or_plate).first()
-                if car:
-                    return car
-                
-                return None
-            
-            for row in table_data:
-                try:
-                    price_netto = to_decimal(row.get("price_netto"))
-                    tax_price = to_decimal(row.get("tax_price"))
-                    price_brutto = to_decimal(row.get("price_brutto"))
-                    
-                    # Clean item_name from Unicode escape sequences if any
-                    item_name = row.get("item_name", "")
-                    if item_name:
-                        # Decode any remaining Unicode escapes
-                        item_name = item_name.encode().decode('unicode_escape') if '\\u' in item_name else item_name
-                    
-                    current_car_vin = row.get("current_car_vin")
-                    
-                    item = InvoiceItem.objects.create(
-                        invoice=invoice,
-                        item_id=str(row.get("id")),
-                        item_name=item_name[:1000] if item_name else "",  # Ensure max length
-                        amount=to_decimal(row.get("amount", "1")),
-                        price_netto=price_netto,
-                        tax_percent=to_decimal(row.get("tax_percent", "23")),
-                        tax_price=tax_price,
-                        price_brutto=price_brutto,
-                        current_car_vin=current_car_vin,
-                    )
-                    
-                    # Try to find car and create outlay
-                    car = None
-                    if current_car_vin:
-                        car = find_car_by_vin_or_plate(current_car_vin)
-                        if car:
-                            car_matches[str(item.uuid)] = {
-                                'car_uuid': str(car.uuid),
-                                'car_name': f"{car.mark} {car.model} {car.year}",
-                                'vin_or_plate': current_car_vin
-                            }
-                            
-                            # Create outlay for this item
-                            if service_gas:
-                                try:
-                                    outlay = create_outlay(
-                                        type='service',
-                                        name=item_name[:255] if item_name else f"Витрата з фактури {invoice.name}",
-                                        car=car,
-                                        price_per_item=float(price_netto),
-                                        item_count=float(item.amount),
-                                        created_at=invoice.created_at or timezone.now(),
-                                        full_price=float(price_brutto),
-                                        service_name=service_gas.name,
-                                        comment=f"Автоматично створено з фактури: {invoice.name}, позиція: {item.item_id}",
-                                    )
-                                    logger.info(f"Created outlay {outlay.uuid} for car {car.uuid} from invoice item {item.uuid}")
-                                except Exception as e:
-                                    logger.exception(f"Error creating outlay for invoice item {item.uuid}: {e}")
-                        else:
-                            # Car not found
-                            car_matches[str(item.uuid)] = {
-                                'car_found': False,
-                                'vin_or_plate': current_car_vin
-                            }
-                    
-                    # Store validation errors if any
-                    if row.get("validation_errors"):
-                        validation_errors_summary[str(item.uuid)] = row["validation_errors"]
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(get_invoice_batch_summary(self.object))
+        return context
 
-                    total_amount += price_brutto
 
-                except Exception as e:
-                    logger.exception("Error creating invoice item", extra={"row": row})
-                    continue
+class InvoiceStatusView(LoginRequiredMixin, View):
+    """Parsing progress of an uploaded invoice, polled by the detail page"""
 
-            invoice.invoice_amount = total_amount
-            invoice.save(update_fields=["invoice_amount"])
-            
-            # Store validation errors, total validation, and car matches in invoice_data
-            if validation_errors_summary or parsed_data.get("total_validation_error") or car_matches:
-                if not invoice.invoice_data:
-                    invoice.invoice_data = {}
-                if validation_errors_summary:
-                    invoice.invoice_data["validation_errors"] = validation_errors_summary
-                if parsed_data.get("total_validation_error"):
-                    invoice.invoice_data["total_validation_error"] = parsed_data["total_validation_error"]
-                if car_matches:
-                    invoice.invoice_data["car_matches"] = car_matches
-                invoice.save(update_fields=["invoice_data"])
-
-            return redirect("invoice-detail", pk=invoice.uuid)
+    def get(self, request, pk):
+        invoice = get_object_or_404(Invoice, uuid=pk)
+        job = invoice.jobs.order_by("-created_at").first()
 
-        except Exception as e:
-            logger.exception("Error parsing invoice PDF")
-            form.add_error("pdf_file", f"Помилка обробки PDF: {e}")
-            return render(request, self.template_name, {"form": form})
+        return JsonResponse({
+            "status": invoice.status,
+            "status_display": invoice.get_status_display(),
+            "progress": job.progress if job else 100,
+            "message": job.progress_message if job else "",
+            "job_status": job.status if job else None,
+            "attempts": job.attempts if job else 0,
+            "error": invoice.parse_error,
+            "items_count": invoice.items.count(),
+            "parse_stats": invoice.parse_stats,
+        })
 
 
 class NotificationsView(LoginRequiredMixin, TemplateView):
@@ -1569,30 +1284,13 @@ class InvoiceDetailView(LoginRequiredMixin, DetailView):
         # Handle PDF viewing/downloading
         pdf_action = request.GET.get('pdf')
         if pdf_action in ('view', 'download'):
-            from django.http import FileResponse, Http404, HttpResponse
-            from django.conf import settings
-            import os
-            
-            file_path = Path(settings.MEDIA_ROOT) / self.object.file_path
-            if not file_path.exists():
-                raise Http404("PDF файл не знайдено")
-            
-            filename = os.path.basename(self.object.file_path)
-            
-            # Read file content
-            with open(file_path, 'rb') as f:
-                file_content = f.read()
-            
-            # Create response
-            if pdf_action == 'download':
-                response = HttpResponse(file_content, content_type='application/pdf')
-                response['Content-Disposition'] = f'attachment; filename="{filename}"'
-            else:
-                response = HttpResponse(file_content, content_type='application/pdf')
-                response['Content-Disposition'] = f'inline; filename="{filename}"'
+            filename = self.object.original_filename or os.path.basename(self.object.file_path)
+            response = protected_file_response(
+                request, self.object.file_path, filename, as_attachment=pdf_action == 'download'
+            )
+            if pdf_action == 'view':
                 # Allow embedding in iframe - override middleware X-Frame-Options
                 response['X-Frame-Options'] = 'SAMEORIGIN'
-            
             return response
         
         return super().get(request, *args, **kwargs)
@@ -1604,29 +1302,6 @@ class InvoiceDetailView(LoginRequiredMixin, DetailView):
         items_list = list(self.object.items.all())
         items_list.sort(key=lambda x: int(x.item_id) if x.item_id.isdigit() else float('inf'))
         
-        # Decode Unicode escape sequences in item names for existing records
-        # Create a wrapper to store decoded names without modifying the model
-        class ItemWrapper:
-            def __init__(self, item):
-                self._item = item
-                # Always decode Unicode escapes in item_name (even if not visible in DB)
-                # This handles cases where text is stored correctly but displayed with escapes
-                if item.item_name:
-                    # Decode any Unicode escape sequences
-                    decoded_name = decode_unicode_escapes(item.item_name)
-                    # If decoding changed something, use decoded version
-                    if decoded_name != item.item_name:
-                        self.item_name = decoded_name
-                    else:
-                        self.item_name = item.item_name
-                else:
-                    self.item_name = item.item_name
-                
-            def __getattr__(self, name):
-                return getattr(self._item, name)
-        
-        items_list = [ItemWrapper(item) for item in items_list]
-        
         context['items'] = items_list
         context['form'] = InvoiceItemForm()
         
@@ -1636,6 +1311,11 @@ class InvoiceDetailView(LoginRequiredMixin, DetailView):
             validation_errors = self.object.invoice_data.get("validation_errors", {})
         context['validation_errors'] = validation_errors
         
+        # Rows and outlays skipped on ingest because the database would reject their values
+        invoice_data = self.object.invoice_data if isinstance(self.object.invoice_data, dict) else {}
+        context['rejected_rows'] = invoice_data.get("rejected_rows", {})
+        context['rejected_outlays'] = invoice_data.get("rejected_outlays", {})
+        
         # Get car matches from invoice_data and convert UUID keys to strings for template
         car_matches = {}
         if self.object.invoice_data and isinstance(self.object.invoice_data, dict):
@@ -1678,7 +1358,10 @@ class InvoiceItemUpdateView(LoginRequiredMixin, View):
         form = InvoiceItemForm(request.POST, instance=item)
         
         if form.is_valid():
-            form.save()
+            item = form.save(commit=False)
+            # Names are stored decoded, the detail page renders them as is
+            item.item_name = decode_unicode_escapes(item.item_name)
+            item.save()
             return JsonResponse({
                 'status': 'ok',
                 'message': 'Позицію успішно оновлено'
@@ -1690,6 +1373,30 @@ class InvoiceItemUpdateView(LoginRequiredMixin, View):
         }, status=400)
 
 
+class InvoiceItemCarConfirmView(LoginRequiredMixin, View):
+    """Book an invoice line on the car suggested by a VIN suffix or edit-distance match"""
+
+    def post(self, request, pk):
+        try:
+            item = InvoiceItem.objects.get(uuid=pk)
+        except InvoiceItem.DoesNotExist:
+            return JsonResponse({
+                'status': 'error',
+                'errors': {'__all__': ['Позицію не знайдено']}
+            }, status=404)
+
+        if confirm_invoice_car_match(item) is None:
+            return JsonResponse({
+                'status': 'error',
+                'errors': {'__all__': ['Не вдалося створити витрату для цієї позиції']}
+            }, status=400)
+
+        return JsonResponse({
+            'status': 'ok',
+            'message': 'Машину підтверджено, витрату створено'
+        })
+
+
 class InvoiceItemDeleteView(LoginRequiredMixin, View):
     def post(self, request, pk):
         try:
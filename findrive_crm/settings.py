@@ -199,6 +199,34 @@ STATICFILES_DIRS = [
 STATIC_ROOT = BASE_DIR / "staticfiles"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
+# Who sends protected media (invoice PDFs) after the view has checked access:
+# "django" streams it with FileResponse, "nginx" hands it off via X-Accel-Redirect
+# to the internal location below (see nginx/conf.d/findrive.conf)
+PROTECTED_MEDIA_SERVER = os.getenv("PROTECTED_MEDIA_SERVER", "django")
+PROTECTED_MEDIA_INTERNAL_URL = "/protected-media/"
+# Fleet outlay exports: kept outside MEDIA_ROOT (nginx serves /media/ to anyone) and
+# downloaded only through the export view, with nginx via the internal location below
+EXPORTS_ROOT = Path(os.getenv("EXPORTS_ROOT", BASE_DIR / "exports"))
+EXPORTS_INTERNAL_URL = "/protected-exports/"
+# Export files older than this are deleted whenever a new export runs
+EXPORT_RETENTION_DAYS = int(os.getenv("EXPORT_RETENTION_DAYS", 7))
+
+# Invoice PDF parsing: process pool size for page-parallel table extraction (1 = sequential).
+# Job workers and reparse_invoices already parse invoices in parallel, and the parse
+# sandbox always runs in one process, so this only matters for direct PDFCore use
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", 1))
+# Limits of the sandboxed parse process: wall clock and CPU seconds, extra address space in MB (0 = no limit)
+PDF_PARSE_TIMEOUT = int(os.getenv("PDF_PARSE_TIMEOUT", 90))
+PDF_PARSE_CPU_SECONDS = int(os.getenv("PDF_PARSE_CPU_SECONDS", 60))
+PDF_PARSE_MAX_MEMORY_MB = int(os.getenv("PDF_PARSE_MAX_MEMORY_MB", 1024))
+# Parallel processes of `run_job_worker`, each parses one invoice at a time
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", os.cpu_count() or 1))
+
+# Batch invoice upload: files per batch (PDFs + ZIP members) and max size of one PDF inside a ZIP
+INVOICE_BATCH_MAX_FILES = int(os.getenv("INVOICE_BATCH_MAX_FILES", 300))
+INVOICE_BATCH_MAX_FILE_SIZE = int(os.getenv("INVOICE_BATCH_MAX_FILE_SIZE", 50 * 1024 * 1024))
+# Multi-file upload field of the batch form sends one request field per file (Django default is 100)
+DATA_UPLOAD_MAX_NUMBER_FILES = INVOICE_BATCH_MAX_FILES
 
 # Session settings
 SESSION_COOKIE_AGE = 86400  # 24 hours